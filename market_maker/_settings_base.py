@@ -21,6 +21,15 @@ API_SECRET = ""
 # Instrument to market make on BitMEX.
 SYMBOL = "XBTUSD"
 
+# To quote several instruments from one process, list them here. They share a single websocket connection
+# and REST session, and every tick converges each of them. When set, this overrides SYMBOL.
+# SYMBOLS = ["XBTUSD", "ETHUSD"]
+SYMBOLS = []
+
+# Order book feed to subscribe to. "orderBookL2_25" carries the top 25 levels per side; "orderBookL2" is
+# the full-depth book. Both are kept sorted by price so the best bid/ask are always at hand.
+ORDERBOOK_TABLE = "orderBookL2_25"
+
 
 ########################################################################################################################
 # Order Size & Spread
@@ -45,6 +54,11 @@ MIN_SPREAD = 0.01
 # rather than starting in the middle and killing potentially profitable spreads.
 MAINTAIN_SPREADS = True
 
+# Build the whole order ladder in one batched NumPy pass instead of level by level. Worth it for wide
+# ladders (ORDER_PAIRS in the tens or hundreds). Requires numpy. Strategies that override prepare_order()
+# should leave this off, as the batched builder doesn't call it.
+NUMPY_LADDER = False
+
 # This number defines far much the price of an existing order can be from a desired order before it is amended.
 # This is useful for avoiding unnecessary calls and maintaining your ratelimits.
 #
@@ -52,7 +66,8 @@ MAINTAIN_SPREADS = True
 # Each order is designed to be (INTERVAL*n)% away from the spread.
 # If the spread changes and the order has moved outside its bound defined as
 # abs((desired_order['price'] / order['price']) - 1) > settings.RELIST_INTERVAL)
-# it will be resubmitted.
+# it will be resubmitted. The same tolerance applies to quantity: an order whose size is within
+# RELIST_INTERVAL of the desired size is left as is, keeping its place in the queue.
 #
 # 0.01 == 1%
 RELIST_INTERVAL = 0.01
@@ -87,14 +102,106 @@ DRY_RUN = False
 # order amend/replaces are done, you may hit a ratelimit. If so, email BitMEX if you feel you need a higher limit.
 LOOP_INTERVAL = 5
 
+# If True, re-quote as soon as the websocket reports a change (top of book moved, one of our orders filled,
+# position changed) instead of every LOOP_INTERVAL seconds. LOOP_INTERVAL then only bounds how long we go
+# without a tick when the market is quiet.
+EVENT_DRIVEN = False
+# After the first event, wait this many seconds for more to arrive so a burst triggers a single re-quote.
+EVENT_DEBOUNCE = 0.01
+# Never re-quote more often than this many seconds apart, whatever the event rate.
+MIN_REACTION_INTERVAL = 0.5
+
+# Websocket liveness. We ping every WS_PING_INTERVAL seconds and treat the connection as dead if a pong
+# doesn't come back within WS_PING_TIMEOUT seconds.
+WS_PING_INTERVAL = 15
+WS_PING_TIMEOUT = 10
+
+# If a table goes this many seconds without a message, we unsubscribe and resubscribe just that table and
+# rebuild it from the new partial. The rest of the websocket state stays readable meanwhile.
+TABLE_STALE_TIMEOUT = {
+    'instrument': 30,
+    'orderBookL2_25': 60,
+    'orderBookL2': 60,
+}
+# If a resubscribed table's partial hasn't arrived after this many seconds, it can be found stale again.
+WS_RESUBSCRIBE_TIMEOUT = 30
+
+# If True, keep a second websocket connected and in sync. If the primary drops, the standby takes over
+# immediately instead of reconnecting and waiting for all the partials again.
+WS_STANDBY = False
+
+# Track per-table websocket latency: exchange timestamp to receipt, and receipt to applied. Message rates,
+# latency percentiles and socket backlog are logged every WS_LATENCY_LOG_INTERVAL seconds, as a warning if a
+# table's 99th percentile lag exceeds WS_LATENCY_WARNING seconds. Also available from BitMEXWebsocket.latency_stats().
+WS_LATENCY_STATS = True
+WS_LATENCY_LOG_INTERVAL = 60
+WS_LATENCY_WARNING = 1.0
+
+# Set to a directory to record every raw websocket frame, with its receive time, to a compressed journal
+# there. Useful for debugging quotes after the fact and for replaying sessions. A new file is started every
+# CAPTURE_ROTATE_SECONDS seconds.
+CAPTURE_DIR = None
+CAPTURE_ROTATE_SECONDS = 3600
+
 # Wait times between orders / errors
 API_REST_INTERVAL = 1
 API_ERROR_INTERVAL = 10
 TIMEOUT = 7
 
+# Failed requests (timeouts, 503s, dropped connections) are retried after a random wait of up to
+# API_RETRY_BACKOFF * 2^n seconds on the n'th retry, capped at API_RETRY_MAX_BACKOFF. Order placement
+# gives up after a few seconds (see utils/retry.py) and is re-planned on the next tick instead.
+API_RETRY_BACKOFF = 0.25
+API_RETRY_MAX_BACKOFF = 5
+
+# The API rate limit: RATE_LIMIT requests per RATE_LIMIT_WINDOW seconds. This is only the starting
+# assumption; every response reports the real limit and what's left of it, and we track that.
+RATE_LIMIT = 300
+RATE_LIMIT_WINDOW = 300
+# When there isn't budget for every amend and create, the RATE_LIMIT_PROTECT_LEVELS innermost levels
+# per side go first and may use the last RATE_LIMIT_RESERVE requests. Outer levels wait for a later
+# tick rather than eat into the reserve.
+RATE_LIMIT_RESERVE = 10
+RATE_LIMIT_PROTECT_LEVELS = 2
+
+# Send a tick's cancel, amend and create batches at the same time, each over its own pooled keep-alive
+# connection, instead of one after the other. Cancels never wait on creates either way.
+PARALLEL_DISPATCH = True
+HTTP_POOL_SIZE = 4
+
+# Collect order operations for this many seconds and send them as one cancel, one bulk amend and one
+# bulk create, instead of a request per batch. An amend superseded by a later one for the same order
+# within the window is never sent. Orders go out at most this much later, plus one round trip.
+# Worth it with EVENT_DRIVEN, where ticks come milliseconds apart, or several symbols share a connection.
+# 0 sends every batch as soon as it's ready.
+ORDER_COALESCE_WINDOW = 0
+
+# On startup, restart and shutdown we cancel our open orders (those with our ORDERID_PREFIX) in one request.
+# Set this to True to cancel every order on the symbol instead (DELETE /order/all), which also catches
+# orders the websocket hasn't told us about yet, but takes out orders you or another bot placed on this
+# account too.
+CANCEL_ALL_BY_SYMBOL = False
+
+# Dead man's switch. Every CANCEL_ALL_AFTER_INTERVAL seconds we tell BitMEX to cancel all our orders if
+# it doesn't hear from us again within CANCEL_ALL_AFTER seconds. If the bot hangs or loses its connection,
+# its quotes come down by themselves. Set CANCEL_ALL_AFTER to 0 to turn it off.
+CANCEL_ALL_AFTER = 60
+CANCEL_ALL_AFTER_INTERVAL = 15
+
 # If we're doing a dry run, use these numbers for BTC balances
 DRY_BTC = 50
 
+# Retention for the append-only websocket tables. Each is held in a fixed-size ring buffer of `count` rows;
+# set `seconds` to also drop rows older than that many seconds.
+TABLE_RETENTION = {
+    'trade': {'count': 200, 'seconds': None},
+    'quote': {'count': 200, 'seconds': None},
+    'execution': {'count': 200, 'seconds': None},
+}
+
+# JSON library used to decode websocket frames: "orjson", "ujson" or "json". None picks the fastest installed.
+JSON_BACKEND = None
+
 # Available levels: logging.(DEBUG|INFO|WARN|ERROR)
 LOG_LEVEL = logging.INFO
 
@@ -1,15 +1,22 @@
 """BitMEX API Connector."""
 from __future__ import absolute_import
+import _thread
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
 import base64
 import uuid
-from market_maker.auth import APIKeyAuthWithExpires
+from market_maker.auth import RequestSigner
 from market_maker.utils import constants, errors, log
+from market_maker.utils.gateway import OrderGateway
+from market_maker.utils.orderstate import OrderTracker
+from market_maker.utils.ratelimit import RateLimitBudget, request_cost
+from market_maker.utils.retry import RetryPolicy
+from market_maker.ws.events import ChangeNotifier
 from market_maker.ws.ws_thread import BitMEXWebsocket
-from threading import Timer
+from threading import Event, Lock, Thread, Timer
 
 logger = log.setup_custom_logger('root')
 
@@ -19,11 +26,39 @@ class BitMEX(object):
 
     """BitMEX API Connector."""
 
+    # How often to check the websocket for liveness and stale tables, in seconds.
+    WS_CHECK_INTERVAL = 10
+
     def __init__(self, base_url=None, symbol=None, apiKey=None, apiSecret=None,
-                 orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False, timeout=7):
-        """Init connector."""
+                 orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False, timeout=7, symbols=None,
+                 wsStandby=False, capture=None, ws=None, rateLimit=300, rateLimitWindow=300, poolSize=4,
+                 retryPolicy=None, coalesceWindow=0):
+        """Init connector.
+
+        Pass `symbols` to stream several instruments over the one websocket. `symbol` is then the
+        default for methods that take an optional symbol.
+
+        With `wsStandby`, a second, fully synced websocket is kept connected and takes over as soon
+        as the primary drops.
+
+        Pass a ws.capture.CaptureWriter as `capture` to journal every frame the websocket receives.
+
+        Pass an already connected `ws` (e.g. a ws.replay.ReplayWebsocket) to use it instead of
+        connecting to base_url. It is used as is: no standby, no liveness checks.
+
+        `rateLimit` requests per `rateLimitWindow` seconds is what we assume the API allows until the
+        first response tells us otherwise. See `ratelimit`.
+
+        Up to `poolSize` REST requests can be in flight at once, each on its own keep-alive connection;
+        see submit().
+
+        `retryPolicy` (a utils.retry.RetryPolicy) sets how failed requests are retried.
+
+        With a `coalesceWindow` (seconds), `gateway` is a utils.gateway.OrderGateway that merges the order
+        operations queued within each window into as few requests as possible."""
         self.base_url = base_url
-        self.symbol = symbol
+        self.symbols = symbols or [symbol]
+        self.symbol = symbol or self.symbols[0]
         self.postOnly = postOnly
         self.shouldWSAuth = shouldWSAuth
         if (apiKey is None):
@@ -32,38 +67,123 @@ class BitMEX(object):
                             )
         self.apiKey = apiKey
         self.apiSecret = apiSecret
+        self.signer = RequestSigner(apiKey, apiSecret, base_url or '')
         if len(orderIDPrefix) > 13:
             raise ValueError("settings.ORDERID_PREFIX must be at most 13 characters long!")
         self.orderIDPrefix = orderIDPrefix
-        self.retries = 0  # initialize counter
-
-        # Prepare HTTPS session
+        # Our orders as of the last REST response, ahead of the websocket. See open_orders().
+        self.order_state = OrderTracker(orderIDPrefix)
+        # What's left of the API rate limit, kept in sync from every response's X-RateLimit-* headers.
+        self.ratelimit = RateLimitBudget(rateLimit, rateLimitWindow)
+        self.retry_policy = retryPolicy or RetryPolicy()
+        # Set while start_heartbeat() keeps the cancelAllAfter dead man's switch armed.
+        self.heartbeat = None
+
+        # Prepare HTTPS session. Keep a connection per concurrent request alive, so batches sent
+        # together through submit() don't wait on each other or on a fresh TLS handshake.
         self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.dispatcher = ThreadPoolExecutor(max_workers=poolSize, thread_name_prefix='bitmex-rest')
+        self.gateway = OrderGateway(self, coalesceWindow) if coalesceWindow else None
         # These headers are always sent
         self.session.headers.update({'user-agent': 'liquidbot-' + constants.VERSION})
         self.session.headers.update({'content-type': 'application/json'})
         self.session.headers.update({'accept': 'application/json'})
 
-        # Create websocket for streaming data
-        self.ws = BitMEXWebsocket()
-        self.ws.connect(base_url, symbol, shouldAuth=shouldWSAuth)
+        # Change events outlive any one websocket, so a reconnect doesn't strand whoever is waiting on them.
+        self.events = ChangeNotifier()
 
-        self.__check_ws_alive()
+        # Create websocket for streaming data
+        self.wsStandby = wsStandby
+        self.standby = None
+        self.ws_lock = Lock()
+        self.capture = capture
+        if ws is not None:
+            self.ws = ws
+            self.events = ws.events
+        else:
+            self.ws = self.__new_ws(self.events, self.capture)
+            self.ws.on_disconnect = self.__replace_ws
+            if self.wsStandby:
+                self.__start_standby()
+
+            self.__check_ws_alive()
 
         self.timeout = timeout
 
+    def __new_ws(self, notifier=None, capture=None):
+        ws = BitMEXWebsocket(notifier=notifier, capture=capture)
+        ws.connect(self.base_url, self.symbols, shouldAuth=self.shouldWSAuth)
+        return ws
+
     def __check_ws_alive(self):
-        if not self.ws.updated:
-            self.ws = BitMEXWebsocket()
-            self.ws.connect(self.base_url, self.symbol, shouldAuth=self.shouldWSAuth)
+        """Every WS_CHECK_INTERVAL seconds, replace a dead websocket and resubscribe any stale tables."""
+        if not self.ws.updated or not self.ws.is_alive():
+            self.__replace_ws(self.ws)
+        else:
+            for table in self.ws.stale_tables():
+                self.ws.resubscribe(table)
+            # Keep the standby healthy too, so it's ready when we need it.
+            standby = self.standby
+            if standby is not None and not standby.is_alive():
+                logger.warning("Standby websocket is down, reconnecting it.")
+                self.standby = None
+                standby.exit()
+                self.__start_standby()
         self.ws.updated = False
-        self.t = Timer(10, self.__check_ws_alive).start()
+        self.t = Timer(BitMEX.WS_CHECK_INTERVAL, self.__check_ws_alive)
+        self.t.daemon = True
+        self.t.start()
+
+    def __replace_ws(self, dead):
+        """Swap in the standby websocket if we have a live one, or reconnect from scratch."""
+        with self.ws_lock:
+            if self.ws is not dead:
+                return  # Already replaced, e.g. by the disconnect callback
+            standby, self.standby = self.standby, None
+            if standby is not None and standby.is_alive():
+                logger.warning("Websocket connection lost, switching to the standby connection.")
+                standby.events = self.events
+                standby.capture = self.capture
+                standby.on_disconnect = self.__replace_ws
+                self.ws = standby
+            else:
+                logger.warning("Websocket connection lost, reconnecting.")
+                if standby is not None:
+                    standby.exit()
+                self.ws = self.__new_ws(self.events, self.capture)
+                self.ws.on_disconnect = self.__replace_ws
+            dead.on_disconnect = None
+            dead.exit()
+        if self.wsStandby:
+            self.__start_standby()
+
+    def __start_standby(self):
+        """Connect a standby websocket in the background. It keeps its own events to itself until promoted."""
+        def connect():
+            self.standby = self.__new_ws()
+        Thread(target=connect, daemon=True).start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run a request method, e.g. self.amend_bulk_orders, on the dispatch pool. Returns a Future."""
+        return self.dispatcher.submit(fn, *args, **kwargs)
 
     def __del__(self):
         self.exit()
 
     def exit(self):
+        if self.heartbeat is not None:
+            self.heartbeat.set()
+        if self.gateway is not None:
+            self.gateway.close()
         self.ws.exit()
+        if self.standby is not None:
+            self.standby.exit()
+        if self.capture is not None:
+            self.capture.close()
+        self.dispatcher.shutdown(wait=False)
 
     #
     # Public methods
@@ -88,19 +208,33 @@ class BitMEX(object):
         """Get market depth / orderbook."""
         return self.ws.market_depth()
 
-    def recent_trades(self):
-        """Get recent trades.
+    def order_book(self, symbol=None):
+        """Get the sorted order book. Best bid/ask are at level 0 of `bids`/`asks`."""
+        if symbol is None:
+            symbol = self.symbol
+        return self.ws.order_book(symbol)
+
+    def snapshot(self, symbol=None, depth=25):
+        """Get a consistent view of instrument, orders, position, margin and book at one point in the feed."""
+        return self.ws.snapshot(symbol or self.symbol, depth)
+
+    def latency_stats(self):
+        """Get per-table websocket latency and message rates."""
+        return self.ws.latency_stats()
+
+    def recent_trades(self, count=None):
+        """Get recent trades. Pass `count` to iterate over only the newest trades without copying.
 
         Returns
         -------
-        A list of dicts:
+        A sequence of dicts:
               {u'amount': 60,
                u'date': 1306775375,
                u'price': 8.7401099999999996,
                u'tid': u'93842'},
 
         """
-        return self.ws.recent_trades()
+        return self.ws.recent_trades(count)
 
     #
     # Authentication required methods
@@ -156,51 +290,81 @@ class BitMEX(object):
         return self.place_order(-quantity, price)
 
     @authentication_required
-    def place_order(self, quantity, price):
+    def place_order(self, quantity, price, symbol=None):
         """Place an order."""
         if price < 0:
             raise Exception("Price must be positive.")
 
         endpoint = "order"
         # Generate a unique clOrdID with our prefix so we can identify it.
-        clOrdID = self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
+        clOrdID = self.new_clOrdID()
         postdict = {
-            'symbol': self.symbol,
+            'symbol': symbol or self.symbol,
             'orderQty': quantity,
             'price': price,
             'clOrdID': clOrdID
         }
-        return self._curl_bitmex(path=endpoint, postdict=postdict, verb="POST")
+        return self.__tracked(self.order_state.creating([postdict]),
+                              lambda: self._curl_bitmex(path=endpoint, postdict=postdict, verb="POST"))
+
+    def new_clOrdID(self):
+        """A unique clOrdID with our prefix, so we can identify our orders."""
+        return self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
 
     @authentication_required
     def amend_bulk_orders(self, orders):
-        """Amend multiple orders."""
+        """Amend multiple orders.
+
+        Orders given with an `origClOrdID` are re-keyed: the amend targets the order by its current clOrdID
+        and gives it a new one. If the amend lands but we don't hear back, retrying it can't apply it twice."""
+        payload = []
+        for order in orders:
+            order = dict(order)
+            if order.get('origClOrdID'):
+                order.pop('orderID', None)
+                order['clOrdID'] = self.new_clOrdID()
+            payload.append(order)
         # Note rethrow; if this fails, we want to catch it and re-tick
-        return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='PUT', rethrow_errors=True)
+        return self.__tracked(self.order_state.amending(payload), lambda: self._curl_bitmex(
+            path='order/bulk', postdict={'orders': payload}, verb='PUT', rethrow_errors=True))
 
     @authentication_required
-    def create_bulk_orders(self, orders):
-        """Create multiple orders."""
+    def create_bulk_orders(self, orders, symbol=None, queued=False):
+        """Create multiple orders. Orders that already have a clOrdID, e.g. from the gateway, keep it.
+
+        `queued` orders are already in order_state as pending creates (see utils.gateway), so they're only
+        confirmed or rolled back here, not registered again."""
         for order in orders:
-            order['clOrdID'] = self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
-            order['symbol'] = self.symbol
+            order['clOrdID'] = order.get('clOrdID') or self.new_clOrdID()
+            order['symbol'] = symbol or self.symbol
             if self.postOnly:
                 order['execInst'] = 'ParticipateDoNotInitiate'
-        return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='POST')
+        keys = [order['clOrdID'] for order in orders] if queued else self.order_state.creating(orders)
+        return self.__tracked(keys,
+                              lambda: self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='POST'))
 
     @authentication_required
-    def open_orders(self):
-        """Get open orders."""
-        return self.ws.open_orders(self.orderIDPrefix)
+    def open_orders(self, symbol=None):
+        """Get open orders. Without a symbol, returns our open orders on every symbol we stream.
+
+        These are the orders as they'll be once our in-flight requests land: REST responses are applied
+        as soon as they return, without waiting for the websocket to confirm them. Orders still being
+        created have no orderID yet."""
+        return self.order_state.open_orders(self.ws.open_orders(self.orderIDPrefix, symbol),
+                                            self.ws.order_by_clOrdID, symbol)
+
+    def best_open_order(self, side, symbol=None):
+        """Get our highest open buy or lowest open sell."""
+        return self.ws.best_open_order(self.orderIDPrefix, symbol or self.symbol, side)
 
     @authentication_required
-    def http_open_orders(self):
+    def http_open_orders(self, symbol=None):
         """Get open orders via HTTP. Used on close to ensure we catch them all."""
         path = "order"
         orders = self._curl_bitmex(
             path=path,
             query={
-                'filter': json.dumps({'ordStatus.isTerminated': False, 'symbol': self.symbol}),
+                'filter': json.dumps({'ordStatus.isTerminated': False, 'symbol': symbol or self.symbol}),
                 'count': 500
             },
             verb="GET"
@@ -209,13 +373,77 @@ class BitMEX(object):
         return [o for o in orders if str(o['clOrdID']).startswith(self.orderIDPrefix)]
 
     @authentication_required
-    def cancel(self, orderID):
-        """Cancel an existing order."""
+    def cancel(self, orderID=None, clOrdID=None):
+        """Cancel one or more orders in one request, by orderID and/or clOrdID (each an ID or a list of them)."""
         path = "order"
-        postdict = {
-            'orderID': orderID,
-        }
-        return self._curl_bitmex(path=path, postdict=postdict, verb="DELETE")
+        postdict = {}
+        if orderID:
+            postdict['orderID'] = orderID
+        if clOrdID:
+            postdict['clOrdID'] = clOrdID
+        if not postdict:
+            return []
+        return self.__tracked(self.order_state.canceling(orderID, clOrdID),
+                              lambda: self._curl_bitmex(path=path, postdict=postdict, verb="DELETE"))
+
+    @authentication_required
+    def cancel_all(self, symbol=None):
+        """Cancel every open order on `symbol` in one request, or on every symbol without one.
+
+        Note this is every order on the account, not only the ones with our orderIDPrefix."""
+        postdict = {'symbol': symbol} if symbol else {}
+        return self.__tracked(self.order_state.canceling(symbol=symbol) if symbol else [],
+                              lambda: self._curl_bitmex(path="order/all", postdict=postdict, verb="DELETE"))
+
+    def __tracked(self, keys, send):
+        """Send an order request, then feed what comes back into order_state, or undo `keys` if it fails."""
+        try:
+            result = send()
+        except BaseException:
+            self.order_state.rollback(keys)
+            raise
+        self.order_state.confirm(result)
+        return result
+
+    @authentication_required
+    def cancel_all_after(self, timeout):
+        """Dead man's switch: the exchange cancels all our orders unless this is called again within
+        `timeout` seconds. 0 disarms it. Errors are raised, not fatal: see start_heartbeat()."""
+        return self._curl_bitmex(path="order/cancelAllAfter", postdict={'timeout': int(timeout * 1000)},
+                                 verb="POST", max_retries=1, rethrow_errors=True)
+
+    def start_heartbeat(self, timeout, interval):
+        """Re-arm cancel_all_after(timeout) every `interval` seconds from a background thread, so our
+        quotes are pulled if this process hangs or loses its connection."""
+        self.stop_heartbeat()
+        self.heartbeat = Event()
+
+        def beat(stopped):
+            while not stopped.is_set():
+                try:
+                    self.cancel_all_after(timeout)
+                except Exception as e:
+                    # Keep trying: the switch is only armed while this thread lives.
+                    logger.warning("Unable to renew cancelAllAfter: %s" % e)
+                except SystemExit:
+                    # _curl_bitmex exits on a 401. That would only end this thread, leaving the bot quoting
+                    # with no dead man's switch, so stop the bot (the main thread exits and cancels) instead.
+                    logger.error("cancelAllAfter was refused authentication. Stopping rather than quote without it.")
+                    _thread.interrupt_main()
+                    return
+                stopped.wait(interval)
+        Thread(target=beat, args=(self.heartbeat,), daemon=True).start()
+
+    def stop_heartbeat(self, disarm=False):
+        """Stop renewing cancelAllAfter. With `disarm`, also switch it off on the exchange."""
+        if self.heartbeat is not None:
+            self.heartbeat.set()
+            self.heartbeat = None
+            if disarm:
+                try:
+                    self.cancel_all_after(0)
+                except Exception as e:
+                    logger.warning("Unable to disarm cancelAllAfter: %s" % e)
 
     @authentication_required
     def withdraw(self, amount, fee, address):
@@ -229,10 +457,10 @@ class BitMEX(object):
         return self._curl_bitmex(path=path, postdict=postdict, verb="POST", max_retries=0)
 
     def _curl_bitmex(self, path, query=None, postdict=None, timeout=None, verb=None, rethrow_errors=False,
-                     max_retries=None):
-        """Send a request to BitMEX Servers."""
-        # Handle URL
-        url = self.base_url + path
+                     max_retries=None, attempt=None):
+        """Send a request to BitMEX Servers. `attempt` is the RetryState of a request being retried."""
+        # Handle URL: the full URL and the path we sign, with the query string if any
+        url, signed_path = self.signer.url(path, query)
 
         if timeout is None:
             timeout = self.timeout
@@ -241,15 +469,17 @@ class BitMEX(object):
         if not verb:
             verb = 'POST' if postdict else 'GET'
 
-        # By default don't retry POST or PUT. Retrying GET/DELETE is okay because they are idempotent.
-        # In the future we could allow retrying PUT, so long as 'leavesQty' is not used (not idempotent),
-        # or you could change the clOrdID (set {"clOrdID": "new", "origClOrdID": "old"}) so that an amend
-        # can't erroneously be applied twice.
+        # Retrying GET/DELETE is okay because they are idempotent. So are order creates and amends the way
+        # we send them: creates carry a clOrdID, so one that did land comes back as a duplicate clOrdID and
+        # we fetch it instead. Amends re-key the order ({"clOrdID": "new", "origClOrdID": "old"}), so one
+        # can't be applied twice. Don't retry any other POST or PUT.
         if max_retries is None:
-            max_retries = 0 if verb in ['POST', 'PUT'] else 3
+            max_retries = 3 if verb in ['GET', 'DELETE'] or self.__idempotent(verb, postdict) else 0
+        if attempt is None:
+            attempt = self.retry_policy.start(verb, path, max_retries)
 
-        # Auth: API Key/Secret
-        auth = APIKeyAuthWithExpires(self.apiKey, self.apiSecret)
+        # Serialize the body once, compactly, and sign, send and log that same string.
+        body = json.dumps(postdict, separators=(',', ':')) if postdict else ''
 
         def exit_or_throw(e):
             if rethrow_errors:
@@ -257,19 +487,33 @@ class BitMEX(object):
             else:
                 exit(1)
 
-        def retry():
-            self.retries += 1
-            if self.retries > max_retries:
-                raise Exception("Max retries on %s (%s) hit, raising." % (path, json.dumps(postdict or '')))
-            return self._curl_bitmex(path, query, postdict, timeout, verb, rethrow_errors, max_retries)
+        # Retry state travels with the request rather than living on self, since several requests can be
+        # in flight at once (see submit()). Back off with jitter, and give up at the endpoint's deadline.
+        def retry(minimum=0):
+            delay = attempt.backoff(minimum)
+            if delay is None:
+                raise errors.RetriesExhaustedError("Max retries on %s (%s) hit, raising." % (path, body))
+            time.sleep(delay)
+            return self._curl_bitmex(path, query, postdict, timeout, verb, rethrow_errors, max_retries, attempt)
+
+        # Wait for the budget rather than run into a 429. Cancels aren't blocked by the limit, so never wait on them.
+        cost = request_cost(verb, path, postdict)
+        if verb != 'DELETE':
+            wait = self.ratelimit.wait_time(cost)
+            if wait > 0:
+                logger.warning("Rate limit budget exhausted, waiting %.2fs before %s %s." % (wait, verb, path))
+                time.sleep(wait)
 
         # Make the request
         response = None
         try:
-            logger.info("sending req to %s: %s" % (url, json.dumps(postdict or query or '')))
-            req = requests.Request(verb, url, json=postdict, auth=auth, params=query)
+            logger.info("sending req to %s: %s" % (url, body))
+            # Auth: API Key/Secret
+            req = requests.Request(verb, url, data=body or None, headers=self.signer.headers(verb, signed_path, body))
             prepped = self.session.prepare_request(req)
+            self.ratelimit.spend(cost)
             response = self.session.send(prepped, timeout=timeout)
+            self.ratelimit.update(response.headers)
             # Make non-200s throw
             response.raise_for_status()
 
@@ -289,62 +533,51 @@ class BitMEX(object):
             # 404, can be thrown if order canceled or does not exist.
             elif response.status_code == 404:
                 if verb == 'DELETE':
-                    logger.error("Order not found: %s" % postdict['orderID'])
+                    logger.error("Order not found: %s" % (postdict.get('orderID') or postdict.get('clOrdID')))
                     return
                 logger.error("Unable to contact the BitMEX API (404). " +
-                                  "Request: %s \n %s" % (url, json.dumps(postdict)))
+                                  "Request: %s \n %s" % (url, body))
                 exit_or_throw(e)
 
-            # 429, ratelimit; cancel orders & wait until X-RateLimit-Reset
+            # 429, ratelimit; cancel orders & wait until X-RateLimit-Reset.
+            # The budget above should keep us from getting here; if we do, something else shares the key.
             elif response.status_code == 429:
                 logger.error("Ratelimited on current request. Sleeping, then trying again. Try fewer " +
                                   "order pairs or contact support@bitmex.com to raise your limits. " +
-                                  "Request: %s \n %s" % (url, json.dumps(postdict)))
+                                  "Request: %s \n %s" % (url, body))
 
                 # Figure out how long we need to wait.
                 ratelimit_reset = response.headers['X-RateLimit-Reset']
-                to_sleep = int(ratelimit_reset) - int(time.time())
+                to_sleep = max(int(ratelimit_reset) - int(time.time()), 0)
                 reset_str = datetime.datetime.fromtimestamp(int(ratelimit_reset)).strftime('%X')
 
                 # We're ratelimited, and we may be waiting for a long time. Cancel orders.
                 logger.warning("Canceling all known orders in the meantime.")
-                self.cancel([o['orderID'] for o in self.open_orders()])
+                self.cancel([o['orderID'] for o in self.open_orders() if o.get('orderID')])
 
-                logger.error("Your ratelimit will reset at %s. Sleeping for %d seconds." % (reset_str, to_sleep))
-                time.sleep(to_sleep)
-
-                # Retry the request.
-                return retry()
+                # Retry the request once the limit resets, if that's before its deadline.
+                logger.error("Your ratelimit will reset at %s, in %d seconds." % (reset_str, to_sleep))
+                return retry(to_sleep)
 
             # 503 - BitMEX temporary downtime, likely due to a deploy. Try again
             elif response.status_code == 503:
                 logger.warning("Unable to contact the BitMEX API (503), retrying. " +
-                                    "Request: %s \n %s" % (url, json.dumps(postdict)))
-                time.sleep(3)
+                                    "Request: %s \n %s" % (url, body))
                 return retry()
 
             elif response.status_code == 400:
                 error = response.json()['error']
                 message = error['message'].lower() if error else ''
 
-                # Duplicate clOrdID: that's fine, probably a deploy, go get the order(s) and return it
-                if 'duplicate clordid' in message:
-                    orders = postdict['orders'] if 'orders' in postdict else postdict
-
-                    IDs = json.dumps({'clOrdID': [order['clOrdID'] for order in orders]})
-                    orderResults = self._curl_bitmex('/order', query={'filter': IDs}, verb='GET')
-
-                    for i, order in enumerate(orderResults):
-                        if (
-                                order['orderQty'] != abs(postdict['orderQty']) or
-                                order['side'] != ('Buy' if postdict['orderQty'] > 0 else 'Sell') or
-                                order['price'] != postdict['price'] or
-                                order['symbol'] != postdict['symbol']):
-                            raise Exception('Attempted to recover from duplicate clOrdID, but order returned from API ' +
-                                            'did not match POST.\nPOST data: %s\nReturned order: %s' % (
-                                                json.dumps(orders[i]), json.dumps(order)))
-                    # All good
-                    return orderResults
+                # Duplicate clOrdID: that's fine, probably a deploy or a retry of a create that did land.
+                # Go get the order(s) and return them.
+                if 'duplicate clordid' in message and verb == 'POST':
+                    return self.__recover(verb, postdict)
+
+                # A retried amend that landed the first time: the order has already been re-keyed.
+                elif verb == 'PUT' and attempt.retries and any(
+                        m in message for m in ('duplicate clordid', 'invalid orderid', 'invalid origclordid')):
+                    return self.__recover(verb, postdict)
 
                 elif 'insufficient available balance' in message:
                     logger.error('Account out of funds. The message: %s' % error['message'])
@@ -353,21 +586,57 @@ class BitMEX(object):
 
             # If we haven't returned or re-raised yet, we get here.
             logger.error("Unhandled Error: %s: %s" % (e, response.text))
-            logger.error("Endpoint was: %s %s: %s" % (verb, path, json.dumps(postdict)))
+            logger.error("Endpoint was: %s %s: %s" % (verb, path, body))
             exit_or_throw(e)
 
         except requests.exceptions.Timeout as e:
             # Timeout, re-run this request
-            logger.warning("Timed out on request: %s (%s), retrying..." % (path, json.dumps(postdict or '')))
+            logger.warning("Timed out on request: %s (%s), retrying..." % (path, body))
             return retry()
 
         except requests.exceptions.ConnectionError as e:
-            logger.warning("Unable to contact the BitMEX API (%s). Please check the URL. Retrying. " +
-                                "Request: %s %s \n %s" % (e, url, json.dumps(postdict)))
-            time.sleep(1)
+            logger.warning("Unable to contact the BitMEX API (%s). Please check the URL. Retrying. "
+                           "Request: %s \n %s" % (e, url, body))
             return retry()
 
-        # Reset retry counter on success
-        self.retries = 0
-
         return response.json()
+
+    def __idempotent(self, verb, postdict):
+        """Whether an order POST or PUT can safely be sent twice: see _curl_bitmex."""
+        if not postdict:
+            return False
+        orders = postdict.get('orders', [postdict])
+        if verb == 'POST':
+            return all(o.get('clOrdID') for o in orders)
+        if verb == 'PUT':
+            return all(o.get('clOrdID') and o.get('origClOrdID') for o in orders)
+        return False
+
+    def __recover(self, verb, postdict):
+        """Fetch the orders a create or amend was for, by clOrdID, after learning it already went through."""
+        orders = postdict['orders'] if 'orders' in postdict else [postdict]
+        sent = {order['clOrdID']: order for order in orders}
+        IDs = json.dumps({'clOrdID': list(sent)})
+        orderResults = self._curl_bitmex('order', query={'filter': IDs}, verb='GET')
+
+        if len(orderResults) != len(sent):
+            # Some of them really didn't go through, e.g. an amend to an order that filled in between.
+            # Return what did; order_state forgets or reverts the rest and the next tick plans them again.
+            found = set(order['clOrdID'] for order in orderResults)
+            missing = [order for clOrdID, order in sent.items() if clOrdID not in found]
+            logger.warning('Recovering from duplicate clOrdID, found %d of %d orders. Missing %s data: %s' % (
+                len(orderResults), len(sent), verb, json.dumps(missing)))
+            self.order_state.rollback([order.get('origClOrdID') or order['clOrdID'] for order in missing])
+        for order in orderResults:
+            expected = sent[order['clOrdID']]
+            side = expected.get('side') or ('Buy' if expected.get('orderQty', 0) > 0 else 'Sell')
+            if (
+                    ('orderQty' in expected and order['orderQty'] != abs(expected['orderQty'])) or
+                    ('price' in expected and order['price'] != expected['price']) or
+                    ('symbol' in expected and order['symbol'] != expected['symbol']) or
+                    (verb == 'POST' and order['side'] != side)):
+                raise Exception('Attempted to recover from duplicate clOrdID, but order returned from API ' +
+                                'did not match %s.\n%s data: %s\nReturned order: %s' % (
+                                    verb, verb, json.dumps(expected), json.dumps(order)))
+        # All good
+        return orderResults
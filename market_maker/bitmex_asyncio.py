@@ -0,0 +1,231 @@
+"""BitMEX API Connector for asyncio."""
+from __future__ import absolute_import
+import asyncio
+import base64
+import datetime
+import json
+import time
+import uuid
+
+import aiohttp
+from yarl import URL
+
+from market_maker.auth.APIKeyAuth import RequestSigner
+from market_maker.utils import constants, errors, log
+from market_maker.utils.retry import RetryPolicy
+from market_maker.ws.ws_asyncio import AsyncBitMEXWebsocket
+
+logger = log.setup_custom_logger('root')
+
+
+class AsyncBitMEX(object):
+
+    """asyncio BitMEX API Connector.
+
+    Mirrors BitMEX, but REST calls are coroutines on a shared aiohttp session and market data comes
+    from an AsyncBitMEXWebsocket. Nothing blocks the event loop, so a strategy can have several
+    requests in flight while it computes.
+
+        bitmex = AsyncBitMEX(base_url=..., symbol='XBTUSD', apiKey=..., apiSecret=...)
+        await bitmex.connect()
+        await bitmex.create_bulk_orders([...])
+        await bitmex.close()
+
+    Requires aiohttp (pip install bitmex-market-maker[asyncio]).
+    """
+
+    def __init__(self, base_url=None, symbol=None, apiKey=None, apiSecret=None,
+                 orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False, timeout=7, retryPolicy=None):
+        """Init connector. Call `connect()` before use.
+
+        `retryPolicy` (a utils.retry.RetryPolicy) sets how failed requests are retried, as for BitMEX."""
+        self.base_url = base_url
+        self.symbol = symbol
+        self.postOnly = postOnly
+        self.shouldWSAuth = shouldWSAuth
+        if (apiKey is None):
+            raise Exception("Please set an API key and Secret to get started. See " +
+                            "https://github.com/BitMEX/sample-market-maker/#getting-started for more information."
+                            )
+        self.apiKey = apiKey
+        self.apiSecret = apiSecret
+        self.signer = RequestSigner(apiKey, apiSecret, base_url or '')
+        if len(orderIDPrefix) > 13:
+            raise ValueError("settings.ORDERID_PREFIX must be at most 13 characters long!")
+        self.orderIDPrefix = orderIDPrefix
+        self.timeout = timeout
+        self.retry_policy = retryPolicy or RetryPolicy()
+        self.session = None
+        self.ws = None
+
+    async def connect(self):
+        """Open the HTTPS session and websocket. Returns once the initial data images have arrived."""
+        self.session = aiohttp.ClientSession(
+            headers={
+                'user-agent': 'liquidbot-' + constants.VERSION,
+                'content-type': 'application/json',
+                'accept': 'application/json'
+            },
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self.ws = AsyncBitMEXWebsocket(session=self.session)
+        await self.ws.connect(self.base_url, self.symbol, shouldAuth=self.shouldWSAuth)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.session is not None:
+            await self.session.close()
+
+    #
+    # Public methods
+    #
+    def ticker_data(self, symbol=None):
+        """Get ticker data."""
+        return self.ws.get_ticker(symbol or self.symbol)
+
+    def instrument(self, symbol):
+        """Get an instrument's details."""
+        return self.ws.get_instrument(symbol)
+
+    def market_depth(self):
+        """Get market depth / orderbook."""
+        return self.ws.market_depth()
+
+    def order_book(self, symbol=None):
+        """Get the sorted order book."""
+        return self.ws.order_book(symbol or self.symbol)
+
+    def recent_trades(self, count=None):
+        """Get recent trades."""
+        return self.ws.recent_trades(count)
+
+    def funds(self):
+        """Get your current balance."""
+        return self.ws.funds()
+
+    def position(self, symbol):
+        """Get your open position."""
+        return self.ws.position(symbol)
+
+    def open_orders(self):
+        """Get open orders."""
+        return self.ws.open_orders(self.orderIDPrefix)
+
+    async def place_order(self, quantity, price):
+        """Place an order."""
+        if price < 0:
+            raise Exception("Price must be positive.")
+
+        postdict = {
+            'symbol': self.symbol,
+            'orderQty': quantity,
+            'price': price,
+            'clOrdID': self.new_clOrdID()
+        }
+        return await self._curl_bitmex(path="order", postdict=postdict, verb="POST")
+
+    async def amend_bulk_orders(self, orders):
+        """Amend multiple orders."""
+        return await self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='PUT')
+
+    async def create_bulk_orders(self, orders):
+        """Create multiple orders."""
+        for order in orders:
+            order['clOrdID'] = self.new_clOrdID()
+            order['symbol'] = self.symbol
+            if self.postOnly:
+                order['execInst'] = 'ParticipateDoNotInitiate'
+        return await self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='POST')
+
+    async def cancel(self, orderID):
+        """Cancel one or more existing orders."""
+        return await self._curl_bitmex(path="order", postdict={'orderID': orderID}, verb="DELETE")
+
+    async def http_open_orders(self):
+        """Get open orders via HTTP."""
+        orders = await self._curl_bitmex(
+            path="order",
+            query={
+                'filter': json.dumps({'ordStatus.isTerminated': False, 'symbol': self.symbol}),
+                'count': 500
+            },
+            verb="GET"
+        )
+        return [o for o in orders if str(o['clOrdID']).startswith(self.orderIDPrefix)]
+
+    def new_clOrdID(self):
+        """Generate a unique clOrdID with our prefix so we can identify it."""
+        return self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
+
+    async def _curl_bitmex(self, path, query=None, postdict=None, verb=None, max_retries=None):
+        """Send a request to BitMEX Servers. Raises aiohttp.ClientResponseError on unhandled errors, and
+        errors.RetriesExhaustedError once out of retries or past the endpoint's deadline."""
+        url, signed_path = self.signer.url(path, query)
+
+        # Default to POST if data is attached, GET otherwise
+        if not verb:
+            verb = 'POST' if postdict else 'GET'
+
+        # Same policy as BitMEX._curl_bitmex: only retry idempotent verbs.
+        if max_retries is None:
+            max_retries = 0 if verb in ['POST', 'PUT'] else 3
+
+        # Sign exactly the body we send.
+        body = json.dumps(postdict, separators=(',', ':')) if postdict else ''
+
+        # Back off with jitter and give up at the endpoint's deadline, as BitMEX._curl_bitmex does.
+        attempt = self.retry_policy.start(verb, path, max_retries)
+
+        def give_up():
+            return errors.RetriesExhaustedError("Max retries on %s (%s) hit, raising." % (path, body))
+
+        while True:
+            headers = self.signer.headers(verb, signed_path, body)
+
+            logger.info("sending req to %s: %s" % (url, body))
+            try:
+                # encoded=True stops aiohttp from re-quoting the URL we signed.
+                async with self.session.request(verb, URL(url, encoded=True), data=body or None,
+                                                headers=headers) as response:
+                    if response.status == 401:
+                        logger.error("API Key or Secret incorrect, please check and restart.")
+                        raise errors.AuthenticationError(await response.text())
+
+                    if response.status == 404 and verb == 'DELETE':
+                        logger.error("Order not found: %s" % postdict['orderID'])
+                        return None
+
+                    if response.status == 429:
+                        ratelimit_reset = response.headers['X-RateLimit-Reset']
+                        to_sleep = max(int(ratelimit_reset) - int(time.time()), 0)
+                        reset_str = datetime.datetime.fromtimestamp(int(ratelimit_reset)).strftime('%X')
+                        logger.error("Ratelimited on current request. Your ratelimit will reset at %s. "
+                                     "Sleeping for %d seconds." % (reset_str, to_sleep))
+                        delay = attempt.backoff(to_sleep)
+                        if delay is None:
+                            raise give_up()
+                        await asyncio.sleep(delay)
+                        continue
+
+                    if response.status == 503:
+                        logger.warning("Unable to contact the BitMEX API (503), retrying. " +
+                                       "Request: %s \n %s" % (url, body))
+                        delay = attempt.backoff()
+                        if delay is None:
+                            raise give_up()
+                        await asyncio.sleep(delay)
+                        continue
+
+                    if response.status >= 400:
+                        logger.error("Unhandled Error: %s: %s" % (response.status, await response.text()))
+                        logger.error("Endpoint was: %s %s: %s" % (verb, path, body))
+                    response.raise_for_status()
+                    return await response.json()
+
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+                delay = attempt.backoff()
+                if delay is None:
+                    raise give_up() from e
+                logger.warning("Unable to contact the BitMEX API (%s), retrying. Request: %s %s" % (e, url, body))
+                await asyncio.sleep(delay)
@@ -76,8 +76,15 @@ class CustomOrderManager(OrderManager):
             logger.exception(e)
 
     def place_orders(self):
-        orderbook = pd.DataFrame(self.exchange.bitmex.market_depth())
-        orderbook = orderbook.sort_values('price', ascending=False).reset_index(drop=True)
+        # The book is already sorted; lay it out highest price first (asks, then bids) without re-sorting.
+        book = self.exchange.bitmex.order_book()
+        ask_prices, ask_sizes = book.asks.prices(), book.asks.sizes()
+        bid_prices, bid_sizes = book.bids.prices(), book.bids.sizes()
+        orderbook = pd.DataFrame({
+            'side': ['Sell'] * len(ask_prices) + ['Buy'] * len(bid_prices),
+            'price': ask_prices[::-1] + bid_prices,
+            'size': ask_sizes[::-1] + bid_sizes,
+        })
         self.context['orderbook'] = orderbook
         self.orderbook_stream.on_next(self.context)
 
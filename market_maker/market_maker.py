@@ -1,16 +1,21 @@
 from __future__ import absolute_import
-from time import sleep
+from time import sleep, time
 import sys
 from datetime import datetime
 from os.path import getmtime
 import random
+from math import ceil, floor
+from concurrent.futures import wait
 import requests
 import atexit
 import signal
 
 from market_maker import bitmex
 from market_maker.settings import settings
-from market_maker.utils import log, constants, errors, math
+from market_maker.utils import log, constants, errors, ladder, math, ratelimit, reconcile
+from market_maker.utils.retry import RetryPolicy
+from market_maker.ws import events
+from market_maker.ws.capture import CaptureWriter
 
 # Used for reloading the bot - saves modified times of key files
 import os
@@ -23,49 +28,76 @@ watched_files_mtimes = [(f, getmtime(f)) for f in settings.WATCHED_FILES]
 logger = log.setup_custom_logger('root')
 
 
+def make_connector(symbol, symbols=None, ws=None):
+    """Build a BitMEX connector from settings. Pass `ws` to use that websocket, e.g. a replay, instead of connecting."""
+    capture = CaptureWriter(settings.CAPTURE_DIR, rotate_seconds=settings.CAPTURE_ROTATE_SECONDS) \
+        if settings.CAPTURE_DIR and ws is None else None
+    return bitmex.BitMEX(base_url=settings.BASE_URL, symbol=symbol, symbols=symbols,
+                         apiKey=settings.API_KEY, apiSecret=settings.API_SECRET,
+                         orderIDPrefix=settings.ORDERID_PREFIX, postOnly=settings.POST_ONLY,
+                         timeout=settings.TIMEOUT, wsStandby=settings.WS_STANDBY, capture=capture, ws=ws,
+                         rateLimit=settings.RATE_LIMIT, rateLimitWindow=settings.RATE_LIMIT_WINDOW,
+                         poolSize=settings.HTTP_POOL_SIZE,
+                         retryPolicy=RetryPolicy(settings.API_RETRY_BACKOFF, settings.API_RETRY_MAX_BACKOFF),
+                         coalesceWindow=settings.ORDER_COALESCE_WINDOW)
+
+
 class ExchangeInterface:
-    def __init__(self, dry_run=False):
+    def __init__(self, dry_run=False, symbol=None, connector=None):
+        """Trade one symbol. Pass a shared `connector` (a BitMEX) to quote several symbols over one connection."""
         self.dry_run = dry_run
-        if len(sys.argv) > 1:
+        if symbol is not None:
+            self.symbol = symbol
+        elif len(sys.argv) > 1:
             self.symbol = sys.argv[1]
         else:
             self.symbol = settings.SYMBOL
-        self.bitmex = bitmex.BitMEX(base_url=settings.BASE_URL, symbol=self.symbol,
-                                    apiKey=settings.API_KEY, apiSecret=settings.API_SECRET,
-                                    orderIDPrefix=settings.ORDERID_PREFIX, postOnly=settings.POST_ONLY,
-                                    timeout=settings.TIMEOUT)
+        if connector is not None:
+            self.bitmex = connector
+        else:
+            self.bitmex = make_connector(self.symbol)
 
     def cancel_order(self, order):
         tickLog = self.get_instrument()['tickLog']
         logger.info("Canceling: %s %d @ %.*f" % (order['side'], order['orderQty'], tickLog, order['price']))
-        while True:
-            try:
-                self.bitmex.cancel(order['orderID'])
-                sleep(settings.API_REST_INTERVAL)
-            except ValueError as e:
-                logger.info(e)
-                sleep(settings.API_ERROR_INTERVAL)
-            else:
-                break
+        self.bitmex.cancel(order['orderID'])
 
     def cancel_all_orders(self):
         if self.dry_run:
             return
 
         logger.info("Resetting current position. Canceling all existing orders.")
-        tickLog = self.get_instrument()['tickLog']
+        if self.bitmex.gateway is not None:
+            # Don't let creates still in the coalescing window land after the cancel.
+            self.bitmex.gateway.flush()
+
+        if settings.CANCEL_ALL_BY_SYMBOL:
+            # One round trip, and it catches orders the websocket hasn't told us about yet.
+            canceled = self.bitmex.cancel_all(self.symbol)
+            logger.info("Canceled %d orders on %s." % (len(canceled or []), self.symbol))
+            return
 
-        # In certain cases, a WS update might not make it through before we call this.
-        # For that reason, we grab via HTTP to ensure we grab them all.
-        orders = self.bitmex.http_open_orders()
+        tickLog = self.get_instrument()['tickLog']
+        # Our open orders include ones we've sent but the websocket hasn't reported yet, so there's no need
+        # to fetch them over HTTP. Cancel by clOrdID, as orders still being created have no orderID.
+        orders = self.bitmex.open_orders(self.symbol)
 
         for order in orders:
             logger.info("Canceling: %s %d @ %.*f" % (order['side'], order['orderQty'], tickLog, order['price']))
 
         if len(orders):
-            self.bitmex.cancel([order['orderID'] for order in orders])
+            self.bitmex.cancel(clOrdID=[order['clOrdID'] for order in orders])
+
+    def start_heartbeat(self):
+        """Keep the exchange's dead man's switch armed, so our orders are pulled if we hang. See CANCEL_ALL_AFTER."""
+        if self.dry_run or not settings.CANCEL_ALL_AFTER or self.bitmex.heartbeat is not None:
+            return
+        self.bitmex.start_heartbeat(settings.CANCEL_ALL_AFTER, settings.CANCEL_ALL_AFTER_INTERVAL)
 
-        sleep(settings.API_REST_INTERVAL)
+    def stop_heartbeat(self):
+        if self.dry_run:
+            return
+        self.bitmex.stop_heartbeat(disarm=True)
 
     def get_portfolio(self):
         contracts = settings.CONTRACTS
@@ -74,24 +106,11 @@ class ExchangeInterface:
             position = self.bitmex.position(symbol=symbol)
             instrument = self.bitmex.instrument(symbol=symbol)
 
-            if instrument['isQuanto']:
-                future_type = "Quanto"
-            elif instrument['isInverse']:
-                future_type = "Inverse"
-            elif not instrument['isQuanto'] and not instrument['isInverse']:
-                future_type = "Linear"
-            else:
-                raise NotImplementedError("Unknown future type; not quanto or inverse: %s" % instrument['symbol'])
-
-            if instrument['underlyingToSettleMultiplier'] is None:
-                multiplier = float(instrument['multiplier']) / float(instrument['quoteToSettleMultiplier'])
-            else:
-                multiplier = float(instrument['multiplier']) / float(instrument['underlyingToSettleMultiplier'])
-
+            # futureType and contractMultiplier are precomputed once per instrument by the websocket.
             portfolio[symbol] = {
                 "currentQty": float(position['currentQty']),
-                "futureType": future_type,
-                "multiplier": multiplier,
+                "futureType": instrument['futureType'],
+                "multiplier": instrument['contractMultiplier'],
                 "markPrice": float(instrument['markPrice']),
                 "spot": float(instrument['indicativeSettlePrice'])
             }
@@ -137,23 +156,27 @@ class ExchangeInterface:
             return {'marginBalance': float(settings.DRY_BTC), 'availableFunds': float(settings.DRY_BTC)}
         return self.bitmex.funds()
 
+    def get_rate_budget(self):
+        """Requests we can send right now without being rate limited. None (unlimited) when dry running."""
+        if self.dry_run:
+            return None
+        return self.bitmex.ratelimit.available()
+
     def get_orders(self):
         if self.dry_run:
             return []
-        return self.bitmex.open_orders()
+        return self.bitmex.open_orders(self.symbol)
+
+    def get_snapshot(self):
+        """Consistent view of this symbol's instrument, orders, position, margin and book at one point in the feed."""
+        return self.bitmex.snapshot(self.symbol)
 
     def get_highest_buy(self):
-        buys = [o for o in self.get_orders() if o['side'] == 'Buy']
-        if not len(buys):
-            return {'price': -2**32}
-        highest_buy = max(buys or [], key=lambda o: o['price'])
+        highest_buy = None if self.dry_run else self.bitmex.best_open_order('Buy', self.symbol)
         return highest_buy if highest_buy else {'price': -2**32}
 
     def get_lowest_sell(self):
-        sells = [o for o in self.get_orders() if o['side'] == 'Sell']
-        if not len(sells):
-            return {'price': 2**32}
-        lowest_sell = min(sells or [], key=lambda o: o['price'])
+        lowest_sell = None if self.dry_run else self.bitmex.best_open_order('Sell', self.symbol)
         return lowest_sell if lowest_sell else {'price': 2**32}  # ought to be enough for anyone
 
     def get_position(self, symbol=None):
@@ -166,6 +189,13 @@ class ExchangeInterface:
             symbol = self.symbol
         return self.bitmex.ticker_data(symbol)
 
+    def wait_for_events(self, timeout):
+        """Block until the websocket reports a change or `timeout` passes. Returns the (event, symbol) pairs."""
+        return self.bitmex.events.wait(timeout)
+
+    def drain_events(self):
+        return self.bitmex.events.drain()
+
     def is_open(self):
         """Check that websockets are still open."""
         return not self.bitmex.ws.exited
@@ -182,6 +212,50 @@ class ExchangeInterface:
         if instrument['midPrice'] is None:
             raise errors.MarketEmptyError("Orderbook is empty, cannot quote")
 
+    def dispatch(self, batches):
+        """Send (name, method, orders) batches and return {name: result}, skipping empty ones.
+
+        With PARALLEL_DISPATCH they all go at once over the connector's connection pool; otherwise one
+        after the other, in the order given, stopping at the first that fails. Either way it returns only
+        once every batch sent has finished, so what they did is in order_state. A batch that raised has
+        the exception as its result, so one failing doesn't lose the others' results.
+
+        With the connector's order gateway (ORDER_COALESCE_WINDOW), the batches are queued with it, to go
+        out with whatever else arrives in the same window, and the results are Futures. The gateway then
+        handles failures as converge_orders() would: order_state rolls them back, expected ones are logged
+        and re-planned by the next tick, and anything else is raised from the next dispatch.
+        """
+        batches = [(name, method, orders) for name, method, orders in batches if orders]
+        results = {}
+        gateway = self.bitmex.gateway
+        if gateway is not None and not self.dry_run:
+            for name, method, orders in batches:
+                if name == 'cancel':
+                    results[name] = gateway.cancel([order['orderID'] for order in orders])
+                elif name == 'amend':
+                    results[name] = gateway.amend(orders)
+                elif name == 'create':
+                    results[name] = gateway.create(orders, self.symbol)
+                else:
+                    results[name] = self.bitmex.submit(method, orders)
+            return results
+        if settings.PARALLEL_DISPATCH and len(batches) > 1 and not self.dry_run:
+            futures = [(name, self.bitmex.submit(method, orders)) for name, method, orders in batches]
+            wait([future for name, future in futures])
+            for name, future in futures:
+                try:
+                    results[name] = future.result()
+                except BaseException as e:
+                    results[name] = e
+            return results
+        for name, method, orders in batches:
+            try:
+                results[name] = method(orders)
+            except Exception as e:
+                results[name] = e
+                break
+        return results
+
     def amend_bulk_orders(self, orders):
         if self.dry_run:
             return orders
@@ -190,7 +264,7 @@ class ExchangeInterface:
     def create_bulk_orders(self, orders):
         if self.dry_run:
             return orders
-        return self.bitmex.create_bulk_orders(orders)
+        return self.bitmex.create_bulk_orders(orders, self.symbol)
 
     def cancel_bulk_orders(self, orders):
         if self.dry_run:
@@ -199,12 +273,19 @@ class ExchangeInterface:
 
 
 class OrderManager:
-    def __init__(self):
-        self.exchange = ExchangeInterface(settings.DRY_RUN)
-        # Once exchange is created, register exit handler that will always cancel orders
-        # on any error.
-        atexit.register(self.exit)
-        signal.signal(signal.SIGTERM, self.exit)
+    # Websocket events that trigger a re-quote with EVENT_DRIVEN.
+    TICK_EVENTS = (events.TOP_OF_BOOK, events.ORDER_FILL, events.POSITION)
+
+    def __init__(self, exchange=None):
+        if exchange is None:
+            self.exchange = ExchangeInterface(settings.DRY_RUN)
+            # Once exchange is created, register exit handler that will always cancel orders
+            # on any error.
+            atexit.register(self.exit)
+            signal.signal(signal.SIGTERM, self.exit)
+        else:
+            # Owned by a MultiSymbolOrderManager, which handles exit for all of its symbols.
+            self.exchange = exchange
 
         logger.info("Using symbol %s." % self.exchange.symbol)
 
@@ -214,6 +295,7 @@ class OrderManager:
             logger.info("Order Manager initializing, connecting to BitMEX. Live run: executing real trades.")
 
         self.start_time = datetime.now()
+        self.last_tick = 0
         self.instrument = self.exchange.get_instrument()
         self.starting_qty = self.exchange.get_delta()
         self.running_qty = self.starting_qty
@@ -221,6 +303,7 @@ class OrderManager:
 
     def reset(self):
         self.exchange.cancel_all_orders()
+        self.exchange.start_heartbeat()
         self.sanity_check()
         self.print_status()
 
@@ -250,26 +333,33 @@ class OrderManager:
         ticker = self.exchange.get_ticker()
         tickLog = self.exchange.get_instrument()['tickLog']
 
+        # Positions are worked out in whole ticks (see utils.math); start_position_* are the same as prices.
+        tickSize = self.instrument['tickSize']
+        buy_ticks = math.toTicks(ticker["buy"], tickSize)
+        sell_ticks = math.toTicks(ticker["sell"], tickSize)
+
         # Set up our buy & sell positions as the smallest possible unit above and below the current spread
         # and we'll work out from there. That way we always have the best price but we don't kill wide
         # and potentially profitable spreads.
-        self.start_position_buy = ticker["buy"] + self.instrument['tickSize']
-        self.start_position_sell = ticker["sell"] - self.instrument['tickSize']
+        self.start_ticks_buy = buy_ticks + 1
+        self.start_ticks_sell = sell_ticks - 1
 
         # If we're maintaining spreads and we already have orders in place,
         # make sure they're not ours. If they are, we need to adjust, otherwise we'll
         # just work the orders inward until they collide.
         if settings.MAINTAIN_SPREADS:
             if ticker['buy'] == self.exchange.get_highest_buy()['price']:
-                self.start_position_buy = ticker["buy"]
+                self.start_ticks_buy = buy_ticks
             if ticker['sell'] == self.exchange.get_lowest_sell()['price']:
-                self.start_position_sell = ticker["sell"]
+                self.start_ticks_sell = sell_ticks
 
-        # Back off if our spread is too small.
-        if self.start_position_buy * (1.00 + settings.MIN_SPREAD) > self.start_position_sell:
-            self.start_position_buy *= (1.00 - (settings.MIN_SPREAD / 2))
-            self.start_position_sell *= (1.00 + (settings.MIN_SPREAD / 2))
+        # Back off if our spread is too small. Round outwards, so we never end up inside the back-off.
+        if self.start_ticks_buy * (1.00 + settings.MIN_SPREAD) > self.start_ticks_sell:
+            self.start_ticks_buy = floor(self.start_ticks_buy * (1.00 - (settings.MIN_SPREAD / 2)))
+            self.start_ticks_sell = ceil(self.start_ticks_sell * (1.00 + (settings.MIN_SPREAD / 2)))
 
+        self.start_position_buy = self.ticks_to_price(self.start_ticks_buy)
+        self.start_position_sell = self.ticks_to_price(self.start_ticks_sell)
         # Midpoint, used for simpler order placement.
         self.start_position_mid = ticker["mid"]
         logger.info(
@@ -284,24 +374,31 @@ class OrderManager:
     def get_price_offset(self, index):
         """Given an index (1, -1, 2, -2, etc.) return the price for that side of the book.
            Negative is a buy, positive is a sell."""
+        return self.ticks_to_price(self.get_ticks_offset(index))
+
+    def get_ticks_offset(self, index):
+        """get_price_offset, as a whole number of ticks."""
         # Maintain existing spreads for max profit
         if settings.MAINTAIN_SPREADS:
-            start_position = self.start_position_buy if index < 0 else self.start_position_sell
+            start_position = self.start_ticks_buy if index < 0 else self.start_ticks_sell
             # First positions (index 1, -1) should start right at start_position, others should branch from there
             index = index + 1 if index < 0 else index - 1
         else:
             # Offset mode: ticker comes from a reference exchange and we define an offset.
-            start_position = self.start_position_buy if index < 0 else self.start_position_sell
+            start_position = self.start_ticks_buy if index < 0 else self.start_ticks_sell
 
             # If we're attempting to sell, but our sell price is actually lower than the buy,
             # move over to the sell side.
-            if index > 0 and start_position < self.start_position_buy:
-                start_position = self.start_position_sell
+            if index > 0 and start_position < self.start_ticks_buy:
+                start_position = self.start_ticks_sell
             # Same for buys.
-            if index < 0 and start_position > self.start_position_sell:
-                start_position = self.start_position_buy
+            if index < 0 and start_position > self.start_ticks_sell:
+                start_position = self.start_ticks_buy
+
+        return int(round(start_position * (1 + settings.INTERVAL) ** index))
 
-        return math.toNearest(start_position * (1 + settings.INTERVAL) ** index, self.instrument['tickSize'])
+    def ticks_to_price(self, ticks):
+        return math.fromTicks(ticks, self.instrument['tickUnits'], self.instrument['tickScale'])
 
     ###
     # Orders
@@ -312,18 +409,36 @@ class OrderManager:
 
         buy_orders = []
         sell_orders = []
+        # Position limits can't change while we build the ladder, so check them once rather than per level.
+        buys = not self.long_position_limit_exceeded()
+        sells = not self.short_position_limit_exceeded()
+        if settings.NUMPY_LADDER:
+            buy_orders, sell_orders = self.build_ladder(buys, sells)
+            return self.converge_orders(buy_orders, sell_orders)
+
         # Create orders from the outside in. This is intentional - let's say the inner order gets taken;
         # then we match orders from the outside in, ensuring the fewest number of orders are amended and only
         # a new order is created in the inside. If we did it inside-out, all orders would be amended
         # down and a new order would be created at the outside.
         for i in reversed(range(1, settings.ORDER_PAIRS + 1)):
-            if not self.long_position_limit_exceeded():
+            if buys:
                 buy_orders.append(self.prepare_order(-i))
-            if not self.short_position_limit_exceeded():
+            if sells:
                 sell_orders.append(self.prepare_order(i))
 
         return self.converge_orders(buy_orders, sell_orders)
 
+    def build_ladder(self, buys=True, sells=True):
+        """The same ladder as prepare_order() builds level by level, computed in one NumPy pass.
+
+        Returns (buy_orders, sell_orders) as array-backed LadderSides. See utils.ladder."""
+        random_size = (settings.MIN_ORDER_SIZE, settings.MAX_ORDER_SIZE) if settings.RANDOM_ORDER_SIZE is True else None
+        return ladder.build_ladder(self.start_ticks_buy, self.start_ticks_sell, settings.ORDER_PAIRS, settings.INTERVAL,
+                                   self.instrument['tickUnits'], self.instrument['tickScale'],
+                                   start_size=settings.ORDER_START_SIZE, step_size=settings.ORDER_STEP_SIZE,
+                                   random_size=random_size, maintain_spreads=settings.MAINTAIN_SPREADS,
+                                   buys=buys, sells=sells)
+
     def prepare_order(self, index):
         """Create an order object."""
 
@@ -339,83 +454,79 @@ class OrderManager:
     def converge_orders(self, buy_orders, sell_orders):
         """Converge the orders we currently have in the book with what we want to be in the book.
            This involves amending any open orders and creating new ones if any have filled completely.
-           We start from the closest orders outward."""
+           See utils/reconcile.py for how existing orders are matched up with desired ones."""
 
         tickLog = self.exchange.get_instrument()['tickLog']
-        to_amend = []
-        to_create = []
-        to_cancel = []
-        buys_matched = 0
-        sells_matched = 0
         existing_orders = self.exchange.get_orders()
 
-        # Check all existing orders and match them up with what we want to place.
-        # If there's an open one, we might be able to amend it to fit what we want.
-        for order in existing_orders:
-            try:
-                if order['side'] == 'Buy':
-                    desired_order = buy_orders[buys_matched]
-                    buys_matched += 1
-                else:
-                    desired_order = sell_orders[sells_matched]
-                    sells_matched += 1
-
-                # Found an existing order. Do we need to amend it?
-                if desired_order['orderQty'] != order['leavesQty'] or (
-                        # If price has changed, and the change is more than our RELIST_INTERVAL, amend.
-                        desired_order['price'] != order['price'] and
-                        abs((desired_order['price'] / order['price']) - 1) > settings.RELIST_INTERVAL):
-                    to_amend.append({'orderID': order['orderID'], 'orderQty': order['cumQty'] + desired_order['orderQty'],
-                                     'price': desired_order['price'], 'side': order['side']})
-            except IndexError:
-                # Will throw if there isn't a desired order to match. In that case, cancel it.
-                to_cancel.append(order)
-
-        while buys_matched < len(buy_orders):
-            to_create.append(buy_orders[buys_matched])
-            buys_matched += 1
-
-        while sells_matched < len(sell_orders):
-            to_create.append(sell_orders[sells_matched])
-            sells_matched += 1
+        # Match existing orders to what we want to place by price, not by position, so a fill at the
+        # inside doesn't shift every level along. Orders within RELIST_INTERVAL of a desired order, in
+        # both price and quantity, are left alone and keep their place in the queue.
+        plan = reconcile.plan_orders(existing_orders, buy_orders, sell_orders, settings.RELIST_INTERVAL)
+        # If the rate limit can't pay for all of it, send the inner levels now and leave the rest for later ticks.
+        plan = ratelimit.schedule(plan, self.exchange.get_rate_budget(), settings.RATE_LIMIT_RESERVE,
+                                  settings.RATE_LIMIT_PROTECT_LEVELS)
+        to_amend, to_create, to_cancel = plan.to_amend, plan.to_create, plan.to_cancel
+        if plan:
+            logger.info(plan)
+
+        # Could happen if we exceed a delta limit
+        if len(to_cancel) > 0:
+            logger.info("Canceling %d orders:" % (len(to_cancel)))
+            for order in reversed(to_cancel):
+                logger.info("%4s %d @ %.*f" % (order['side'], order['leavesQty'], tickLog, order['price']))
 
         if len(to_amend) > 0:
+            existing_by_id = {o['orderID']: o for o in existing_orders}
             for amended_order in reversed(to_amend):
-                reference_order = [o for o in existing_orders if o['orderID'] == amended_order['orderID']][0]
+                reference_order = existing_by_id[amended_order['orderID']]
                 logger.info("Amending %4s: %d @ %.*f to %d @ %.*f (%+.*f)" % (
                     amended_order['side'],
                     reference_order['leavesQty'], tickLog, reference_order['price'],
                     (amended_order['orderQty'] - reference_order['cumQty']), tickLog, amended_order['price'],
                     tickLog, (amended_order['price'] - reference_order['price'])
                 ))
-            # This can fail if an order has closed in the time we were processing.
-            # The API will send us `invalid ordStatus`, which means that the order's status (Filled/Canceled)
-            # made it not amendable.
-            # If that happens, we need to catch it and re-tick.
-            try:
-                self.exchange.amend_bulk_orders(to_amend)
-            except requests.exceptions.HTTPError as e:
-                errorObj = e.response.json()
-                if errorObj['error']['message'] == 'Invalid ordStatus':
-                    logger.warn("Amending failed. Waiting for order data to converge and retrying.")
-                    sleep(0.5)
-                    return self.place_orders()
-                else:
-                    logger.error("Unknown error on amend: %s. Exiting" % errorObj)
-                    sys.exit(1)
 
         if len(to_create) > 0:
             logger.info("Creating %d orders:" % (len(to_create)))
             for order in reversed(to_create):
                 logger.info("%4s %d @ %.*f" % (order['side'], order['orderQty'], tickLog, order['price']))
-            self.exchange.create_bulk_orders(to_create)
 
-        # Could happen if we exceed a delta limit
-        if len(to_cancel) > 0:
-            logger.info("Canceling %d orders:" % (len(to_cancel)))
-            for order in reversed(to_cancel):
-                logger.info("%4s %d @ %.*f" % (order['side'], order['leavesQty'], tickLog, order['price']))
-            self.exchange.cancel_bulk_orders(to_cancel)
+        # Cancels are listed first: sequentially they go first, and in parallel they never wait on the creates.
+        results = self.exchange.dispatch([
+            ('cancel', self.exchange.cancel_bulk_orders, to_cancel),
+            ('amend', self.exchange.amend_bulk_orders, to_amend),
+            ('create', self.exchange.create_bulk_orders, to_create),
+        ])
+
+        # dispatch() has waited for every batch, so creates and cancels sent alongside a failed amend have
+        # landed (or failed) and are in order_state: re-planning below can't duplicate them. Deal with their
+        # failures first, so a re-plan doesn't swallow them.
+        for name, result in results.items():
+            if name == 'amend' and isinstance(result, requests.exceptions.HTTPError):
+                continue
+            if isinstance(result, errors.RetriesExhaustedError):
+                # Out of retries or past its deadline. order_state has rolled it back, so the next tick plans it again.
+                logger.warning("Giving up on this tick's %s: %s" % (name, result))
+            elif isinstance(result, BaseException):
+                raise result
+
+        # An amend can fail if an order has closed in the time we were processing.
+        # The API will send us `invalid ordStatus`, which means that the order's status (Filled/Canceled)
+        # made it not amendable.
+        # If that happens, we need to catch it and re-tick.
+        # (With the order gateway the results are Futures, and the gateway handles this itself. See dispatch().)
+        error = results.get('amend')
+        if isinstance(error, requests.exceptions.HTTPError):
+            errorObj = error.response.json()
+            if errorObj['error']['message'] == 'Invalid ordStatus':
+                logger.warn("Amending failed. Waiting for order data to converge and retrying.")
+                sleep(0.5)
+                return self.place_orders()
+            else:
+                logger.error("Unknown error on amend: %s. Exiting" % errorObj)
+                sys.exit(1)
+        return results
 
     ###
     # Position Limits
@@ -488,6 +599,7 @@ class OrderManager:
         logger.info("Shutting down. All open orders will be cancelled.")
         try:
             self.exchange.cancel_all_orders()
+            self.exchange.stop_heartbeat()
             self.exchange.bitmex.exit()
         except errors.AuthenticationError as e:
             logger.info("Was not authenticated; could not cancel orders.")
@@ -502,7 +614,7 @@ class OrderManager:
             sys.stdout.flush()
 
             self.check_file_change()
-            sleep(settings.LOOP_INTERVAL)
+            self.wait_for_tick()
 
             # This will restart on very short downtime, but if it's longer,
             # the MM will crash entirely as it is unable to connect to the WS on boot.
@@ -514,10 +626,93 @@ class OrderManager:
             self.print_status()  # Print skew, delta, etc
             self.place_orders()  # Creates desired orders and converges to existing orders
 
+    def wait_for_tick(self):
+        """Wait until it's time to re-quote.
+
+        By default that's every LOOP_INTERVAL seconds. With EVENT_DRIVEN, it's as soon as the websocket
+        reports a change that matters to our quotes (TICK_EVENTS), debounced by EVENT_DEBOUNCE and no
+        sooner than MIN_REACTION_INTERVAL after the last tick. LOOP_INTERVAL still caps the wait so quiet
+        markets get ticked too. Plain order events are left out: most are our own creates, amends and
+        cancels coming back, and ticking on those would re-quote after every converge."""
+        if not settings.EVENT_DRIVEN:
+            sleep(settings.LOOP_INTERVAL)
+            return
+
+        deadline = time() + settings.LOOP_INTERVAL
+        events = set()
+        while not events and time() < deadline:
+            events = self.__tick_events(self.exchange.wait_for_events(deadline - time()))
+        if events and settings.EVENT_DEBOUNCE:
+            sleep(settings.EVENT_DEBOUNCE)
+            events |= self.__tick_events(self.exchange.drain_events())
+
+        delay = self.last_tick + settings.MIN_REACTION_INTERVAL - time()
+        if delay > 0:
+            sleep(delay)
+        self.last_tick = time()
+        if events:
+            logger.debug("Ticking on %s" % ", ".join(sorted(event for event, symbol in events)))
+
+    def __tick_events(self, events):
+        return set(e for e in events if e[0] in self.TICK_EVENTS)
+
     def restart(self):
         logger.info("Restarting the market maker...")
         os.execv(sys.executable, [sys.executable] + sys.argv)
 
+class MultiSymbolOrderManager:
+    """Quote several symbols from one process.
+
+    All symbols share one BitMEX connector: one websocket with per-symbol subscriptions, one auth
+    handshake, one instrument stream and one REST session. Each symbol gets its own OrderManager
+    for its per-symbol state, and every tick converges all of them in turn.
+    """
+
+    def __init__(self, symbols, connector=None):
+        self.bitmex = connector or make_connector(symbols[0], symbols)
+        self.managers = []
+        atexit.register(self.exit)
+        signal.signal(signal.SIGTERM, self.exit)
+
+        logger.info("Using symbols %s." % ", ".join(symbols))
+        for symbol in symbols:
+            exchange = ExchangeInterface(settings.DRY_RUN, symbol=symbol, connector=self.bitmex)
+            self.managers.append(OrderManager(exchange))
+
+    def exit(self):
+        logger.info("Shutting down. All open orders will be cancelled.")
+        try:
+            for manager in self.managers:
+                manager.exchange.cancel_all_orders()
+            self.managers[0].exchange.stop_heartbeat()
+            self.bitmex.exit()
+        except errors.AuthenticationError as e:
+            logger.info("Was not authenticated; could not cancel orders.")
+        except Exception as e:
+            logger.info("Unable to cancel orders: %s" % e)
+
+        sys.exit()
+
+    def run_loop(self):
+        # Connection, file watching and tick timing are shared, so any one manager can handle them.
+        lead = self.managers[0]
+        while True:
+            sys.stdout.write("-----\n")
+            sys.stdout.flush()
+
+            lead.check_file_change()
+            lead.wait_for_tick()
+
+            if not lead.check_connection():
+                logger.error("Realtime data connection unexpectedly closed, restarting.")
+                lead.restart()
+
+            for manager in self.managers:
+                manager.sanity_check()
+                manager.print_status()
+                manager.place_orders()
+
+
 #
 # Helpers
 #
@@ -540,7 +735,10 @@ def margin(instrument, quantity, price):
 def run():
     logger.info('BitMEX Market Maker Version: %s\n' % constants.VERSION)
 
-    om = OrderManager()
+    if settings.SYMBOLS:
+        om = MultiSymbolOrderManager(settings.SYMBOLS)
+    else:
+        om = OrderManager()
     # Try/except just keeps ctrl-c from printing an ugly stacktrace
     try:
         om.run_loop()
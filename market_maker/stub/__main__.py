@@ -0,0 +1,36 @@
+import argparse
+import time
+
+from market_maker.stub.exchange import StubExchange
+from market_maker.stub.server import StubServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local BitMEX stand-in for load and latency testing')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--symbols', default='XBTUSD', help='Comma separated')
+    parser.add_argument('--price', type=float, default=10000.0, help='Starting mid price')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response and frame')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many more seconds, at random')
+    parser.add_argument('--rate-limit', type=int, default=None, help='Requests per --rate-window, then 429')
+    parser.add_argument('--rate-window', type=int, default=60)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Chance of a 503 per REST request')
+    parser.add_argument('--interval', type=float, default=0.1, help='Seconds between market steps')
+    parser.add_argument('--api-secret', default=None, help='Check request signatures against this secret')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    exchange = StubExchange(symbols=args.symbols.split(','), price=args.price, seed=args.seed)
+    server = StubServer(args.host, args.port, exchange, latency=args.latency, jitter=args.jitter,
+                        rate_limit=args.rate_limit, rate_window=args.rate_window, error_rate=args.error_rate,
+                        market_interval=args.interval, api_secret=args.api_secret, seed=args.seed).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""In-memory exchange behind the stub server: a synthetic market per symbol plus one account's orders."""
+import datetime
+import random
+import threading
+import time
+import uuid
+
+from market_maker.utils import constants
+
+
+class StubError(Exception):
+
+    """An API error, returned to the client as `status` with BitMEX's error body."""
+
+    def __init__(self, status, message, name='HTTPError'):
+        super(StubError, self).__init__(message)
+        self.status = status
+        self.message = message
+        self.name = name
+
+
+# Keys of each table, as sent in its partial.
+TABLE_KEYS = {
+    'instrument': ['symbol'],
+    'quote': [],
+    'trade': [],
+    'orderBookL2': ['symbol', 'id', 'side'],
+    'order': ['orderID'],
+    'execution': ['execID'],
+    'position': ['account', 'symbol', 'currency'],
+    'margin': ['account', 'currency'],
+}
+
+TERMINAL_STATUSES = ('Filled', 'Canceled', 'Rejected')
+
+
+def timestamp():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class StubExchange(object):
+
+    """State of a small exchange with a single account.
+
+    Each symbol has a synthetic market: a mid price that random walks one tick at a time, `depth`
+    levels of liquidity either side of it, and random trade prints. Our orders rest alongside that
+    liquidity and are shown in the L2 book. They fill when a trade print reaches their price or the
+    market moves through them, with price then time priority. Orders that cross the market on entry
+    take liquidity at the touch, or are canceled if they are post-only.
+
+    Every change is passed to `listener(table, action, rows)` while holding `lock`, so a listener
+    that also takes `lock` to send partials sees each change exactly once.
+    """
+
+    def __init__(self, symbols=('XBTUSD',), price=10000.0, tick_size=0.5, depth=25, trade_rate=0.5,
+                 balance=1 * constants.XBt_TO_XBT, account=1, seed=None):
+        self.lock = threading.RLock()
+        self.listener = None
+        self.depth = depth
+        self.trade_rate = trade_rate
+        self.account = account
+        self.random = random.Random(seed)
+
+        self.instruments = {}
+        self.markets = {}
+        self.positions = {}
+        self.orders = {}
+        self.clOrdIDs = {}
+        self.published_book = {}
+        self.cancel_all_at = None  # cancelAllAfter deadline, epoch seconds
+        for symbol in symbols:
+            self.instruments[symbol] = self.__new_instrument(symbol, tick_size)
+            self.markets[symbol] = {'mid': int(round(price / tick_size)), 'bids': {}, 'asks': {}}
+            self.positions[symbol] = {
+                'account': account, 'symbol': symbol, 'currency': 'XBt', 'underlying': 'XBT',
+                'quoteCurrency': 'USD', 'currentQty': 0, 'avgCostPrice': None, 'avgEntryPrice': None,
+                'markPrice': price, 'leverage': 0, 'crossMargin': True, 'isOpen': False, 'realisedPnl': 0,
+            }
+            self.published_book[symbol] = {}
+            self.__reseed_liquidity(symbol)
+            self.__update_prices(symbol)
+        self.margin = {
+            'account': account, 'currency': 'XBt', 'walletBalance': balance, 'marginBalance': balance,
+            'availableFunds': balance, 'realisedPnl': 0,
+        }
+
+    #
+    # Queries
+    #
+    def partial(self, table, symbol=None):
+        """Rows for a table's partial, optionally filtered to one symbol."""
+        if table == 'instrument':
+            rows = list(self.instruments.values())
+        elif table == 'orderBookL2':
+            rows = [row for s in self.instruments for row in self.book_rows(s)]
+        elif table == 'order':
+            rows = [o for o in self.orders.values() if o['ordStatus'] not in TERMINAL_STATUSES]
+        elif table == 'position':
+            rows = list(self.positions.values())
+        elif table == 'margin':
+            rows = [self.margin]
+        elif table == 'quote':
+            rows = [self.quote(s) for s in self.instruments]
+        else:
+            rows = []  # trade and execution partials start empty
+        if symbol is not None:
+            rows = [row for row in rows if row.get('symbol') == symbol]
+        return [dict(row) for row in rows]
+
+    def find_orders(self, filter=None, count=None, reverse=False):
+        filter = filter or {}
+        orders = sorted(self.orders.values(), key=lambda o: o['transactTime'], reverse=reverse)
+        for field, value in filter.items():
+            if field == 'ordStatus.isTerminated':
+                orders = [o for o in orders if (o['ordStatus'] in TERMINAL_STATUSES) == value]
+            elif isinstance(value, list):
+                orders = [o for o in orders if o.get(field) in value]
+            else:
+                orders = [o for o in orders if o.get(field) == value]
+        return [dict(o) for o in orders[:count]]
+
+    def quote(self, symbol):
+        bid, ask = self.touch(symbol)
+        tick = self.instruments[symbol]['tickSize']
+        market = self.markets[symbol]
+        return {'timestamp': timestamp(), 'symbol': symbol,
+                'bidPrice': bid * tick, 'bidSize': market['bids'].get(bid, 0),
+                'askPrice': ask * tick, 'askSize': market['asks'].get(ask, 0)}
+
+    def touch(self, symbol):
+        """Best synthetic bid and ask, in ticks."""
+        market = self.markets[symbol]
+        return max(market['bids']), min(market['asks'])
+
+    def book_rows(self, symbol):
+        """The top `depth` L2 levels per side: synthetic liquidity plus our resting orders."""
+        tick = self.instruments[symbol]['tickSize']
+        market = self.markets[symbol]
+        levels = {'Buy': dict(market['bids']), 'Sell': dict(market['asks'])}
+        for order in self.__resting(symbol):
+            side = levels[order['side']]
+            price = self.__ticks(order['price'], symbol)
+            side[price] = side.get(price, 0) + order['leavesQty']
+        rows = []
+        for side, prices in levels.items():
+            for price in sorted(prices, reverse=side == 'Buy')[:self.depth]:
+                rows.append({'symbol': symbol, 'id': book_id(symbol, price * tick), 'side': side,
+                             'size': prices[price], 'price': price * tick})
+        return rows
+
+    #
+    # Order entry
+    #
+    def place(self, order):
+        """Validate and enter a new order. Returns the order row."""
+        with self.lock:
+            symbol = order.get('symbol')
+            if symbol not in self.instruments:
+                raise StubError(400, 'Invalid symbol', 'ValidationError')
+            qty = order.get('orderQty')
+            side = order.get('side') or ('Buy' if qty and qty > 0 else 'Sell')
+            qty = abs(qty or 0)
+            if not qty:
+                raise StubError(400, 'Invalid orderQty', 'ValidationError')
+            price = self.__check_price(order.get('price'), symbol)
+            clOrdID = order.get('clOrdID') or ''
+            if clOrdID and clOrdID in self.clOrdIDs:
+                raise StubError(400, 'Duplicate clOrdID', 'ValidationError')
+
+            now = timestamp()
+            row = {
+                'orderID': str(uuid.uuid4()), 'clOrdID': clOrdID, 'account': self.account, 'symbol': symbol,
+                'side': side, 'orderQty': qty, 'price': price, 'leavesQty': qty, 'cumQty': 0, 'avgPx': None,
+                'ordType': 'Limit', 'ordStatus': 'New', 'execInst': order.get('execInst', ''),
+                'workingIndicator': True, 'text': order.get('text', 'Submitted via API.'),
+                'timestamp': now, 'transactTime': now,
+            }
+            self.orders[row['orderID']] = row
+            if clOrdID:
+                self.clOrdIDs[clOrdID] = row['orderID']
+            self.__emit('order', 'insert', [dict(row)])
+            self.__execution(row, 'New')
+            self.__cross(row)
+            self.__publish_book(symbol)
+            return dict(row)
+
+    def amend(self, amend):
+        """Amend price and/or quantity of a resting order. Returns the order row."""
+        with self.lock:
+            row = self.__lookup(amend.get('orderID'), amend.get('origClOrdID'))
+            if row is None:
+                raise StubError(400, 'Invalid orderID', 'ValidationError')
+            if row['ordStatus'] in TERMINAL_STATUSES:
+                raise StubError(400, 'Invalid ordStatus', 'ValidationError')
+            newClOrdID = amend.get('clOrdID') if amend.get('origClOrdID') else None
+            if newClOrdID and newClOrdID in self.clOrdIDs:
+                raise StubError(400, 'Duplicate clOrdID', 'ValidationError')
+
+            changes = {}
+            if amend.get('price') is not None:
+                changes['price'] = self.__check_price(amend['price'], row['symbol'])
+            if amend.get('leavesQty') is not None:
+                changes['leavesQty'] = amend['leavesQty']
+                changes['orderQty'] = row['cumQty'] + amend['leavesQty']
+            elif amend.get('orderQty') is not None:
+                changes['orderQty'] = abs(amend['orderQty'])
+                changes['leavesQty'] = changes['orderQty'] - row['cumQty']
+            if changes.get('leavesQty', 1) <= 0:
+                raise StubError(400, 'Invalid leavesQty', 'ValidationError')
+            if newClOrdID:
+                del self.clOrdIDs[row['clOrdID']]
+                self.clOrdIDs[newClOrdID] = row['orderID']
+                changes['clOrdID'] = newClOrdID
+                changes['origClOrdID'] = row['clOrdID']
+
+            self.__change(row, changes)
+            self.__execution(row, 'Replaced')
+            self.__cross(row)
+            self.__publish_book(row['symbol'])
+            return dict(row)
+
+    def cancel(self, orderIDs=None, clOrdIDs=None, text=None):
+        """Cancel orders by ID. Returns a row per ID; ones that couldn't be canceled carry an `error`."""
+        with self.lock:
+            results = []
+            symbols = set()
+            ids = [(i, None) for i in as_list(orderIDs)] + [(None, c) for c in as_list(clOrdIDs)]
+            for orderID, clOrdID in ids:
+                row = self.__lookup(orderID, clOrdID)
+                if row is None:
+                    results.append({'orderID': orderID, 'clOrdID': clOrdID, 'error': 'Not Found'})
+                elif row['ordStatus'] in TERMINAL_STATUSES:
+                    result = dict(row)
+                    result['error'] = 'Unable to cancel order due to existing state: %s' % row['ordStatus']
+                    results.append(result)
+                else:
+                    self.__change(row, {'ordStatus': 'Canceled', 'leavesQty': 0, 'workingIndicator': False,
+                                        'text': text or 'Canceled: Canceled via API.'})
+                    self.__execution(row, 'Canceled')
+                    symbols.add(row['symbol'])
+                    results.append(dict(row))
+            for symbol in symbols:
+                self.__publish_book(symbol)
+            return results
+
+    def set_leverage(self, symbol, leverage):
+        with self.lock:
+            if symbol not in self.positions:
+                raise StubError(400, 'Invalid symbol', 'ValidationError')
+            position = self.positions[symbol]
+            position.update({'leverage': leverage, 'crossMargin': not leverage})
+            self.__emit('position', 'update', [{'account': self.account, 'symbol': symbol, 'currency': 'XBt',
+                                                'leverage': leverage, 'crossMargin': not leverage}])
+            return dict(position)
+
+    #
+    # Market simulation
+    #
+    def cancel_all(self, symbol=None, filter=None, text=None):
+        """Cancel every open order, or every one on `symbol` and/or matching `filter`."""
+        with self.lock:
+            filter = dict(filter or {})
+            if symbol:
+                filter['symbol'] = symbol
+            open_orders = [o for o in self.orders.values() if o['ordStatus'] not in TERMINAL_STATUSES and
+                           all(o.get(k) == v for k, v in filter.items())]
+            if not open_orders:
+                return []
+            return self.cancel([o['orderID'] for o in open_orders], text=text)
+
+    def cancel_all_after(self, timeout):
+        """Dead man's switch: cancel everything unless called again within `timeout` ms. 0 disarms it."""
+        with self.lock:
+            now = time.time()
+            self.cancel_all_at = now + timeout / 1000.0 if timeout else None
+            result = {'now': timestamp()}
+            if self.cancel_all_at is not None:
+                result['cancelTime'] = datetime.datetime.utcfromtimestamp(self.cancel_all_at).strftime(
+                    '%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+            return result
+
+    def step(self):
+        """Advance every synthetic market by one step: maybe move the mid, maybe print a trade."""
+        with self.lock:
+            if self.cancel_all_at is not None and time.time() >= self.cancel_all_at:
+                self.cancel_all_at = None
+                self.cancel_all(text='Canceled: Cancel all after timeout expired.')
+            for symbol, market in self.markets.items():
+                move = self.random.choice((-1, 0, 0, 1))
+                if move:
+                    market['mid'] += move
+                    self.__reseed_liquidity(symbol)
+                    # The market moved through any of our orders it now crosses.
+                    for order in list(self.__resting(symbol)):
+                        self.__cross(order, passive=True)
+                else:
+                    for side in (market['bids'], market['asks']):
+                        price = self.random.choice(list(side))
+                        side[price] = self.__random_size()
+                if self.random.random() < self.trade_rate:
+                    self.__print_trade(symbol)
+                self.__update_prices(symbol)
+                self.__publish_book(symbol)
+                self.__emit('quote', 'insert', [self.quote(symbol)])
+
+    #
+    # Private methods
+    #
+    def __new_instrument(self, symbol, tick_size):
+        return {
+            'symbol': symbol, 'rootSymbol': symbol[:3], 'state': 'Open', 'typ': 'FFWCSX',
+            'underlying': symbol[:3], 'quoteCurrency': symbol[3:] or 'USD', 'settlCurrency': 'XBt',
+            'tickSize': tick_size, 'lotSize': 1, 'multiplier': -constants.XBt_TO_XBT,
+            'underlyingToSettleMultiplier': -constants.XBt_TO_XBT, 'quoteToSettleMultiplier': None,
+            'isQuanto': False, 'isInverse': True, 'initMargin': 0.01, 'maintMargin': 0.005,
+            'makerFee': -0.00025, 'takerFee': 0.00075,
+        }
+
+    def __random_size(self):
+        return self.random.randint(1, 200) * 100
+
+    def __reseed_liquidity(self, symbol):
+        """Rebuild the synthetic levels around the mid, keeping sizes of levels that survive the move."""
+        market = self.markets[symbol]
+        mid = market['mid']
+        bids, asks = market['bids'], market['asks']
+        market['bids'] = {p: bids.get(p) or self.__random_size() for p in range(mid - 1, mid - 1 - self.depth, -1)}
+        market['asks'] = {p: asks.get(p) or self.__random_size() for p in range(mid + 1, mid + 1 + self.depth)}
+
+    def __update_prices(self, symbol):
+        bid, ask = self.touch(symbol)
+        tick = self.instruments[symbol]['tickSize']
+        mid = self.markets[symbol]['mid'] * tick
+        instrument = self.instruments[symbol]
+        changes = {'bidPrice': bid * tick, 'askPrice': ask * tick, 'midPrice': mid, 'markPrice': mid,
+                   'fairPrice': mid, 'indicativeSettlePrice': mid, 'lastPrice': instrument.get('lastPrice') or mid,
+                   'timestamp': timestamp()}
+        instrument.update(changes)
+        self.__emit('instrument', 'update', [dict(changes, symbol=symbol)])
+
+    def __print_trade(self, symbol):
+        """An outside aggressor trades at the touch, filling any of our orders at or through that price first."""
+        side = self.random.choice(('Buy', 'Sell'))
+        bid, ask = self.touch(symbol)
+        tick = self.instruments[symbol]['tickSize']
+        price = (ask if side == 'Buy' else bid) * tick
+        size = self.__random_size()
+        remaining = size
+        ours = [o for o in self.__resting(symbol) if o['side'] != side and
+                (o['price'] <= price if side == 'Buy' else o['price'] >= price)]
+        ours.sort(key=lambda o: (o['price'] if side == 'Buy' else -o['price'], o['transactTime']))
+        for order in ours:
+            if not remaining:
+                break
+            qty = min(remaining, order['leavesQty'])
+            self.__fill(order, qty, order['price'], maker=True)
+            remaining -= qty
+        self.instruments[symbol]['lastPrice'] = price
+        self.__emit('trade', 'insert', [{
+            'timestamp': timestamp(), 'symbol': symbol, 'side': side, 'size': size, 'price': price,
+            'tickDirection': 'ZeroPlusTick', 'trdMatchID': str(uuid.uuid4()),
+        }])
+
+    def __cross(self, order, passive=False):
+        """Handle an order that crosses the synthetic market.
+
+        Entered or amended orders take liquidity at the touch, unless they're post-only, in which case
+        they're canceled. Resting orders the market has moved through (`passive`) fill as the maker."""
+        if order['ordStatus'] in TERMINAL_STATUSES:
+            return
+        symbol = order['symbol']
+        bid, ask = self.touch(symbol)
+        tick = self.instruments[symbol]['tickSize']
+        price = self.__ticks(order['price'], symbol)
+        crosses = price >= ask if order['side'] == 'Buy' else price <= bid
+        if not crosses:
+            return
+        if passive:
+            self.__fill(order, order['leavesQty'], order['price'], maker=True)
+        elif 'ParticipateDoNotInitiate' in (order['execInst'] or ''):
+            self.__change(order, {'ordStatus': 'Canceled', 'leavesQty': 0, 'workingIndicator': False,
+                                  'text': 'Canceled: Order had execInst of ParticipateDoNotInitiate'})
+            self.__execution(order, 'Canceled')
+        else:
+            self.__fill(order, order['leavesQty'], (ask if order['side'] == 'Buy' else bid) * tick, maker=False)
+
+    def __fill(self, order, qty, price, maker):
+        cumQty = order['cumQty'] + qty
+        avgPx = ((order['avgPx'] or 0) * order['cumQty'] + price * qty) / cumQty
+        leavesQty = order['leavesQty'] - qty
+        self.__change(order, {'cumQty': cumQty, 'leavesQty': leavesQty, 'avgPx': avgPx,
+                              'ordStatus': 'Filled' if not leavesQty else 'PartiallyFilled',
+                              'workingIndicator': bool(leavesQty)})
+        self.__execution(order, 'Trade', lastQty=qty, lastPx=price,
+                         lastLiquidityInd='AddedLiquidity' if maker else 'RemovedLiquidity')
+
+        position = self.positions[order['symbol']]
+        signed = qty if order['side'] == 'Buy' else -qty
+        current = position['currentQty']
+        newQty = current + signed
+        if newQty == 0:
+            avgCost = None
+        elif current == 0 or (current > 0) != (newQty > 0):
+            avgCost = price
+        elif abs(newQty) > abs(current):
+            avgCost = (position['avgCostPrice'] * abs(current) + price * qty) / abs(newQty)
+        else:
+            avgCost = position['avgCostPrice']
+        changes = {'currentQty': newQty, 'avgCostPrice': avgCost, 'avgEntryPrice': avgCost, 'isOpen': newQty != 0}
+        position.update(changes)
+        self.__emit('position', 'update', [dict(changes, account=self.account, symbol=order['symbol'],
+                                                currency='XBt')])
+
+    def __change(self, order, changes):
+        changes['timestamp'] = changes['transactTime'] = timestamp()
+        order.update(changes)
+        self.__emit('order', 'update', [dict(changes, orderID=order['orderID'], symbol=order['symbol'],
+                                             side=order['side'], clOrdID=order['clOrdID'])])
+
+    def __execution(self, order, execType, **fields):
+        row = dict(order, execID=str(uuid.uuid4()), execType=execType, **fields)
+        self.__emit('execution', 'insert', [row])
+
+    def __publish_book(self, symbol):
+        """Send the changes to the top of the L2 book since we last published it."""
+        rows = {(row['side'], row['id']): row for row in self.book_rows(symbol)}
+        published = self.published_book[symbol]
+        deleted = [{'symbol': symbol, 'id': id, 'side': side} for (side, id) in published if (side, id) not in rows]
+        inserted = [row for key, row in rows.items() if key not in published]
+        updated = [{'symbol': symbol, 'id': row['id'], 'side': row['side'], 'size': row['size']}
+                   for key, row in rows.items() if key in published and published[key] != row['size']]
+        self.published_book[symbol] = {key: row['size'] for key, row in rows.items()}
+        if deleted:
+            self.__emit('orderBookL2', 'delete', deleted)
+        if inserted:
+            self.__emit('orderBookL2', 'insert', inserted)
+        if updated:
+            self.__emit('orderBookL2', 'update', updated)
+
+    def __resting(self, symbol):
+        return [o for o in self.orders.values() if o['symbol'] == symbol and o['ordStatus'] not in TERMINAL_STATUSES]
+
+    def __lookup(self, orderID=None, clOrdID=None):
+        if orderID:
+            return self.orders.get(orderID)
+        if clOrdID:
+            return self.orders.get(self.clOrdIDs.get(clOrdID))
+        return None
+
+    def __check_price(self, price, symbol):
+        if price is None or price <= 0:
+            raise StubError(400, 'Invalid price', 'ValidationError')
+        tick = self.instruments[symbol]['tickSize']
+        if abs(price / tick - round(price / tick)) > 1e-9:
+            raise StubError(400, 'Invalid price tickSize', 'ValidationError')
+        return price
+
+    def __ticks(self, price, symbol):
+        return int(round(price / self.instruments[symbol]['tickSize']))
+
+    def __emit(self, table, action, rows):
+        if self.listener is not None:
+            self.listener(table, action, rows)
+
+
+def book_id(symbol, price):
+    """L2 level id, BitMEX style: a per-symbol base minus the price in cents."""
+    base = 8800000000 + 100000000 * (sum(map(ord, symbol)) % 50)
+    return base - int(round(price * 100))
+
+
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
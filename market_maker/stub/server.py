@@ -0,0 +1,489 @@
+"""HTTP and websocket front end of the stub server. Standard library only."""
+import base64
+import hashlib
+import hmac
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from market_maker.stub.exchange import StubError, StubExchange, TABLE_KEYS, timestamp
+from market_maker.utils import log
+
+logger = log.setup_custom_logger('root')
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Websocket tables that are served from another exchange table.
+TABLE_ALIASES = {'orderBookL2_25': 'orderBookL2'}
+
+# Tables that need an authenticated connection.
+PRIVATE_TABLES = ('order', 'execution', 'position', 'margin')
+
+OVERLOADED = 'The system is currently overloaded. Please try again later.'
+
+
+class StubServer(object):
+
+    """A stand-in for BitMEX on localhost: /api/v1 REST and /realtime websocket, on one port.
+
+        server = StubServer(port=3000, latency=0.02, jitter=0.01).start()
+        bitmex = BitMEX(base_url=server.base_url, symbol='XBTUSD', apiKey='key', apiSecret='secret')
+
+    Market data and fills come from a StubExchange, stepped every `market_interval` seconds.
+
+    Faults can be set at construction or changed at any time:
+      * `latency` + up to `jitter` seconds are added to every REST response and websocket frame.
+      * `rate_limit` requests per `rate_window` seconds, per API key, then 429 with X-RateLimit-Reset.
+        Cancels are never limited and bulk orders cost one request per 10 orders, as on BitMEX.
+      * `error_rate` is the chance a REST request fails with 503 without being applied. outage()
+        fails them all for a while, and drop_websockets() disconnects every websocket.
+    If `api_secret` is set, request signatures are checked too.
+    """
+
+    def __init__(self, host='localhost', port=3000, exchange=None, latency=0.0, jitter=0.0, rate_limit=None,
+                 rate_window=60, error_rate=0.0, market_interval=0.1, api_secret=None, seed=None):
+        self.exchange = exchange or StubExchange(seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.market_interval = market_interval
+        self.api_secret = api_secret
+        self.random = random.Random(seed)
+        self.outage_until = 0
+        self.requests = 0
+
+        self.sessions = set()
+        self.sessions_lock = threading.Lock()
+        self.rate_counts = {}
+        self.rate_lock = threading.Lock()
+        self.exchange.listener = self.__broadcast
+
+        self.httpd = ThreadingHTTPServer((host, port), StubRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.running = False
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d/api/v1/' % (host, port)
+
+    def start(self):
+        """Serve and run the market in background threads. Returns self."""
+        self.running = True
+        for target in (self.httpd.serve_forever, self.__run_market):
+            thread = threading.Thread(target=target, name='stub-server')
+            thread.daemon = True
+            thread.start()
+        logger.info("Stub BitMEX listening on %s" % self.base_url)
+        return self
+
+    def stop(self):
+        self.running = False
+        self.drop_websockets()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def outage(self, seconds):
+        """Fail every REST request with 503 for the next `seconds` seconds."""
+        self.outage_until = time.time() + seconds
+
+    def drop_websockets(self):
+        with self.sessions_lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.close()
+
+    def delay(self):
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+
+    #
+    # Used by the request handler
+    #
+    def check_rate_limit(self, apiKey, cost):
+        """Charge `cost` requests to `apiKey`. Returns (limit, remaining, reset) headers, or raises a 429."""
+        if not self.rate_limit:
+            return None
+        now = time.time()
+        with self.rate_lock:
+            reset, used = self.rate_counts.get(apiKey, (0, 0))
+            if now >= reset:
+                reset, used = int(now) + self.rate_window, 0
+            if used + cost > self.rate_limit:
+                raise RateLimited(self.rate_limit, reset)
+            used += cost
+            self.rate_counts[apiKey] = (reset, used)
+        return self.rate_limit, self.rate_limit - used, reset
+
+    def check_signature(self, verb, path, headers, body):
+        if not headers.get('api-key'):
+            raise StubError(401, 'Missing API key.')
+        if self.api_secret is None:
+            return
+        expires = headers.get('api-expires', '0')
+        if int(expires) < time.time():
+            raise StubError(401, 'This request has expired - `expires` is in the past.')
+        message = (verb + path + expires + body).encode('utf-8')
+        signature = hmac.new(self.api_secret.encode('utf-8'), message, digestmod=hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature, headers.get('api-signature', '')):
+            raise StubError(401, 'Signature not valid.')
+
+    def should_fail(self):
+        return time.time() < self.outage_until or (self.error_rate and self.random.random() < self.error_rate)
+
+    def add_session(self, session):
+        with self.sessions_lock:
+            self.sessions.add(session)
+
+    def remove_session(self, session):
+        with self.sessions_lock:
+            self.sessions.discard(session)
+
+    #
+    # Private methods
+    #
+    def __run_market(self):
+        while self.running:
+            time.sleep(self.market_interval)
+            self.exchange.step()
+
+    def __broadcast(self, table, action, rows):
+        """Exchange listener: fan a change out to every matching subscription. Called holding the exchange lock."""
+        with self.sessions_lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.publish(table, action, rows)
+
+
+class RateLimited(Exception):
+
+    def __init__(self, limit, reset):
+        super(RateLimited, self).__init__('Rate limit exceeded, retry in %d seconds.' % max(reset - time.time(), 0))
+        self.limit = limit
+        self.reset = reset
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, as the real API
+
+    def do_GET(self):
+        if self.path.startswith('/realtime'):
+            return self.__websocket()
+        self.__rest('GET')
+
+    def do_POST(self):
+        self.__rest('POST')
+
+    def do_PUT(self):
+        self.__rest('PUT')
+
+    def do_DELETE(self):
+        self.__rest('DELETE')
+
+    def log_message(self, format, *args):
+        logger.debug("stub: " + format, *args)
+
+    #
+    # REST
+    #
+    def __rest(self, verb):
+        stub = self.server.stub
+        stub.requests += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        url = urlparse(self.path)
+        route = url.path[len('/api/v1/'):].strip('/') if url.path.startswith('/api/v1/') else None
+        params = dict(parse_qsl(url.query))
+        if body:
+            params.update(json.loads(body))
+
+        delay = stub.delay()
+        if delay:
+            time.sleep(delay)
+
+        headers = {}
+        try:
+            if stub.should_fail():
+                raise StubError(503, OVERLOADED)
+            if route != 'instrument':
+                stub.check_signature(verb, self.path, {k.lower(): v for k, v in self.headers.items()}, body)
+            if not (verb == 'DELETE' and route and route.startswith('order')):
+                cost = int(math.ceil(len(params['orders']) / 10.0)) if route == 'order/bulk' else 1
+                limits = stub.check_rate_limit(self.headers.get('api-key'), max(cost, 1))
+                if limits:
+                    headers = {'X-RateLimit-Limit': limits[0], 'X-RateLimit-Remaining': limits[1],
+                               'X-RateLimit-Reset': limits[2]}
+            status, result = 200, self.__route(stub.exchange, verb, route, params)
+        except RateLimited as e:
+            status, result = 429, {'error': {'message': str(e), 'name': 'HTTPError'}}
+            headers = {'X-RateLimit-Limit': e.limit, 'X-RateLimit-Remaining': 0, 'X-RateLimit-Reset': e.reset,
+                       'Retry-After': max(int(math.ceil(e.reset - time.time())), 0)}
+        except StubError as e:
+            status, result = e.status, {'error': {'message': e.message, 'name': e.name}}
+        except (KeyError, TypeError, ValueError) as e:
+            status, result = 400, {'error': {'message': 'Invalid request: %s' % e, 'name': 'ValidationError'}}
+
+        payload = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def __route(self, exchange, verb, route, params):
+        if route == 'instrument' and verb == 'GET':
+            filter = json_param(params, 'filter') or {}
+            if 'symbol' in params:
+                filter['symbol'] = params['symbol']
+            return [dict(i) for i in exchange.instruments.values()
+                    if all(i.get(k) == v for k, v in filter.items())]
+        if route == 'order':
+            if verb == 'GET':
+                return exchange.find_orders(json_param(params, 'filter'), int(params.get('count', 100)),
+                                            str(params.get('reverse')).lower() == 'true')
+            if verb == 'POST':
+                return exchange.place(params)
+            if verb == 'PUT':
+                return exchange.amend(params)
+            if verb == 'DELETE':
+                results = exchange.cancel(json_param(params, 'orderID'), json_param(params, 'clOrdID'),
+                                          params.get('text'))
+                if results and all(r.get('error') == 'Not Found' for r in results):
+                    raise StubError(404, 'Not Found')
+                return results
+        if route == 'order/all' and verb == 'DELETE':
+            return exchange.cancel_all(params.get('symbol'), json_param(params, 'filter'), params.get('text'))
+        if route == 'order/cancelAllAfter' and verb == 'POST':
+            return exchange.cancel_all_after(int(params['timeout']))
+        if route == 'order/bulk':
+            if verb == 'POST':
+                return [exchange.place(order) for order in params['orders']]
+            if verb == 'PUT':
+                return [exchange.amend(order) for order in params['orders']]
+        if route == 'position' and verb == 'GET':
+            return exchange.partial('position')
+        if route == 'position/leverage' and verb == 'POST':
+            return exchange.set_leverage(params['symbol'], float(params['leverage']))
+        if route == 'user/margin' and verb == 'GET':
+            return exchange.partial('margin')[0]
+        raise StubError(404, 'Not Found')
+
+    #
+    # Websocket
+    #
+    def __websocket(self):
+        key = self.headers.get('Sec-WebSocket-Key')
+        if not key or 'websocket' not in (self.headers.get('Upgrade') or '').lower():
+            self.send_error(400, 'Expected a websocket upgrade')
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+
+        stub = self.server.stub
+        authed = bool(self.headers.get('api-key'))
+        session = WebsocketSession(stub, self.connection, authed)
+        stub.add_session(session)
+        try:
+            session.send({'info': 'Welcome to the BitMEX Realtime API.', 'version': 'stub',
+                          'timestamp': timestamp(), 'docs': '/app/wsAPI', 'limit': {'remaining': 40}})
+            query = dict(parse_qsl(urlparse(self.path).query))
+            if query.get('subscribe'):
+                topics = query['subscribe'].split(',')
+                for topic in topics:
+                    session.subscribe(topic, {'op': 'subscribe', 'args': topics})
+            session.serve()
+        finally:
+            stub.remove_session(session)
+            session.close()
+
+
+class WebsocketSession(object):
+
+    """One client connection: RFC 6455 framing, subscriptions, and a paced outbound queue.
+
+    Frames are queued with a due time (now + the server's latency and jitter, never earlier than
+    the frame before) and written by a sender thread, so a slow client never holds up the exchange.
+    """
+
+    def __init__(self, stub, sock, authed):
+        self.stub = stub
+        self.sock = sock
+        self.authed = authed
+        self.subscriptions = {}  # exchange table -> [(subscribed table name, symbol or None)]
+        self.closed = False
+        self.outbox = deque()
+        self.ready = threading.Condition()
+        self.last_due = 0
+        self.sender = threading.Thread(target=self.__send_loop, name='stub-ws-sender')
+        self.sender.daemon = True
+        self.sender.start()
+
+    def send(self, message):
+        due = max(time.time() + self.stub.delay(), self.last_due)
+        self.last_due = due
+        with self.ready:
+            self.outbox.append((due, message if isinstance(message, str) else json.dumps(message)))
+            self.ready.notify()
+
+    def subscribe(self, topic, request):
+        name, _, symbol = topic.partition(':')
+        table = TABLE_ALIASES.get(name, name)
+        if table not in TABLE_KEYS:
+            return self.send({'success': False, 'error': 'Unknown table: %s' % name, 'request': request})
+        if table in PRIVATE_TABLES and not self.authed:
+            return self.send({'status': 401, 'error': 'Not authenticated.', 'request': request})
+        exchange = self.stub.exchange
+        # Holding the exchange lock, no change can land between the partial and the subscription.
+        with exchange.lock:
+            self.send({'success': True, 'subscribe': topic, 'request': request})
+            self.send({'table': name, 'action': 'partial', 'keys': TABLE_KEYS[table], 'types': {},
+                       'foreignKeys': {}, 'attributes': {}, 'filter': {'symbol': symbol} if symbol else {},
+                       'data': exchange.partial(table, symbol or None)})
+            self.subscriptions.setdefault(table, []).append((name, symbol or None))
+
+    def unsubscribe(self, topic, request):
+        name, _, symbol = topic.partition(':')
+        table = TABLE_ALIASES.get(name, name)
+        with self.stub.exchange.lock:
+            subs = self.subscriptions.get(table, [])
+            if (name, symbol or None) in subs:
+                subs.remove((name, symbol or None))
+        self.send({'success': True, 'unsubscribe': topic, 'request': request})
+
+    def publish(self, table, action, rows):
+        for name, symbol in self.subscriptions.get(table, ()):
+            data = rows if symbol is None else [row for row in rows if row.get('symbol') == symbol]
+            if data:
+                self.send({'table': name, 'action': action, 'data': data})
+
+    def serve(self):
+        """Read client frames until the connection closes."""
+        while not self.closed:
+            frame = self.__read_frame()
+            if frame is None:
+                return
+            opcode, payload = frame
+            if opcode == 0x8:
+                return
+            if opcode == 0x9:
+                self.__write_frame(0xA, payload)
+            elif opcode == 0x1:
+                self.__on_text(payload.decode('utf-8'))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        with self.ready:
+            self.ready.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    #
+    # Private methods
+    #
+    def __on_text(self, text):
+        if text == 'ping':
+            return self.send('pong')
+        try:
+            request = json.loads(text)
+            op, args = request['op'], request.get('args') or []
+        except (ValueError, KeyError, TypeError):
+            return self.send({'status': 400, 'error': 'Unknown or expired command.', 'request': text})
+        args = args if isinstance(args, list) else [args]
+        if op == 'subscribe':
+            for topic in args:
+                self.subscribe(topic, request)
+        elif op == 'unsubscribe':
+            for topic in args:
+                self.unsubscribe(topic, request)
+        elif op in ('authKeyExpires', 'authKey'):
+            self.authed = True
+            self.send({'success': True, 'request': request})
+        else:
+            self.send({'status': 400, 'error': 'Unknown or expired command.', 'request': request})
+
+    def __send_loop(self):
+        while True:
+            with self.ready:
+                while not self.outbox and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+                due, message = self.outbox.popleft()
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.__write_frame(0x1, message.encode('utf-8'))
+            except OSError:
+                self.close()
+                return
+
+    def __write_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        self.sock.sendall(header + payload)
+
+    def __read_exactly(self, count):
+        data = b''
+        while len(data) < count:
+            try:
+                chunk = self.sock.recv(count - len(data))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def __read_frame(self):
+        header = self.__read_exactly(2)
+        if header is None:
+            return None
+        opcode, length = header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self.__read_exactly(2) or b'\0\0')[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.__read_exactly(8) or b'\0' * 8)[0]
+        mask = self.__read_exactly(4) if header[1] & 0x80 else None
+        payload = self.__read_exactly(length) if length else b''
+        if payload is None:
+            return None
+        if mask:
+            # Unmask a machine word at a time rather than byte by byte.
+            key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+            payload = (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+        return opcode, payload
+
+
+def json_param(params, name):
+    """A parameter that may arrive JSON-encoded, as in the query string, or already decoded, as in a body."""
+    value = params.get(name)
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        return json.loads(value)
+    return value
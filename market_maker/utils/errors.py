@@ -6,3 +6,6 @@ class MarketClosedError(Exception):
 
 class MarketEmptyError(Exception):
     pass
+
+class RetriesExhaustedError(Exception):
+    pass
@@ -0,0 +1,30 @@
+"""JSON decoding through the fastest backend that's installed.
+
+orjson and ujson are optional. If neither is available we fall back to the stdlib `json`.
+"""
+import importlib
+import json
+
+# In order of preference.
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def load_backend(name=None):
+    """Return the named JSON module, or the fastest installed one if `name` is None."""
+    if name is not None:
+        return importlib.import_module(name)
+    for candidate in BACKENDS:
+        try:
+            return importlib.import_module(candidate)
+        except ImportError:
+            continue
+    return json
+
+
+def get_decoder(name=None):
+    """Return a `loads(str_or_bytes)` function for the named (or fastest installed) backend."""
+    return load_backend(name).loads
+
+
+backend = load_backend()
+loads = backend.loads
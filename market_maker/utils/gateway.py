@@ -0,0 +1,209 @@
+"""Coalesce order operations that arrive close together into as few requests as possible."""
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Condition, Thread
+
+import requests
+
+from market_maker.utils import errors, log
+
+logger = log.setup_custom_logger('root')
+
+
+class OrderGateway(object):
+
+    """Sits in front of a BitMEX connector's amend_bulk_orders, create_bulk_orders and cancel.
+
+    amend(), create() and cancel() queue operations and return a Future for their result rows. The
+    first operation into an empty queue opens a window of `window` seconds. When it closes, the queue
+    goes out as at most one cancel, one bulk amend and one bulk create per symbol, sent together. An
+    amend for an order that already has one queued replaces it, and a cancel drops any queued amend
+    for the same order. One window's requests finish before the next window's go out, so the added
+    latency is at most `window` plus one round trip.
+
+    Queued operations are applied to the connector's order_state straight away, so a plan made before
+    the window closes already sees them and doesn't queue the same creates again. An amend's origClOrdID
+    is looked up again as it's sent: an earlier amend to the same order may have re-keyed it since.
+
+    Failed requests fail their Futures, and order_state rolls them back. The failures converge_orders
+    shrugs off without the gateway (an amend to an order that just closed, a request out of retries)
+    are logged and the next plan picks up where we are. Any other error is raised from the next call,
+    in the caller's thread, as it would have been from the call itself.
+    """
+
+    def __init__(self, bitmex, window=0.005):
+        self.bitmex = bitmex
+        self.window = window
+        self.cond = Condition()
+        self.closed = False
+        self.fatal = None
+        self.sending = False
+        self.flush_now = False
+        self.__reset()
+        self.thread = Thread(target=self.__run, name='order-gateway', daemon=True)
+        self.thread.start()
+
+    #
+    # Public methods
+    #
+    def amend(self, orders):
+        """Queue amends ({'orderID', 'orderQty', 'price', ...}). The Future gets the amended order rows."""
+        with self.cond:
+            self.__check()
+            for order in orders:
+                queued = self.amends.get(order['orderID'])
+                if queued is not None:
+                    order = dict(queued, **order)  # Supersedes the queued amend
+                self.amends[order['orderID']] = order
+            self.bitmex.order_state.amending(orders)
+            return self.__call('amend', [order['orderID'] for order in orders])
+
+    def create(self, orders, symbol=None):
+        """Queue new orders on `symbol`. The Future gets the created order rows."""
+        with self.cond:
+            self.__check()
+            for order in orders:
+                # Give them their clOrdIDs now, so order_state can show them as pending straight away.
+                order['clOrdID'] = order.get('clOrdID') or self.bitmex.new_clOrdID()
+                order['symbol'] = symbol or order.get('symbol') or self.bitmex.symbol
+                self.creates.append(order)
+            self.bitmex.order_state.creating(orders)
+            return self.__call('create', [order['clOrdID'] for order in orders])
+
+    def cancel(self, orderIDs):
+        """Queue cancels by orderID. The Future gets the canceled order rows."""
+        with self.cond:
+            self.__check()
+            for orderID in orderIDs:
+                self.cancels[orderID] = True
+                self.amends.pop(orderID, None)
+            self.bitmex.order_state.canceling(orderIDs)
+            return self.__call('cancel', list(orderIDs))
+
+    def flush(self):
+        """Send whatever is queued now, and wait until it and anything already in flight is done."""
+        with self.cond:
+            self.flush_now = True
+            self.cond.notify_all()
+            while (self.calls or self.sending) and self.thread.is_alive():
+                self.cond.wait(0.1)
+            self.flush_now = False
+
+    def close(self):
+        """Stop the gateway. Queued operations are dropped and their Futures canceled."""
+        with self.cond:
+            self.closed = True
+            for future, kind, keys in self.calls:
+                future.cancel()
+            self.__reset()
+            self.cond.notify_all()
+
+    #
+    # Private methods
+    #
+    def __reset(self):
+        self.amends = OrderedDict()   # orderID -> amend
+        self.creates = []
+        self.cancels = OrderedDict()  # orderID -> True
+        self.calls = []               # (Future, kind, keys), in the order they were queued
+        self.opened = None
+
+    def __check(self):
+        if self.fatal is not None:
+            fatal, self.fatal = self.fatal, None
+            raise fatal
+        if self.closed:
+            raise RuntimeError("The order gateway is closed.")
+
+    def __call(self, kind, keys):
+        future = Future()
+        self.calls.append((future, kind, keys))
+        if self.opened is None:
+            self.opened = time.time()
+            self.cond.notify_all()
+        return future
+
+    def __run(self):
+        while True:
+            with self.cond:
+                while not self.calls and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                # Hold the window open for whatever else arrives, unless someone's waiting on a flush.
+                while not self.flush_now and not self.closed:
+                    remaining = self.opened + self.window - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if self.closed:
+                    return
+                batch = (self.cancels, self.amends, self.creates, self.calls)
+                self.__reset()
+                self.sending = True
+            try:
+                self.__send(*batch)
+            finally:
+                with self.cond:
+                    self.sending = False
+                    self.cond.notify_all()
+
+    def __send(self, cancels, amends, creates, calls):
+        # Cancels first, so they never wait on creates.
+        requests_ = []
+        if cancels:
+            requests_.append(('cancel', self.bitmex.submit(self.bitmex.cancel, list(cancels))))
+        if amends:
+            amends = [self.__rekeyed(amend) for amend in amends.values()]
+            requests_.append(('amend', self.bitmex.submit(self.bitmex.amend_bulk_orders, amends)))
+        by_symbol = OrderedDict()
+        for order in creates:
+            by_symbol.setdefault(order['symbol'], []).append(order)
+        for symbol, orders in by_symbol.items():
+            requests_.append(('create', self.bitmex.submit(self.bitmex.create_bulk_orders, orders, symbol, True)))
+
+        rows = {'cancel': {}, 'amend': {}, 'create': {}}
+        failed = {}
+        for kind, future in requests_:
+            try:
+                result = future.result()
+            except BaseException as e:
+                failed[kind] = e
+                if not self.__expected(kind, e):
+                    logger.error("Order gateway %s failed: %r" % (kind, e))
+                    self.fatal = e
+                continue
+            key = 'clOrdID' if kind == 'create' else 'orderID'
+            for row in result if isinstance(result, list) else [result] if result else []:
+                rows[kind][row.get(key)] = row
+
+        for future, kind, keys in calls:
+            if kind in failed:
+                future.set_exception(failed[kind])
+            else:
+                future.set_result([rows[kind][key] for key in keys if key in rows[kind]])
+
+    def __rekeyed(self, amend):
+        """`amend`, targeting the order's current clOrdID rather than the one it had when the tick was planned."""
+        if not amend.get('origClOrdID'):
+            return amend
+        clOrdID = self.bitmex.order_state.clOrdID_of(amend['orderID'])
+        if clOrdID is None or clOrdID == amend['origClOrdID']:
+            return amend
+        return dict(amend, origClOrdID=clOrdID)
+
+    def __expected(self, kind, e):
+        """Log `e` and return True if it's a failure the next tick simply re-plans around."""
+        if isinstance(e, errors.RetriesExhaustedError):
+            logger.warning("Giving up on this window's %s: %s" % (kind, e))
+            return True
+        if kind == 'amend' and isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+            try:
+                message = e.response.json()['error']['message']
+            except (ValueError, KeyError, TypeError):
+                message = e.response.text
+            if message == 'Invalid ordStatus':
+                logger.warning("Amending failed: an order closed first. The next tick will re-plan.")
+                return True
+        return False
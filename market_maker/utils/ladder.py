@@ -0,0 +1,74 @@
+"""Batched quote ladder construction with NumPy, for quoting many levels.
+
+NumPy is optional: it's imported on first use, only when NUMPY_LADDER is enabled in settings.
+"""
+from market_maker.utils.math import fromTicks
+
+
+class LadderSide(object):
+
+    """One side of a ladder: parallel arrays of tick prices and sizes, outermost level first.
+
+    Indexing and iteration yield the order dicts converge_orders() expects, built on demand, so
+    it can be passed wherever a list of orders is.
+    """
+
+    __slots__ = ('side', 'ticks', 'sizes', 'tickUnits', 'tickScale')
+
+    def __init__(self, side, ticks, sizes, tickUnits, tickScale):
+        self.side = side
+        self.ticks = ticks
+        self.sizes = sizes
+        self.tickUnits = tickUnits
+        self.tickScale = tickScale
+
+    def prices(self):
+        """All the prices on this side, as floats."""
+        return (self.ticks * self.tickUnits / self.tickScale).tolist()
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return {'price': fromTicks(int(self.ticks[i]), self.tickUnits, self.tickScale),
+                'orderQty': int(self.sizes[i]), 'side': self.side}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'LadderSide(%s, %d levels)' % (self.side, len(self))
+
+
+def build_ladder(start_ticks_buy, start_ticks_sell, pairs, interval, tickUnits, tickScale, start_size=100,
+                 step_size=100, random_size=None, maintain_spreads=True, buys=True, sells=True, rng=None):
+    """Compute every level of a ladder in one pass. Returns (buy side, sell side) LadderSides.
+
+    Mirrors OrderManager.get_ticks_offset / prepare_order: level i (1 is innermost) is quoted at
+    start * (1 + interval) ** (i - 1) ticks from the start position with MAINTAIN_SPREADS, and
+    ** i without it, rounded half to even. Sizes step up by `step_size` per level, or are drawn
+    uniformly from `random_size` = (min, max) inclusive. Levels are outermost first, as
+    place_orders() builds them. Pass buys/sells=False to leave a side empty (position limits).
+    """
+    import numpy as np
+
+    levels = np.arange(pairs, 0, -1, dtype=np.int64)  # pairs .. 1: outside in
+    exponents = levels - 1 if maintain_spreads else levels
+    growth = (1.0 + interval) ** exponents.astype(np.float64)
+    shrink = (1.0 + interval) ** -exponents.astype(np.float64)
+
+    if random_size:
+        rng = rng or np.random.default_rng()
+        size_of = lambda: rng.integers(random_size[0], random_size[1] + 1, size=pairs, dtype=np.int64)
+    else:
+        fixed = start_size + (levels - 1) * step_size
+        size_of = lambda: fixed
+
+    empty = np.empty(0, dtype=np.int64)
+    buy_ticks = np.rint(start_ticks_buy * shrink).astype(np.int64) if buys else empty
+    sell_ticks = np.rint(start_ticks_sell * growth).astype(np.int64) if sells else empty
+    return (LadderSide('Buy', buy_ticks, size_of() if buys else empty, tickUnits, tickScale),
+            LadderSide('Sell', sell_ticks, size_of() if sells else empty, tickUnits, tickScale))
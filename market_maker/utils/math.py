@@ -1,9 +1,36 @@
 from decimal import Decimal
+from functools import lru_cache
+
+# Prices are handled as integer counts of ticks wherever we do arithmetic on them, and only turned
+# back into floats for display and the API. Rounding a tick count is exact, and converting back is
+# one integer multiply and a correctly rounded division: ticks * tickUnits / tickScale, where
+# tickSize == tickUnits / tickScale exactly (e.g. 0.5 == 5 / 10). No Decimals on the hot path.
+
+
+@lru_cache(maxsize=64)
+def tickParams(tickSize):
+    """Return (tickUnits, tickScale) for a tickSize, so that tickSize == tickUnits / tickScale exactly.
+
+    InstrumentTable precomputes these on every instrument row; this is for callers that only have the tickSize."""
+    exponent = Decimal(str(tickSize)).as_tuple().exponent
+    tickScale = 10 ** max(-exponent, 0)
+    return int(round(tickSize * tickScale)), tickScale
+
+
+def toTicks(num, tickSize):
+    """Round a price to the nearest whole number of ticks."""
+    return int(round(num / tickSize))
+
+
+def fromTicks(ticks, tickUnits, tickScale):
+    """Turn a tick count back into a price, e.g. fromTicks(80293, 5, 10) -> 40146.5."""
+    return ticks * tickUnits / tickScale
+
 
 def toNearest(num, tickSize):
     """Given a number, round it to the nearest tick. Very useful for sussing float error
        out of numbers: e.g. toNearest(401.46, 0.01) -> 401.46, whereas processing is
        normally with floats would give you 401.46000000000004.
        Use this after adding/subtracting/multiplying numbers."""
-    tickDec = Decimal(str(tickSize))
-    return float((Decimal(round(num / tickSize, 0)) * tickDec))
+    tickUnits, tickScale = tickParams(tickSize)
+    return int(round(num / tickSize)) * tickUnits / tickScale
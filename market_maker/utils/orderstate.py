@@ -0,0 +1,233 @@
+"""Our orders as we intend them to be, ahead of the websocket."""
+import time
+from threading import Lock
+
+PENDING_NEW = 'pending-new'
+LIVE = 'live'
+PENDING_AMEND = 'pending-amend'
+PENDING_CANCEL = 'pending-cancel'
+DONE = 'done'
+
+TERMINAL_STATUSES = ('Filled', 'Canceled', 'Rejected')
+
+
+class TrackedOrder(object):
+
+    """One of our orders: the exchange's last word on it, plus any change we've asked for and not heard back on."""
+
+    __slots__ = ('clOrdID', 'state', 'order', 'intent', 'sent', 'seen_on_ws')
+
+    def __init__(self, clOrdID, state, order, intent=None, sent=None):
+        self.clOrdID = clOrdID
+        self.state = state
+        self.order = order    # Order row, from a REST response or the websocket
+        self.intent = intent  # Fields we've asked to change: price, orderQty, leavesQty
+        self.sent = sent      # When the pending request went out, or when we last heard from REST
+        self.seen_on_ws = False  # Whether the websocket has shown it under this clOrdID
+
+    def view(self):
+        if not self.intent:
+            return self.order
+        view = dict(self.order)
+        view.update(self.intent)
+        return view
+
+
+class OrderTracker(object):
+
+    """Order state machine fed by REST responses as soon as they return, and confirmed by the websocket.
+
+    pending-new -> live -> pending-amend -> live -> pending-cancel -> done, with fills or cancels from
+    the exchange taking any state to done. BitMEX calls creating()/amending()/canceling() before a
+    request goes out, confirm() with what comes back, and rollback() if it fails. open_orders() then
+    shows our orders as they will be once everything in flight lands, so the next converge_orders()
+    doesn't redo work the websocket hasn't reported yet.
+
+    Anything we haven't heard about from either source within `timeout` seconds is given up on:
+    pending changes are rolled back and orders the websocket never showed are forgotten.
+    """
+
+    def __init__(self, clOrdIDPrefix, timeout=30):
+        self.clOrdIDPrefix = clOrdIDPrefix
+        self.timeout = timeout
+        self.lock = Lock()
+        self.orders = {}     # clOrdID -> TrackedOrder
+        self.clOrdIDs = {}   # orderID -> clOrdID
+
+    #
+    # Called around REST requests
+    #
+    def creating(self, orders):
+        """About to create `orders`, which already carry their clOrdIDs. Returns keys for rollback()."""
+        now = time.time()
+        with self.lock:
+            for order in orders:
+                row = {'orderID': None, 'clOrdID': order['clOrdID'], 'symbol': order['symbol'],
+                       'side': order.get('side') or ('Buy' if order['orderQty'] > 0 else 'Sell'),
+                       'orderQty': abs(order['orderQty']), 'leavesQty': abs(order['orderQty']), 'cumQty': 0,
+                       'price': order['price'], 'ordStatus': 'New', 'timestamp': ''}
+                self.orders[order['clOrdID']] = TrackedOrder(order['clOrdID'], PENDING_NEW, row, sent=now)
+        return [order['clOrdID'] for order in orders]
+
+    def amending(self, amends):
+        """About to send `amends` ({'orderID', 'orderQty', 'price'} as in converge_orders)."""
+        now = time.time()
+        keys = []
+        with self.lock:
+            for amend in amends:
+                tracked = self.__find(amend.get('orderID'), amend.get('origClOrdID') or amend.get('clOrdID'))
+                if tracked is None or tracked.state == DONE:
+                    continue
+                intent = {'price': amend['price']} if 'price' in amend else {}
+                if 'orderQty' in amend:
+                    intent['orderQty'] = amend['orderQty']
+                    intent['leavesQty'] = amend['orderQty'] - tracked.order.get('cumQty', 0)
+                tracked.state, tracked.intent, tracked.sent = PENDING_AMEND, intent, now
+                keys.append(tracked.clOrdID)
+        return keys
+
+    def canceling(self, orderIDs=None, clOrdIDs=None, symbol=None):
+        """About to cancel these orders, or with `symbol`, every one on that symbol. Returns keys for rollback()."""
+        now = time.time()
+        keys = []
+        with self.lock:
+            if symbol is not None:
+                targets = [t for t in self.orders.values() if t.order.get('symbol') == symbol]
+            else:
+                targets = [self.__find(orderID=i) for i in as_list(orderIDs)] + \
+                          [self.__find(clOrdID=c) for c in as_list(clOrdIDs)]
+            for tracked in targets:
+                if tracked is not None and tracked.state != DONE:
+                    tracked.state, tracked.sent = PENDING_CANCEL, now
+                    keys.append(tracked.clOrdID)
+        return keys
+
+    def confirm(self, rows):
+        """Apply order rows from a REST response. Rows for orders we don't track but placed are adopted."""
+        now = time.time()
+        with self.lock:
+            for row in as_list(rows):
+                if not isinstance(row, dict):
+                    continue
+                tracked = self.__find(row.get('orderID'), row.get('clOrdID'))
+                if tracked is None:
+                    if not str(row.get('clOrdID')).startswith(self.clOrdIDPrefix) or not row.get('ordStatus'):
+                        continue
+                    tracked = self.orders[row['clOrdID']] = TrackedOrder(row['clOrdID'], LIVE, row)
+                if row.get('error') and not row.get('ordStatus'):
+                    # e.g. 'Not Found' on a cancel: it's gone already.
+                    tracked.state = DONE
+                    continue
+                if row.get('clOrdID') and row['clOrdID'] != tracked.clOrdID:
+                    # Amended with a new clOrdID, which the websocket may not have shown yet
+                    del self.orders[tracked.clOrdID]
+                    tracked.clOrdID = row['clOrdID']
+                    tracked.seen_on_ws = False
+                    self.orders[tracked.clOrdID] = tracked
+                tracked.order = row
+                tracked.intent = None
+                tracked.sent = now
+                tracked.state = DONE if isDone(row) else LIVE
+                if row.get('orderID'):
+                    self.clOrdIDs[row['orderID']] = tracked.clOrdID
+
+    def rollback(self, keys):
+        """A request failed: forget the orders it would have created and undo the changes it would have made."""
+        with self.lock:
+            for key in keys:
+                tracked = self.orders.get(key)
+                if tracked is None:
+                    continue
+                if tracked.state == PENDING_NEW:
+                    del self.orders[key]
+                elif tracked.state in (PENDING_AMEND, PENDING_CANCEL):
+                    tracked.state, tracked.intent = LIVE, None
+
+    #
+    # Reading
+    #
+    def open_orders(self, ws_orders, lookup, symbol=None):
+        """Our open orders as they will be once in-flight requests land: pending creates and amends
+        included, pending cancels left out.
+
+        `ws_orders` are the websocket's open orders for `symbol`, and `lookup` finds the websocket's row
+        for a clOrdID. A websocket row at least as new as what REST told us takes over from it. The
+        websocket drops orders once they're filled or canceled, so one it has shown and no longer does
+        is done.
+        """
+        now = time.time()
+        result = []
+        with self.lock:
+            for tracked in list(self.orders.values()):
+                self.__sync(tracked, lookup(tracked.clOrdID), now)
+                if tracked.state == DONE:
+                    self.__forget(tracked)
+                elif tracked.state != PENDING_CANCEL and (symbol is None or tracked.order.get('symbol') == symbol):
+                    result.append(tracked.view())
+            # Orders the websocket knows about that we never sent, e.g. from before a restart. Ours can
+            # show up under the new clOrdID of an amend we haven't heard back on; the orderID gives those away.
+            result.extend(o for o in ws_orders if o.get('clOrdID') not in self.orders and
+                          o.get('orderID') not in self.clOrdIDs)
+        return result
+
+    def clOrdID_of(self, orderID):
+        """The clOrdID we know `orderID` by now, after any re-keying amends; None if we don't track it."""
+        with self.lock:
+            return self.clOrdIDs.get(orderID)
+
+    def pending(self):
+        """How many orders have a request in flight."""
+        with self.lock:
+            return sum(1 for t in self.orders.values() if t.state in (PENDING_NEW, PENDING_AMEND, PENDING_CANCEL))
+
+    def __sync(self, tracked, ws_row, now):
+        if ws_row is None and tracked.seen_on_ws and tracked.state != PENDING_AMEND:
+            # Filled or canceled. (While an amend is in flight, the websocket may already show the
+            # order under the clOrdID the amend gives it.)
+            tracked.state = DONE
+            return
+        if ws_row is not None:
+            tracked.seen_on_ws = True
+        if ws_row is not None and (ws_row.get('timestamp') or '') >= (tracked.order.get('timestamp') or ''):
+            tracked.order = ws_row
+            if isDone(ws_row):
+                tracked.state = DONE
+            elif tracked.state == PENDING_NEW:
+                tracked.state = LIVE
+            elif tracked.state == PENDING_AMEND and \
+                    all(ws_row.get(field) == value for field, value in tracked.intent.items()):
+                tracked.state, tracked.intent = LIVE, None
+            if tracked.order.get('orderID'):
+                self.clOrdIDs[tracked.order['orderID']] = tracked.clOrdID
+            return
+        if tracked.sent is None:
+            tracked.sent = now  # Start the clock on an order the websocket has stopped showing.
+        elif now - tracked.sent > self.timeout:
+            if ws_row is None:
+                # Neither REST nor the websocket has shown us this order for a while. Let the websocket be the judge.
+                tracked.state = DONE
+            else:
+                tracked.state, tracked.intent, tracked.sent = LIVE, None, None
+
+    def __forget(self, tracked):
+        self.orders.pop(tracked.clOrdID, None)
+        orderID = tracked.order.get('orderID')
+        if orderID and self.clOrdIDs.get(orderID) == tracked.clOrdID:
+            del self.clOrdIDs[orderID]
+
+    def __find(self, orderID=None, clOrdID=None):
+        if clOrdID and clOrdID in self.orders:
+            return self.orders[clOrdID]
+        if orderID:
+            return self.orders.get(self.clOrdIDs.get(orderID))
+        return None
+
+
+def isDone(order):
+    return order.get('ordStatus') in TERMINAL_STATUSES or order.get('leavesQty') == 0
+
+
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
@@ -0,0 +1,112 @@
+"""Client-side view of the BitMEX rate limit, and spending it on the orders that matter most."""
+import time
+from math import ceil
+from threading import Lock
+
+from market_maker.utils.reconcile import Plan
+
+
+class RateLimitBudget(object):
+
+    """Token bucket mirroring the exchange's rate limit.
+
+    Every response carries X-RateLimit-Limit, -Remaining and -Reset (when the bucket is full again);
+    update() resyncs from those. In between, requests we send are charged with spend() and the bucket
+    refills at the rate the last Reset implied, so we know what's left without waiting for a 429.
+    """
+
+    def __init__(self, limit=300, window=300):
+        self.lock = Lock()
+        self.limit = limit
+        self.rate = limit / float(window)  # tokens per second
+        self.tokens = float(limit)
+        self.stamp = time.time()
+
+    def update(self, headers, now=None):
+        """Resync from a response's headers. Responses without them are ignored."""
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = int(headers['X-RateLimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+        now = now or time.time()
+        with self.lock:
+            self.limit = limit
+            self.tokens = float(remaining)
+            self.stamp = now
+            if remaining < limit and reset > now:
+                self.rate = (limit - remaining) / (reset - now)
+
+    def available(self, now=None):
+        """Requests we can send right now."""
+        now = now or time.time()
+        with self.lock:
+            return min(self.limit, self.tokens + (now - self.stamp) * self.rate)
+
+    def spend(self, cost, now=None):
+        now = now or time.time()
+        with self.lock:
+            self.tokens = min(self.limit, self.tokens + (now - self.stamp) * self.rate) - cost
+            self.stamp = now
+
+    def wait_time(self, cost, now=None):
+        """Seconds until `cost` requests are available, 0 if they are now."""
+        short = cost - self.available(now)
+        return short / self.rate if short > 0 and self.rate else 0
+
+
+def request_cost(verb, path, postdict=None):
+    """What a request costs against the limit: bulk creates and amends 1 per 10 orders, everything else 1."""
+    if path == 'order/bulk' and verb in ('POST', 'PUT') and postdict:
+        return int(ceil(len(postdict.get('orders', ())) / 10.0)) or 1
+    return 1
+
+
+def schedule(plan, budget, reserve=0, protect_levels=1):
+    """Trim a reconcile.Plan to what `budget` requests can pay for, spending it by priority.
+
+    Cancels always go: they're one request and take risk off the book. Then amends and creates,
+    innermost first on each side. The `protect_levels` innermost per side are sent even if that
+    digs into `reserve`; further out levels are cosmetic and only go while `budget - reserve` lasts.
+    Whatever doesn't fit is moved to plan.deferred. The next tick's plan picks it up again.
+    """
+    if budget is None or plan.requests() <= budget - reserve:
+        return plan
+
+    scheduled = Plan()
+    scheduled.kept = plan.kept
+    scheduled.to_cancel = list(plan.to_cancel)
+    spent = 1 if plan.to_cancel else 0
+    amends = creates = 0
+
+    for inner, order, is_amend in _by_priority(plan, protect_levels):
+        cost = int(ceil((amends + is_amend) / 10.0)) + int(ceil((creates + (not is_amend)) / 10.0))
+        if inner and spent + cost <= budget or spent + cost <= budget - reserve:
+            if is_amend:
+                scheduled.to_amend.append(order)
+                amends += 1
+            else:
+                scheduled.to_create.append(order)
+                creates += 1
+        else:
+            scheduled.deferred.append(order)
+
+    # Keep the orders in the plan's order, not priority order.
+    positions = {id(o): i for i, o in enumerate(plan.to_amend + plan.to_create)}
+    scheduled.to_amend.sort(key=lambda o: positions[id(o)])
+    scheduled.to_create.sort(key=lambda o: positions[id(o)])
+    return scheduled
+
+
+def _by_priority(plan, protect_levels):
+    """(inner, order, is_amend) for every amend and create, closest to the inside of its side first."""
+    ranked = []
+    for side, sign in (('Buy', -1), ('Sell', 1)):
+        orders = [(o, True) for o in plan.to_amend if o['side'] == side] + \
+                 [(o, False) for o in plan.to_create if o['side'] == side]
+        # Buys are innermost at the highest price, sells at the lowest.
+        orders.sort(key=lambda item: sign * item[0]['price'])
+        ranked.extend((level, level < protect_levels, order, is_amend) for level, (order, is_amend) in enumerate(orders))
+    ranked.sort(key=lambda item: (not item[1], item[0]))
+    return [(inner, order, is_amend) for _, inner, order, is_amend in ranked]
@@ -0,0 +1,159 @@
+"""Plan the fewest order operations that turn the orders we have into the orders we want."""
+from bisect import bisect_left, bisect_right
+from math import ceil
+
+
+class Plan(object):
+
+    """What converge_orders() should send: amends, creates and cancels, plus what it can leave alone."""
+
+    def __init__(self):
+        self.to_amend = []
+        self.to_create = []
+        self.to_cancel = []
+        self.kept = []
+        # Amends and creates held back for lack of rate limit; see utils/ratelimit.schedule().
+        self.deferred = []
+
+    def cost(self):
+        """Number of order operations in the plan."""
+        return len(self.to_amend) + len(self.to_create) + len(self.to_cancel)
+
+    def requests(self):
+        """Rate limit the plan will use: bulk amends and creates cost 1 per 10 orders, a cancel call costs 1."""
+        return int(ceil(len(self.to_amend) / 10.0)) + int(ceil(len(self.to_create) / 10.0)) + \
+            (1 if self.to_cancel else 0)
+
+    def __bool__(self):
+        return self.cost() > 0
+
+    def __repr__(self):
+        text = "Plan: keep %d, amend %d, create %d, cancel %d (%d operations, %d requests)" % (
+            len(self.kept), len(self.to_amend), len(self.to_create), len(self.to_cancel), self.cost(), self.requests())
+        if self.deferred:
+            text += ", %d deferred" % len(self.deferred)
+        return text
+
+
+def plan_orders(existing_orders, buy_orders, sell_orders, tolerance):
+    """Match existing orders to desired ones, per side, and return the Plan with the fewest operations.
+
+    An existing order within `tolerance` (relative, like RELIST_INTERVAL) of a desired order's price
+    and quantity is kept as is, so it keeps its place in the queue. One that's outside on either is
+    amended, changing only what's out of tolerance. Desired orders left over are created, existing
+    ones left over canceled.
+
+    A side with n existing and m desired orders needs max(n, m) operations, less one for every pair
+    we can keep. So we first find the most pairs we can keep (a bipartite matching, preferring the
+    closest price), then pair what's left by price, amending as little as possible.
+    """
+    plan = Plan()
+    for side, desired in (('Buy', buy_orders), ('Sell', sell_orders)):
+        existing = [o for o in existing_orders if o['side'] == side]
+        _plan_side(plan, existing, list(desired), tolerance)
+    return plan
+
+
+def _within(a, b, tolerance):
+    return a == b or (b and abs(a / b - 1) <= tolerance)
+
+
+def _keepable(order, want, tolerance):
+    return _within(want['price'], order['price'], tolerance) and _within(want['orderQty'], order['leavesQty'], tolerance)
+
+
+def _plan_side(plan, existing, desired, tolerance):
+    existing.sort(key=lambda o: o['price'])
+    desired.sort(key=lambda o: o['price'])
+    prices = [o['price'] for o in desired]
+
+    # Desired orders each existing order could stay as, closest price first. Only prices within
+    # tolerance qualify, so bisect to that window rather than comparing every pair.
+    candidates = []
+    for order in existing:
+        price = order['price']
+        lo = bisect_left(prices, price * (1 - tolerance) - abs(price) * 1e-12)
+        hi = bisect_right(prices, price * (1 + tolerance) + abs(price) * 1e-12)
+        keep = [j for j in range(lo, hi) if _keepable(order, desired[j], tolerance)]
+        keep.sort(key=lambda j: abs(prices[j] - price))
+        candidates.append(keep)
+
+    # Maximum matching by augmenting paths (Kuhn's algorithm). Windows are a few orders wide, so it's cheap.
+    kept_by = [None] * len(desired)  # desired index -> existing index
+
+    def augment(i, seen):
+        for j in candidates[i]:
+            if j not in seen:
+                seen.add(j)
+                if kept_by[j] is None or augment(kept_by[j], seen):
+                    kept_by[j] = i
+                    return True
+        return False
+
+    for i in range(len(existing)):
+        if candidates[i]:
+            augment(i, set())
+
+    kept = set(i for i in kept_by if i is not None)
+    plan.kept.extend(existing[i] for i in sorted(kept))
+    # Orders still being created have no orderID to amend or cancel by. If we can't keep them, leave
+    # them be; by the next tick they'll have one.
+    _pair_rest(plan, [o for i, o in enumerate(existing) if i not in kept and o.get('orderID')],
+               [o for j, o in enumerate(desired) if kept_by[j] is None], tolerance)
+
+
+def _pair_rest(plan, existing, desired, tolerance):
+    """Amend as many of the leftover orders as we can into the leftover desired ones, moving price
+    as little as possible, then create or cancel the rest. None of these pairs are keepable (that
+    would have extended the matching), so every pairing costs one amend and only price moved varies.
+    Pairs never cross when minimising price moved, so it's a DP over both lists in price order."""
+    n, m = len(existing), len(desired)
+    pairs = min(n, m)
+
+    # moved[i][j]: least price moved pairing the first i existing with the first j desired, with
+    # i - j (or j - i) of the longer list skipped; inf where that's more than the surplus.
+    INF = float('inf')
+    moved = [[INF] * (m + 1) for _ in range(n + 1)]
+    step = [[None] * (m + 1) for _ in range(n + 1)]
+    moved[0][0] = 0.0
+    for i in range(n + 1):
+        for j in range(m + 1):
+            if i and j:
+                cost = moved[i - 1][j - 1] + abs(existing[i - 1]['price'] - desired[j - 1]['price'])
+                if cost < moved[i][j]:
+                    moved[i][j], step[i][j] = cost, 'pair'
+            if i and n > m and i - j <= n - pairs and moved[i - 1][j] < moved[i][j]:
+                moved[i][j], step[i][j] = moved[i - 1][j], 'cancel'
+            if j and m > n and j - i <= m - pairs and moved[i][j - 1] < moved[i][j]:
+                moved[i][j], step[i][j] = moved[i][j - 1], 'create'
+
+    amend, create, cancel = [], [], []
+    i, j = n, m
+    while i or j:
+        if step[i][j] == 'cancel':
+            cancel.append(existing[i - 1])
+            i -= 1
+        elif step[i][j] == 'create':
+            create.append(desired[j - 1])
+            j -= 1
+        else:
+            order, want = existing[i - 1], desired[j - 1]
+            price_ok = _within(want['price'], order['price'], tolerance)
+            qty_ok = _within(want['orderQty'], order['leavesQty'], tolerance)
+            amended = {
+                'orderID': order['orderID'],
+                'orderQty': order['cumQty'] + (order['leavesQty'] if qty_ok else want['orderQty']),
+                'price': order['price'] if price_ok else want['price'],
+                'side': order['side'],
+            }
+            if order.get('clOrdID'):
+                # Lets BitMEX.amend_bulk_orders re-key the order, so the amend is safe to retry.
+                amended['origClOrdID'] = order['clOrdID']
+            amend.append(amended)
+            i -= 1
+            j -= 1
+
+    # Walked back from the highest price; hand them out lowest first, like the inputs.
+    plan.to_amend.extend(reversed(amend))
+    plan.to_create.extend(reversed(create))
+    plan.to_cancel.extend(reversed(cancel))
@@ -0,0 +1,65 @@
+"""How _curl_bitmex retries: exponential backoff with jitter, within a per-endpoint deadline."""
+import random
+import time
+
+
+class RetryPolicy(object):
+
+    """Retry settings shared by every request; start() gives each request its own RetryState.
+
+    The n'th retry waits a random time between 0 and min(cap, base * 2 ** n) seconds ("full jitter"),
+    so clients recovering from the same outage don't all come back at once. No request retries past
+    its endpoint's deadline, counted from its first attempt: order placement gives up quickly, as a
+    quote that arrives late is worth less than a fresh tick, while reads and cancels keep trying.
+    """
+
+    # Seconds from the first attempt, by (verb, endpoint). Anything not listed, including every read
+    # and cancel on these endpoints, gets `deadline`.
+    DEADLINES = {
+        ('POST', 'order'): 5,
+        ('PUT', 'order'): 5,
+        ('POST', 'order/bulk'): 5,
+        ('PUT', 'order/bulk'): 5,
+        ('POST', 'order/cancelAllAfter'): 10,
+    }
+
+    def __init__(self, base=0.25, cap=5.0, deadline=30, deadlines=None, rng=None):
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.deadlines = dict(self.DEADLINES)
+        self.deadlines.update(deadlines or {})
+        self.random = rng or random.Random()
+
+    def start(self, verb, path, max_retries):
+        """A fresh RetryState for one `verb` request to `path`, allowing up to `max_retries` retries."""
+        return RetryState(self, max_retries, self.deadlines.get((verb, path.strip('/')), self.deadline))
+
+    def delay(self, retries):
+        return self.random.uniform(0, min(self.cap, self.base * 2 ** retries))
+
+
+class RetryState(object):
+
+    """Attempts made so far by one request, and when it has to give up."""
+
+    __slots__ = ('policy', 'max_retries', 'retries', 'started', 'deadline')
+
+    def __init__(self, policy, max_retries, deadline):
+        self.policy = policy
+        self.max_retries = max_retries
+        self.retries = 0
+        self.started = time.time()
+        self.deadline = self.started + deadline
+
+    def backoff(self, minimum=0):
+        """Seconds to wait before the next attempt, or None if this request is out of retries or time.
+
+        `minimum` is a wait the server asked for, e.g. until a rate limit resets."""
+        if self.retries >= self.max_retries:
+            return None
+        delay = max(minimum, self.policy.delay(self.retries))
+        if time.time() + delay > self.deadline:
+            return None
+        self.retries += 1
+        return delay
@@ -0,0 +1,192 @@
+"""Compressed journal of raw websocket frames, for debugging and replay.
+
+A journal is a directory of files named <prefix>-<YYYYmmdd-HHMMSS>.mdj, each with a matching .idx.
+
+A .mdj file is a sequence of blocks. Each block is a header followed by a zlib-compressed payload:
+    header:  magic (4s) | record count (I) | first ts (d) | last ts (d) | raw length (I) | compressed length (I)
+    payload: records, each receive ts (d) | frame length (I) | frame (utf-8)
+
+The .idx file holds one entry per block, first ts (d) | last ts (d) | byte offset in the .mdj (Q),
+so a reader can seek straight to the block containing a given time.
+"""
+import glob
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+from market_maker.utils import log
+
+logger = log.setup_custom_logger('root')
+
+MAGIC = b'MDJ1'
+BLOCK_HEADER = struct.Struct('<4sIddII')
+RECORD_HEADER = struct.Struct('<dI')
+INDEX_ENTRY = struct.Struct('<ddQ')
+
+
+class CaptureWriter(object):
+
+    """Appends raw frames to a journal from a background thread.
+
+    `write()` is all the socket thread pays for: a timestamp and a deque append, no locks and
+    no disk. The writer thread batches frames into blocks of about `block_size` bytes (or
+    whatever arrived in `flush_interval` seconds), compresses and appends them, and starts a
+    new file every `rotate_seconds` seconds or `rotate_bytes` bytes.
+    """
+
+    def __init__(self, directory, prefix='capture', block_size=256 * 1024, flush_interval=1.0,
+                 rotate_seconds=3600, rotate_bytes=512 * 1024 * 1024, compress_level=1):
+        self.directory = directory
+        self.prefix = prefix
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.rotate_seconds = rotate_seconds
+        self.rotate_bytes = rotate_bytes
+        self.compress_level = compress_level
+
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._file = None
+        self._index = None
+        self._opened_at = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._thread = threading.Thread(target=self.__run, name='capture-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, frame, ts=None):
+        """Queue a raw frame, stamped with its receive time. Safe to call from any thread."""
+        self._queue.append((ts or time.time(), frame))
+
+    def close(self):
+        """Flush everything queued so far and close the journal."""
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def __run(self):
+        records = []
+        size = 0
+        last_flush = time.time()
+        while True:
+            self._wakeup.wait(self.flush_interval / 4)
+            stopped = self._stopped
+            queue = self._queue
+            while queue:
+                ts, frame = queue.popleft()
+                if not isinstance(frame, bytes):
+                    frame = frame.encode('utf8')
+                records.append((ts, frame))
+                size += RECORD_HEADER.size + len(frame)
+                if size >= self.block_size:
+                    self.__write_block(records)
+                    records, size, last_flush = [], 0, time.time()
+            if records and (stopped or time.time() - last_flush >= self.flush_interval):
+                self.__write_block(records)
+                records, size, last_flush = [], 0, time.time()
+            if stopped:
+                self.__close_file()
+                return
+
+    def __write_block(self, records):
+        first_ts, last_ts = records[0][0], records[-1][0]
+        if self._file is None or self._file.tell() >= self.rotate_bytes or \
+                first_ts - self._opened_at >= self.rotate_seconds:
+            self.__open_file(first_ts)
+
+        payload = b''.join(RECORD_HEADER.pack(ts, len(frame)) + frame for ts, frame in records)
+        compressed = zlib.compress(payload, self.compress_level)
+        offset = self._file.tell()
+        self._file.write(BLOCK_HEADER.pack(MAGIC, len(records), first_ts, last_ts, len(payload), len(compressed)))
+        self._file.write(compressed)
+        self._file.flush()
+        self._index.write(INDEX_ENTRY.pack(first_ts, last_ts, offset))
+        self._index.flush()
+
+    def __open_file(self, ts):
+        self.__close_file()
+        name = '%s-%s' % (self.prefix, time.strftime('%Y%m%d-%H%M%S', time.gmtime(ts)))
+        path = os.path.join(self.directory, name)
+        logger.info("Capturing websocket frames to %s.mdj" % path)
+        self._file = open(path + '.mdj', 'ab')
+        self._index = open(path + '.idx', 'ab')
+        self._opened_at = ts
+
+    def __close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._index.close()
+            self._file = self._index = None
+
+
+class CaptureReader(object):
+
+    """Reads (receive ts, frame) pairs back out of a journal, oldest first.
+
+    `path` is a single .mdj file or a journal directory, in which case every .mdj in it is read
+    in name (i.e. time) order. Pass `start` to skip ahead to frames received at or after it; the
+    index is used to jump straight to the right block.
+    """
+
+    def __init__(self, path, start=None, end=None):
+        if os.path.isdir(path):
+            self.files = sorted(glob.glob(os.path.join(path, '*.mdj')))
+        else:
+            self.files = [path]
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        for path in self.files:
+            offset = self.__seek_offset(path)
+            if offset is None:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for ts, frame in self.__read_blocks(f):
+                    if self.start is not None and ts < self.start:
+                        continue
+                    if self.end is not None and ts > self.end:
+                        return
+                    yield ts, frame
+
+    def __seek_offset(self, path):
+        """Byte offset of the first block that can contain `start`, or None to skip the file."""
+        if self.start is None:
+            return 0
+        index_path = os.path.splitext(path)[0] + '.idx'
+        if not os.path.exists(index_path):
+            return 0
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        for i in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            first_ts, last_ts, offset = INDEX_ENTRY.unpack_from(data, i)
+            if last_ts >= self.start:
+                return offset
+        return None
+
+    def __read_blocks(self, f):
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            magic, count, first_ts, last_ts, raw_len, compressed_len = BLOCK_HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("Corrupt capture block at offset %d of %s" % (f.tell() - len(header), f.name))
+            compressed = f.read(compressed_len)
+            if len(compressed) < compressed_len:
+                return  # Truncated final block, e.g. the writer was killed mid-write
+            payload = zlib.decompress(compressed)
+            pos = 0
+            for _ in range(count):
+                ts, length = RECORD_HEADER.unpack_from(payload, pos)
+                pos += RECORD_HEADER.size
+                yield ts, payload[pos:pos + length].decode('utf8')
+                pos += length
@@ -0,0 +1,53 @@
+"""Change events published by BitMEXWebsocket as it applies table updates."""
+import threading
+
+# Best bid or ask price/size changed on the order book.
+TOP_OF_BOOK = 'topOfBook'
+# One of our orders (partially) filled.
+ORDER_FILL = 'orderFill'
+# One of our orders was added, canceled or otherwise left the book.
+ORDER = 'order'
+# Our position quantity changed.
+POSITION = 'position'
+
+
+class ChangeNotifier(object):
+
+    """Collects (event, symbol) pairs from the websocket thread and wakes up whoever is waiting on them.
+
+    Events are coalesced: a burst of identical events between two waits is delivered once.
+    Callbacks registered with `subscribe` run on the websocket thread, so keep them short.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = set()
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """Call `callback(event, table, symbol)` for every published event."""
+        self._listeners.append(callback)
+
+    def publish(self, event, table, symbol):
+        with self._cond:
+            self._pending.add((event, symbol))
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback(event, table, symbol)
+
+    def wait(self, timeout=None):
+        """Block until at least one event is pending (or `timeout` passes), then return and clear them."""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            return self.__take()
+
+    def drain(self):
+        """Return and clear pending events without blocking."""
+        with self._cond:
+            return self.__take()
+
+    def __take(self):
+        events = self._pending
+        self._pending = set()
+        return events
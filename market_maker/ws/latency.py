@@ -0,0 +1,183 @@
+"""Per-table feed latency for BitMEXWebsocket: how far behind the exchange we are, and how long we take."""
+import calendar
+import math
+import time
+
+from market_maker.utils import log
+
+logger = log.setup_custom_logger('root')
+
+
+class LatencyHistogram(object):
+
+    """Log-scale histogram of durations in seconds, from 1us to about 1000s.
+
+    Each power of two is split into SUBBUCKETS buckets, so quantiles are good to within about 10%.
+    Recording is a frexp and a list increment; nothing is allocated.
+    """
+
+    SUBBUCKETS = 8
+    MIN_EXPONENT = -19  # 2**-20s, about 1us
+    MAX_EXPONENT = 10   # 2**10s, about 17 minutes
+
+    def __init__(self):
+        self.counts = [0] * ((self.MAX_EXPONENT - self.MIN_EXPONENT + 1) * self.SUBBUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if seconds <= 0:
+            self.counts[0] += 1
+            return
+        mantissa, exponent = math.frexp(seconds)
+        if exponent < self.MIN_EXPONENT:
+            i = 0
+        elif exponent > self.MAX_EXPONENT:
+            i = len(self.counts) - 1
+        else:
+            i = (exponent - self.MIN_EXPONENT) * self.SUBBUCKETS + int((mantissa - 0.5) * 2 * self.SUBBUCKETS)
+        self.counts[i] += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p'th percentile (0 < p <= 100), or None if empty."""
+        if not self.count:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.upper_bound(i), self.max)
+        return self.max
+
+    def upper_bound(self, i):
+        exponent, sub = divmod(i, self.SUBBUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2.0 * self.SUBBUCKETS), exponent + self.MIN_EXPONENT)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean(), 'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'max': self.max if self.count else None}
+
+
+class TableStats(object):
+
+    """Latency and volume of one table's messages since the window started."""
+
+    def __init__(self):
+        self.messages = 0
+        self.rows = 0
+        # Exchange timestamp -> when we read the frame off the socket.
+        self.exchange_lag = LatencyHistogram()
+        # Read off the socket -> decoded and applied to our tables.
+        self.apply = LatencyHistogram()
+
+    def summary(self, elapsed):
+        return {'messages': self.messages, 'rows': self.rows, 'rate': self.messages / elapsed if elapsed else None,
+                'exchange_lag': self.exchange_lag.summary(), 'apply': self.apply.summary()}
+
+
+class LatencyTracker(object):
+
+    """Collects TableStats per table over a window, and logs a report every `log_interval` seconds.
+
+    `backlog` is an optional callable returning how many bytes are waiting to be read off the socket.
+    It's sampled every BACKLOG_SAMPLE messages. A growing backlog means the socket thread can't keep up.
+    Tables whose p99 exchange lag passes `warn_lag` seconds are logged as warnings.
+    """
+
+    BACKLOG_SAMPLE = 32
+
+    def __init__(self, log_interval=60, warn_lag=1.0, backlog=None):
+        self.log_interval = log_interval
+        self.warn_lag = warn_lag
+        self.backlog = backlog
+        self.reset()
+        # Exchange timestamps only change second every second; cache the parse of 'YYYY-MM-DDTHH:MM:SS'.
+        self._ts_prefix = None
+        self._ts_seconds = 0
+
+    def reset(self, now=None):
+        self.window_start = now or time.time()
+        self.next_report = self.window_start + self.log_interval if self.log_interval else None
+        self.tables = {}
+        self.messages = 0
+        self.backlog_last = None
+        self.backlog_max = None
+
+    def record(self, table, rows, received, started, applied):
+        """Record one table message: its rows, when it was received, and when we started and finished applying it."""
+        stats = self.tables.get(table)
+        if stats is None:
+            stats = self.tables[table] = TableStats()
+        stats.messages += 1
+        stats.rows += len(rows)
+        stats.apply.record(applied - started)
+        if rows:
+            exchange_ts = self.parse_timestamp(rows[-1].get('timestamp'))
+            if exchange_ts is not None:
+                stats.exchange_lag.record(received - exchange_ts)
+
+        self.messages += 1
+        if self.backlog is not None and self.messages % self.BACKLOG_SAMPLE == 0:
+            self.__sample_backlog()
+        if self.next_report is not None and applied >= self.next_report:
+            self.log_report(applied)
+
+    def parse_timestamp(self, value):
+        """Parse a BitMEX timestamp ('2019-06-01T00:00:00.000Z') to epoch seconds. None if there isn't one."""
+        if not value:
+            return None
+        prefix = value[:19]
+        if prefix != self._ts_prefix:
+            try:
+                self._ts_seconds = calendar.timegm(time.strptime(prefix, '%Y-%m-%dT%H:%M:%S'))
+            except ValueError:
+                return None
+            self._ts_prefix = prefix
+        fraction = value[20:-1]
+        return self._ts_seconds + (int(fraction) / 10.0 ** len(fraction) if fraction.isdigit() else 0)
+
+    def summary(self, now=None):
+        """Stats for every table since the window started, plus the socket backlog in bytes."""
+        elapsed = (now or time.time()) - self.window_start
+        return {
+            'window': elapsed,
+            'tables': {table: stats.summary(elapsed) for table, stats in self.tables.items()},
+            'backlog': self.backlog_last,
+            'backlog_max': self.backlog_max,
+        }
+
+    def log_report(self, now=None):
+        """Log the window's stats, then start a new window."""
+        report = self.summary(now)
+        for table, stats in sorted(report['tables'].items()):
+            lag, apply = stats['exchange_lag'], stats['apply']
+            line = "Feed %s: %d msgs (%.1f/s), apply p50 %s p99 %s max %s" % (
+                table, stats['messages'], stats['rate'] or 0, ms(apply['p50']), ms(apply['p99']), ms(apply['max']))
+            if lag['count']:
+                line += ", exchange lag p50 %s p99 %s max %s" % (ms(lag['p50']), ms(lag['p99']), ms(lag['max']))
+            if self.warn_lag and lag['count'] and lag['p99'] > self.warn_lag:
+                logger.warning(line)
+            else:
+                logger.info(line)
+        if report['backlog_max']:
+            logger.warning("Websocket backlog: up to %d bytes waiting to be read." % report['backlog_max'])
+        self.reset(now)
+
+    def __sample_backlog(self):
+        backlog = self.backlog()
+        if backlog is not None:
+            self.backlog_last = backlog
+            self.backlog_max = max(self.backlog_max or 0, backlog)
+
+
+def ms(seconds):
+    return '-' if seconds is None else '%.2fms' % (seconds * 1000)
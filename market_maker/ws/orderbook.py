@@ -0,0 +1,184 @@
+"""Incrementally maintained L2 order book, fed from orderBookL2 / orderBookL2_25."""
+from array import array
+from bisect import bisect_left
+
+
+class BookSide(object):
+
+    """One side of the book, stored in parallel arrays sorted best price first.
+
+    Rows are keyed by their BitMEX price id. Updates only carry the id and the new size,
+    so we keep an id -> price map and bisect on price to find the level: updates are
+    O(log n), inserts and deletes shift the arrays (a memmove, not a Python loop).
+    """
+
+    def __init__(self, descending):
+        # Bids are best at the highest price, asks at the lowest. We store a signed copy of the price
+        # so both sides are ascending and the best level is always at index 0.
+        self._sign = -1.0 if descending else 1.0
+        self._keys = array('d')
+        self._prices = array('d')
+        self._sizes = array('q')
+        self._ids = array('q')
+        self._price_of = {}
+
+    def clear(self):
+        del self._keys[:]
+        del self._prices[:]
+        del self._sizes[:]
+        del self._ids[:]
+        self._price_of.clear()
+
+    def insert(self, id, price, size):
+        if id in self._price_of:
+            self.delete(id)
+        key = self._sign * price
+        i = bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._prices.insert(i, price)
+        self._sizes.insert(i, size)
+        self._ids.insert(i, id)
+        self._price_of[id] = price
+
+    def update(self, id, size):
+        i = self._find(id)
+        if i is not None:
+            self._sizes[i] = size
+
+    def delete(self, id):
+        i = self._find(id)
+        if i is not None:
+            del self._keys[i]
+            del self._prices[i]
+            del self._sizes[i]
+            del self._ids[i]
+            del self._price_of[id]
+
+    def best(self):
+        """Return the best (price, size), or None if this side is empty."""
+        try:
+            return self._prices[0], self._sizes[0]
+        except IndexError:
+            return None
+
+    def best_price(self):
+        try:
+            return self._prices[0]
+        except IndexError:
+            return None
+
+    def top(self, depth=None):
+        """Return a view of the best `depth` levels (all of them if None). Nothing is copied."""
+        return DepthView(self, depth)
+
+    def prices(self, depth=None):
+        return self._prices[:depth].tolist()
+
+    def sizes(self, depth=None):
+        return self._sizes[:depth].tolist()
+
+    def _find(self, id):
+        price = self._price_of.get(id)
+        if price is None:
+            return None
+        i = bisect_left(self._keys, self._sign * price)
+        if i < len(self._ids) and self._ids[i] == id:
+            return i
+        return None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, level):
+        return self._prices[level], self._sizes[level]
+
+
+class DepthView(object):
+
+    """Read-only window onto the best levels of a BookSide. Levels are (price, size) tuples."""
+
+    __slots__ = ('side', 'depth')
+
+    def __init__(self, side, depth=None):
+        self.side = side
+        self.depth = depth
+
+    def __len__(self):
+        if self.depth is None:
+            return len(self.side)
+        return min(self.depth, len(self.side))
+
+    def __getitem__(self, level):
+        if level < 0:
+            level += len(self)
+        if not 0 <= level < len(self):
+            raise IndexError('depth level out of range')
+        return self.side[level]
+
+    def __iter__(self):
+        for level in range(len(self)):
+            yield self.side[level]
+
+    def prices(self):
+        return self.side.prices(self.depth)
+
+    def sizes(self):
+        return self.side.sizes(self.depth)
+
+
+class OrderBook(object):
+
+    """Price-level order book for one symbol.
+
+    Works with both the 25-level and the full-depth L2 feed: BitMEX sends a delete for a
+    level falling out of the top 25 and an insert for the one coming in, so there's nothing
+    special to do for the truncated feed.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+
+    def side(self, side):
+        return self.bids if side == 'Buy' else self.asks
+
+    def apply(self, action, rows):
+        """Apply an orderBookL2 partial/insert/update/delete to the book."""
+        if action == 'partial':
+            self.clear()
+        if action in ('partial', 'insert'):
+            for row in rows:
+                self.side(row['side']).insert(row['id'], row['price'], row['size'])
+        elif action == 'update':
+            for row in rows:
+                self.side(row['side']).update(row['id'], row['size'])
+        elif action == 'delete':
+            for row in rows:
+                self.side(row['side']).delete(row['id'])
+
+    def best_bid(self):
+        """Return the best bid as (price, size), or None if there are no bids."""
+        return self.bids.best()
+
+    def best_ask(self):
+        """Return the best ask as (price, size), or None if there are no asks."""
+        return self.asks.best()
+
+    def mid(self):
+        bid = self.bids.best_price()
+        ask = self.asks.best_price()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2
+
+    def depth(self, depth=None):
+        """Return (bids, asks) views of the top `depth` levels, best first."""
+        return self.bids.top(depth), self.asks.top(depth)
+
+    def __repr__(self):
+        return 'OrderBook(%s, bid=%r, ask=%r)' % (self.symbol, self.best_bid(), self.best_ask())
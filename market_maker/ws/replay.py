@@ -0,0 +1,161 @@
+"""Replay captured websocket sessions (see ws.capture) through BitMEXWebsocket, with no network."""
+import threading
+import time
+
+from market_maker.settings import settings
+from market_maker.utils import log
+from market_maker.ws.capture import CaptureReader
+from market_maker.ws.ws_thread import BitMEXWebsocket
+
+logger = log.setup_custom_logger('root')
+
+
+class ReplayWebsocket(BitMEXWebsocket):
+
+    """A BitMEXWebsocket fed from a capture journal instead of a socket.
+
+    Every frame goes through handle_message(), the same code path live frames take, stamped with
+    its recorded receive time. Tables, books, events and snapshots therefore end up exactly as
+    they were at that point of the recorded session.
+
+    With `speed=None` nothing runs in the background. The caller steps through the capture with
+    advance(), run_until() or replay(), as fast as frames can be applied, and every run is
+    identical. With a `speed`, connect() starts a thread that delivers frames in real time scaled
+    by `speed` (2.0 plays twice as fast as recorded), as a live connection would. Don't mix the two.
+
+    `source` is a capture file or directory, or any iterable of (receive ts, frame) pairs.
+    """
+
+    def __init__(self, source, speed=None, start=None, end=None, decoder=None, notifier=None):
+        super(ReplayWebsocket, self).__init__(decoder=decoder, notifier=notifier)
+        self.source = CaptureReader(source, start, end) if isinstance(source, str) else source
+        self.speed = speed
+        # Capture time we've replayed up to.
+        self.clock = None
+        self.count = 0
+        self.finished = False
+        self.wst = None
+        self._frames = iter(self.source)
+        self._next = None
+
+    def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True):
+        '''Replay frames until the initial data images are in, as connect() waits for them live.'''
+        self.symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        self.symbol = self.symbols[0]
+        self.shouldAuth = shouldAuth
+
+        required = self._required_tables()
+        while not required <= set(self.data):
+            if not self.step():
+                raise Exception("Capture ended before the %s data images arrived." %
+                                ", ".join(sorted(required - set(self.data))))
+        logger.info('Replayed all data images up to %s. Starting.' % time.strftime('%X', time.gmtime(self.clock)))
+
+        if self.speed is not None:
+            self.wst = threading.Thread(target=self.__play, name='replay')
+            self.wst.daemon = True
+            self.wst.start()
+
+    #
+    # Driving the replay
+    #
+    def step(self):
+        '''Apply the next frame. Returns False at the end of the capture.'''
+        frame = self.__peek()
+        if frame is None:
+            self.finished = True
+            return False
+        self._next = None
+        self.clock = frame[0]
+        self.handle_message(frame[1], frame[0])
+        self.count += 1
+        return True
+
+    def run_until(self, ts):
+        '''Apply every frame received up to capture time `ts`. Returns False once the capture is exhausted.'''
+        while True:
+            frame = self.__peek()
+            if frame is None:
+                self.finished = True
+                return False
+            if frame[0] > ts:
+                break
+            self.step()
+        self.clock = ts
+        return True
+
+    def advance(self, seconds):
+        '''Apply the next `seconds` of capture time. Returns False once the capture is exhausted.'''
+        if self.clock is None:
+            frame = self.__peek()
+            if frame is None:
+                return False
+            self.clock = frame[0]
+        return self.run_until(self.clock + seconds)
+
+    def replay(self):
+        '''Apply everything left in the capture. Returns the total number of frames replayed.'''
+        while self.step():
+            pass
+        return self.count
+
+    #
+    # BitMEXWebsocket overrides
+    #
+    def now(self):
+        # Capture time, so age-based table retention sees the session as it was recorded.
+        return self.clock if self.clock is not None else time.time()
+
+    def stale_tables(self, now=None):
+        return super(ReplayWebsocket, self).stale_tables(now or self.clock)
+
+    def is_alive(self):
+        return not self.exited
+
+    def resubscribe(self, table):
+        logger.debug("Ignoring resubscribe to %s during replay." % table)
+
+    def exit(self):
+        self.exited = True
+
+    #
+    # Private methods
+    #
+    def __peek(self):
+        if self._next is None:
+            self._next = next(self._frames, None)
+        return self._next
+
+    def __play(self):
+        '''Deliver the rest of the capture in scaled real time.'''
+        origin, started = self.clock, time.time()
+        while not self.exited:
+            frame = self.__peek()
+            if frame is None:
+                break
+            wait = started + (frame[0] - origin) / self.speed - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.step()
+        self.finished = True
+        logger.info("Replay finished after %d frames." % self.count)
+
+
+def run_strategy(manager, ws, interval=None):
+    """Tick `manager` every `interval` seconds of capture time until `ws` runs out of frames.
+
+    `manager` is an OrderManager (or a subclass, or a MultiSymbolOrderManager) whose connector reads
+    from `ws`, a ReplayWebsocket with no `speed`. Each tick does what run_loop() does, minus the
+    waiting, so a strategy sees the same state it would have seen live, every run.
+    Returns the number of ticks.
+    """
+    interval = interval or settings.LOOP_INTERVAL
+    managers = getattr(manager, 'managers', [manager])
+    ticks = 0
+    while ws.advance(interval):
+        for m in managers:
+            m.sanity_check()
+            m.print_status()
+            m.place_orders()
+        ticks += 1
+    return ticks
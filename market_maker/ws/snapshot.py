@@ -0,0 +1,38 @@
+"""Consistent, immutable views of BitMEXWebsocket state."""
+
+
+class Snapshot(object):
+
+    """Everything the strategy needs for one symbol, as of websocket sequence number `seq`.
+
+    Rows are shared with the live tables rather than copied. That is safe because table rows are
+    copy-on-write and never change once stored. The book is the top `depth` levels copied into
+    (price, size) lists, best first.
+    """
+
+    __slots__ = ('seq', 'symbol', 'instrument', 'orders', 'position', 'margin', 'bids', 'asks')
+
+    def __init__(self, seq, symbol, instrument, orders, position, margin, bids, asks):
+        self.seq = seq
+        self.symbol = symbol
+        self.instrument = instrument
+        self.orders = orders
+        self.position = position
+        self.margin = margin
+        self.bids = bids
+        self.asks = asks
+
+    def open_orders(self, clOrdIDPrefix):
+        """Our open orders on this symbol, as BitMEXWebsocket.open_orders would return them."""
+        return [o for o in self.orders if str(o['clOrdID']).startswith(clOrdIDPrefix) and o['leavesQty'] > 0 and
+                o['symbol'] == self.symbol]
+
+    def best_bid(self):
+        return self.bids[0] if self.bids else None
+
+    def best_ask(self):
+        return self.asks[0] if self.asks else None
+
+    def __repr__(self):
+        return 'Snapshot(seq=%d, symbol=%s, bid=%r, ask=%r, orders=%d)' % (
+            self.seq, self.symbol, self.best_bid(), self.best_ask(), len(self.orders))
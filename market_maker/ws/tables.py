@@ -0,0 +1,468 @@
+"""Storage for the tables maintained by BitMEXWebsocket."""
+import decimal
+import time
+from bisect import bisect_left, insort
+from itertools import islice
+
+
+class KeyedTable(object):
+
+    """A websocket table indexed by the key tuple sent in the table's `partial`.
+
+    Rows live in an insertion-ordered dict keyed by the row's key values, so
+    upserts and deletes are O(1) instead of a scan over the whole table.
+
+    Readers get a plain list of the rows via `rows()`, which is also what
+    iteration and indexing go through. That list is rebuilt lazily after a
+    change and is never mutated once handed out, so a reader on another
+    thread can iterate it while the websocket thread keeps writing. Rows
+    themselves are never mutated either; see `merge`.
+    """
+
+    def __init__(self, keys=None):
+        self.keys = list(keys or [])
+        self._rows = {}
+        self._view = None
+        self._seq = 0  # Fallback key for tables without keys, e.g. 'trade'
+
+    def set_keys(self, keys):
+        """Set the key columns for this table, re-indexing any rows we already hold."""
+        keys = list(keys or [])
+        if keys == self.keys:
+            return
+        self.keys = keys
+        rows = list(self._rows.values())
+        self._rows = {}
+        self._view = None
+        self.extend(rows)
+
+    def key_of(self, item):
+        if not self.keys:
+            self._seq += 1
+            return self._seq
+        return tuple(item.get(key) for key in self.keys)
+
+    def get(self, *key):
+        """Look up a row by the values of its key columns, in key order."""
+        return self._rows.get(key)
+
+    def find(self, matchData):
+        """Return the row matching the keys present in `matchData`, or None."""
+        if not self.keys:
+            return None
+        return self._rows.get(tuple(matchData[key] for key in self.keys))
+
+    def upsert(self, item):
+        """Insert a row, replacing any existing row with the same keys."""
+        self._rows[self.key_of(item)] = item
+        self._view = None
+
+    def extend(self, items, received=None):
+        """Upsert each of `items`. `received` (the frame's receive time) only matters to RingTable."""
+        for item in items:
+            self.upsert(item)
+
+    def update(self, updateData):
+        """Merge `updateData` into the matching row and return it, or None if there's no such row."""
+        item = self.find(updateData)
+        if item is not None:
+            item = self.merge(item, updateData)
+        return item
+
+    def merge(self, item, updateData):
+        """Apply `updateData` to a row already found in this table and return the new row.
+
+        Rows are copy-on-write: the merged row replaces the old one instead of mutating it, so a
+        reader holding the old row (or an old `rows()` list) never sees a half-applied update.
+        """
+        new = self.merged(item, updateData)
+        self._rows[tuple(item.get(key) for key in self.keys)] = new
+        self._view = None
+        return new
+
+    def merged(self, item, updateData):
+        new = dict(item)
+        new.update(updateData)
+        return new
+
+    def delete(self, matchData):
+        """Remove the row matching `matchData` and return it, or None if there's no such row."""
+        if not self.keys:
+            return None
+        item = self._rows.pop(tuple(matchData[key] for key in self.keys), None)
+        if item is not None:
+            self._view = None
+        return item
+
+    def drop_oldest(self, count):
+        """Remove the `count` rows that were inserted first."""
+        for key in list(islice(self._rows, count)):
+            del self._rows[key]
+        self._view = None
+
+    def clear(self, symbol=None):
+        """Remove every row, or with `symbol`, just that symbol's rows."""
+        if symbol is None:
+            self._rows = {}
+        else:
+            self._rows = {key: item for key, item in self._rows.items() if item.get('symbol') != symbol}
+        self._view = None
+
+    def rows(self):
+        """Return the rows as a list. Don't mutate it; it's shared with other readers."""
+        view = self._view
+        if view is None:
+            # list(dict.values()) runs without releasing the GIL, so this can't see a half-applied insert.
+            view = self._view = list(self._rows.values())
+        return view
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def __getitem__(self, index):
+        return self.rows()[index]
+
+    def __contains__(self, item):
+        return item in self.rows()
+
+    def __bool__(self):
+        return bool(self._rows)
+
+    def __repr__(self):
+        return '%s(keys=%r, rows=%d)' % (self.__class__.__name__, self.keys, len(self))
+
+
+class InstrumentTable(KeyedTable):
+
+    """The instrument table, keyed by symbol, with static per-instrument fields precomputed.
+
+    On insert (and whenever one of their inputs changes) each row gets:
+      tickLog            - decimal places in tickSize, for formatting and rounding
+      tickScale          - 10 ** tickLog
+      tickUnits          - tickSize * tickScale as an int, so tickSize == tickUnits / tickScale exactly
+      futureType         - "Quanto", "Inverse" or "Linear"
+      contractMultiplier - multiplier in settlement currency per contract, used for delta
+    """
+
+    STATIC_FIELDS = {'tickSize', 'multiplier', 'isQuanto', 'isInverse', 'underlyingToSettleMultiplier',
+                     'quoteToSettleMultiplier'}
+
+    def upsert(self, item):
+        annotateInstrument(item)
+        KeyedTable.upsert(self, item)
+
+    def merged(self, item, updateData):
+        new = KeyedTable.merged(self, item, updateData)
+        if not self.STATIC_FIELDS.isdisjoint(updateData):
+            annotateInstrument(new)
+        return new
+
+
+class OrderTable(KeyedTable):
+
+    """The order table, with our open orders also indexed by clOrdID and by symbol, side and price.
+
+    The indexes are updated on every insert, update and delete, so the order manager's per-tick
+    questions don't scan the table: best open bid/ask is O(1), a clOrdID lookup is O(1), and the
+    open orders for a clOrdID prefix are rebuilt at most once per change to the table.
+    """
+
+    def __init__(self, keys=None):
+        KeyedTable.__init__(self, keys)
+        self._clOrdIDs = {}
+        self._sides = {}  # (symbol, side) -> OrderSide of open orders
+        self._side_of = {}  # orderID -> OrderSide it's in
+        self._open = {}  # (prefix, symbol) -> cached open_orders() result
+
+    def upsert(self, item):
+        KeyedTable.upsert(self, item)
+        self.__index(item)
+
+    def merge(self, item, updateData):
+        new = KeyedTable.merge(self, item, updateData)
+        self.__index(new, item)
+        return new
+
+    def delete(self, matchData):
+        item = KeyedTable.delete(self, matchData)
+        if item is not None:
+            self.__unindex(item)
+        return item
+
+    def drop_oldest(self, count):
+        for item in list(islice(self._rows.values(), count)):
+            self.__unindex(item)
+        KeyedTable.drop_oldest(self, count)
+
+    def clear(self, symbol=None):
+        if symbol is not None:
+            for item in [o for o in self.rows() if o.get('symbol') == symbol]:
+                self.delete(item)
+            return
+        KeyedTable.clear(self)
+        self._clOrdIDs = {}
+        self._sides = {}
+        self._side_of = {}
+        self._open = {}
+
+    def by_clOrdID(self, clOrdID):
+        return self._clOrdIDs.get(clOrdID)
+
+    def open_orders(self, clOrdIDPrefix, symbol=None):
+        """Open orders whose clOrdID starts with `clOrdIDPrefix`, in the order they were placed.
+
+        Don't mutate the list; it's cached and shared until the table next changes."""
+        cache = self._open
+        key = (clOrdIDPrefix, symbol)
+        orders = cache.get(key)
+        if orders is None:
+            orders = cache[key] = [o for o in self.rows() if isOpen(o) and
+                                   str(o['clOrdID']).startswith(clOrdIDPrefix) and
+                                   (symbol is None or o['symbol'] == symbol)]
+        return orders
+
+    def side_orders(self, symbol, side):
+        """Open orders on one side of a symbol, best price first, then oldest first."""
+        book = self._sides.get((symbol, side))
+        return [self.get(orderID) for orderID in book.orderIDs()] if book else []
+
+    def best(self, symbol, side, clOrdIDPrefix=''):
+        """The best priced open order on a side (highest buy, lowest sell) with the given clOrdID prefix, or None."""
+        book = self._sides.get((symbol, side))
+        if book is None:
+            return None
+        for orderID in book.iter_orderIDs():
+            order = self.get(orderID)
+            if order is not None and str(order['clOrdID']).startswith(clOrdIDPrefix):
+                return order
+        return None
+
+    def __index(self, item, old=None):
+        orderID = item.get('orderID')
+        if old is not None and old.get('clOrdID') != item.get('clOrdID'):
+            self._clOrdIDs.pop(old.get('clOrdID'), None)
+        if item.get('clOrdID'):
+            self._clOrdIDs[item['clOrdID']] = item
+        book = self._side_of.get(orderID)
+        if book is not None:
+            if isOpen(item) and old is not None and old.get('price') == item.get('price'):
+                self._open = {}
+                return  # Still resting at the same price: its place in the side is unchanged.
+            book.remove(orderID)
+            del self._side_of[orderID]
+        if isOpen(item) and item.get('price') is not None:
+            book = self._sides.get((item['symbol'], item['side']))
+            if book is None:
+                book = self._sides[(item['symbol'], item['side'])] = OrderSide(item['side'] == 'Buy')
+            book.insert(orderID, item['price'])
+            self._side_of[orderID] = book
+        self._open = {}
+
+    def __unindex(self, item):
+        if self._clOrdIDs.get(item.get('clOrdID')) is not None:
+            del self._clOrdIDs[item['clOrdID']]
+        book = self._side_of.pop(item.get('orderID'), None)
+        if book is not None:
+            book.remove(item['orderID'])
+        self._open = {}
+
+
+class OrderSide(object):
+
+    """OrderIDs on one side of a symbol, sorted best price first and then by arrival.
+
+    Entries are (signed price, arrival, orderID) tuples in a list kept sorted with bisect, so
+    the best order is at index 0 and inserts/removes are a binary search plus a memmove.
+    """
+
+    def __init__(self, descending):
+        self._sign = -1 if descending else 1
+        self._entries = []
+        self._entry_of = {}
+        self._arrivals = 0
+
+    def insert(self, orderID, price):
+        self._arrivals += 1
+        entry = (self._sign * price, self._arrivals, orderID)
+        insort(self._entries, entry)
+        self._entry_of[orderID] = entry
+
+    def remove(self, orderID):
+        entry = self._entry_of.pop(orderID, None)
+        if entry is not None:
+            i = bisect_left(self._entries, entry)
+            del self._entries[i]
+
+    def orderIDs(self):
+        return [entry[2] for entry in self._entries]
+
+    def iter_orderIDs(self):
+        entries = self._entries
+        for i in range(len(entries)):
+            try:
+                yield entries[i][2]
+            except IndexError:
+                return  # Shrank under us on the socket thread
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def isOpen(order):
+    return (order.get('leavesQty') or 0) > 0 and order.get('ordStatus') not in ('Filled', 'Canceled', 'Rejected')
+
+
+def annotateInstrument(instrument):
+    tickSize = instrument.get('tickSize')
+    if tickSize:
+        # Turn the 'tickSize' into 'tickLog' for use in rounding
+        # http://stackoverflow.com/a/6190291/832202
+        instrument['tickLog'] = max(decimal.Decimal(str(tickSize)).as_tuple().exponent * -1, 0)
+        instrument['tickScale'] = 10 ** instrument['tickLog']
+        instrument['tickUnits'] = int(round(tickSize * instrument['tickScale']))
+
+    if instrument.get('isQuanto'):
+        instrument['futureType'] = "Quanto"
+    elif instrument.get('isInverse'):
+        instrument['futureType'] = "Inverse"
+    else:
+        instrument['futureType'] = "Linear"
+
+    multiplier = instrument.get('multiplier')
+    settleMultiplier = instrument.get('underlyingToSettleMultiplier')
+    if settleMultiplier is None:
+        settleMultiplier = instrument.get('quoteToSettleMultiplier')
+    if multiplier is not None and settleMultiplier:
+        instrument['contractMultiplier'] = float(multiplier) / float(settleMultiplier)
+    else:
+        instrument['contractMultiplier'] = None
+
+
+class RingTable(object):
+
+    """A fixed-capacity ring buffer for append-only tables ('trade', 'quote', 'execution').
+
+    Keeps at most `capacity` rows and, if `max_age` is set, drops rows received more than
+    `max_age` seconds ago, as of `clock()`: on append, and on read, so a quiet table doesn't go on
+    serving old rows. Appends never reallocate. Readers walk the slots by index, so
+    `newest(n)` iterates the last n rows in place without copying the table, and never
+    trips over a concurrent append the way iterating a list or deque would.
+    """
+
+    def __init__(self, capacity, max_age=None, keys=None, clock=time.time):
+        self.keys = list(keys or [])
+        self.capacity = capacity
+        self.max_age = max_age
+        self.clock = clock
+        self._slots = [None] * capacity
+        self._times = [0.0] * capacity
+        self._start = 0  # Absolute index of the oldest row still retained by age
+        self._end = 0  # Absolute index one past the newest row
+
+    def set_keys(self, keys):
+        self.keys = list(keys or [])
+
+    def find(self, matchData):
+        return None  # Append-only; BitMEX never updates these rows
+
+    def update(self, updateData):
+        return None
+
+    def delete(self, matchData):
+        return None
+
+    def upsert(self, item):
+        self.extend([item])
+
+    def extend(self, items, received=None):
+        """Append `items`, stamped with `received`, the time their frame arrived (default now). Replays
+        pass the recorded time, so age-based retention sees the session as it happened."""
+        now = received or self.clock()
+        capacity = self.capacity
+        end = self._end
+        for item in items:
+            self._slots[end % capacity] = item
+            self._times[end % capacity] = now
+            end += 1
+        self._end = end
+        if self.max_age is not None:
+            self._expire(now - self.max_age)
+
+    def _expire(self, cutoff):
+        start = max(self._start, self._end - self.capacity)
+        while start < self._end and self._times[start % self.capacity] < cutoff:
+            self._slots[start % self.capacity] = None
+            start += 1
+        self._start = start
+
+    def clear(self, symbol=None):
+        """Remove every row, or with `symbol`, just that symbol's rows."""
+        if symbol is None:
+            self._slots = [None] * self.capacity
+            self._start = self._end
+            return
+        capacity = self.capacity
+        kept = [(self._slots[i % capacity], self._times[i % capacity]) for i in range(self._first(), self._end)
+                if self._slots[i % capacity].get('symbol') != symbol]
+        slots, times = [None] * capacity, [0.0] * capacity
+        start = self._end
+        for n, (item, stamp) in enumerate(kept):
+            slots[(start + n) % capacity] = item
+            times[(start + n) % capacity] = stamp
+        self._slots, self._times = slots, times
+        self._start, self._end = start, start + len(kept)
+
+    def _first(self):
+        first, end = max(self._start, self._end - self.capacity), self._end
+        if self.max_age is None:
+            return first
+        # Readers can't drop expired rows (that's the writer's job), so skip past them. Receive times
+        # only go up, so bisect for the first row young enough.
+        cutoff = self.clock() - self.max_age
+        times, capacity = self._times, self.capacity
+        while first < end:
+            mid = (first + end) // 2
+            if times[mid % capacity] < cutoff:
+                first = mid + 1
+            else:
+                end = mid
+        return first
+
+    def newest(self, count):
+        """Iterate over the newest `count` rows, oldest of them first."""
+        end = self._end
+        begin = max(end - count, self._first())
+        slots = self._slots
+        capacity = self.capacity
+        for i in range(begin, end):
+            yield slots[i % capacity]
+
+    def rows(self):
+        """Return the rows as a new list, oldest first."""
+        return list(self.newest(self.capacity))
+
+    def __len__(self):
+        return self._end - self._first()
+
+    def __iter__(self):
+        return self.newest(self.capacity)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.rows()[index]
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('table index out of range')
+        return self._slots[(self._end - length + index) % self.capacity]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return '%s(capacity=%d, max_age=%r, rows=%d)' % (self.__class__.__name__, self.capacity, self.max_age,
+                                                         len(self))
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import ssl
+
+import aiohttp
+
+from market_maker.utils import log
+from market_maker.ws.ws_thread import BitMEXWebsocket
+
+logger = log.setup_custom_logger('root')
+
+
+# asyncio flavour of BitMEXWebsocket.
+#
+# Frames are consumed by a task on the running event loop instead of a daemon thread, and `connect()`
+# is awaitable: it returns once every partial we need has arrived, without polling sleeps.
+# All table maintenance (order book, instruments, events...) is shared with BitMEXWebsocket.
+#
+# Requires aiohttp (pip install bitmex-market-maker[asyncio]).
+class AsyncBitMEXWebsocket(BitMEXWebsocket):
+
+    def __init__(self, decoder=None, notifier=None, session=None, capture=None):
+        super(AsyncBitMEXWebsocket, self).__init__(decoder=decoder, notifier=notifier, capture=capture)
+        self.session = session
+        self._owns_session = session is None
+        self.ws = None
+        self._consumer = None
+        self._ready = None
+
+    async def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True, timeout=30):
+        '''Connect to the websocket and wait for the initial data images.'''
+        logger.debug("Connecting WebSocket.")
+        self.symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        self.symbol = self.symbols[0]
+        self.shouldAuth = shouldAuth
+        self._ready = asyncio.Event()
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+        wsURL = self._get_url(endpoint)
+        logger.info("Connecting to %s" % wsURL)
+        headers = {k.strip(): v.strip() for k, v in (h.split(':', 1) for h in self._get_auth())}
+        self.ws = await self.session.ws_connect(wsURL, headers=headers, ssl=ssl.create_default_context(),
+                                                heartbeat=30)
+        self._consumer = asyncio.ensure_future(self.__consume())
+        logger.info('Connected to WS. Waiting for data images, this may take a moment...')
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise Exception("Timed out waiting for websocket data images.")
+        # An error frame (bad key, failed subscription) or the socket closing also ends the wait.
+        if self._error is not None or not self._required_tables() <= set(self.data):
+            await self.close()
+            raise Exception("Websocket failed before the data images arrived: %s" % (self._error or 'closed'))
+        logger.info('Got all market data. Starting.')
+
+    async def send_command(self, command, args):
+        '''Send a raw command.'''
+        await self.ws.send_str(json.dumps({"op": command, "args": args or []}))
+
+    async def close(self):
+        self.exited = True
+        if self._consumer is not None:
+            self._consumer.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+
+    def error(self, err):
+        super(AsyncBitMEXWebsocket, self).error(err)
+        if self._ready is not None:
+            self._ready.set()  # Fail connect() now rather than at its timeout.
+
+    def exit(self):
+        '''Synchronous shutdown, e.g. from __del__. Schedules close() if a loop is running.'''
+        self.exited = True
+        if self.ws is None or self.ws.closed:
+            return
+        try:
+            asyncio.get_event_loop().create_task(self.close())
+        except RuntimeError:
+            pass
+
+    async def __consume(self):
+        try:
+            async for msg in self.ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    if self.capture is not None:
+                        self.capture.write(msg.data)
+                    self.handle_message(msg.data)
+                    if not self._ready.is_set() and self._required_tables() <= set(self.data):
+                        self._ready.set()
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    self.error(self.ws.exception())
+                    break
+        finally:
+            if not self.exited:
+                logger.info('Websocket Closed')
+            self.exited = True
+            if self._ready is not None:
+                self._ready.set()
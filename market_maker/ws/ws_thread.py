@@ -1,16 +1,27 @@
 import sys
 import websocket
 import threading
+import time
 import traceback
 import ssl
 from time import sleep
 import json
-import decimal
 import logging
+from array import array
+try:
+    import fcntl
+    import termios
+except ImportError:  # Not on Windows; backlog() just returns None there.
+    pass
 from market_maker.settings import settings
 from market_maker.auth.APIKeyAuth import generate_expires, generate_signature
-from market_maker.utils import log
-from market_maker.utils.math import toNearest
+from market_maker.utils import fastjson, log
+from market_maker.utils.math import fromTicks, toTicks
+from market_maker.ws import events
+from market_maker.ws.latency import LatencyTracker
+from market_maker.ws.orderbook import OrderBook
+from market_maker.ws.snapshot import Snapshot
+from market_maker.ws.tables import InstrumentTable, KeyedTable, OrderTable, RingTable
 from future.utils import iteritems
 from future.standard_library import hooks
 with hooks():  # Python 2/3 compat
@@ -33,33 +44,41 @@ class BitMEXWebsocket():
     # Don't grow a table larger than this amount. Helps cap memory usage.
     MAX_TABLE_LEN = 200
 
-    def __init__(self):
+    # Tables we subscribe to per symbol, as opposed to account-wide or for every instrument.
+    SYMBOL_TABLES = ('quote', 'trade', 'orderBookL2_25', 'orderBookL2', 'order', 'execution')
+
+    def __init__(self, decoder=None, notifier=None, capture=None):
         self.updated = True
+        # Optional CaptureWriter; every raw frame we receive is journaled to it. See ws.capture.
+        self.capture = capture
+        # Called with this websocket if the connection drops unexpectedly.
+        self.on_disconnect = None
+        # Change events (top of book, fills, position) are published here. See ws.events.
+        self.events = notifier or events.ChangeNotifier()
+        # Parses raw frames. Defaults to the fastest JSON backend installed; see utils.fastjson.
+        self.decode = decoder or fastjson.get_decoder(settings.JSON_BACKEND)
+        # 'orderBookL2_25' for the top 25 levels, 'orderBookL2' for full depth.
+        self.book_table = settings.ORDERBOOK_TABLE
+        # Per-table feed latency, message rates and socket backlog. See ws.latency.
+        self.latency = LatencyTracker(settings.WS_LATENCY_LOG_INTERVAL, settings.WS_LATENCY_WARNING,
+                                      self.backlog) if settings.WS_LATENCY_STATS else None
         self.__reset()
 
     def __del__(self):
         self.exit()
 
     def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True):
-        '''Connect to the websocket and initialize data stores.'''
+        '''Connect to the websocket and initialize data stores.
+
+        `symbol` may also be a list of symbols; they all share this one connection.'''
 
         logger.debug("Connecting WebSocket.")
-        self.symbol = symbol
+        self.symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        self.symbol = self.symbols[0]
         self.shouldAuth = shouldAuth
 
-        # We can subscribe right in the connection querystring, so let's build that.
-        # Subscribe to all pertinent endpoints
-        subscriptions = [sub + ':' + symbol for sub in ["quote", "trade", "orderBookL2_25"]]
-        subscriptions += ["instrument"]  # We want all of them
-        if self.shouldAuth:
-            subscriptions += [sub + ':' + symbol for sub in ["order", "execution"]]
-            subscriptions += ["margin", "position"]
-
         # Get WS URL and connect.
-        urlParts = list(urlparse(endpoint))
-        urlParts[0] = urlParts[0].replace('http', 'ws')
-        urlParts[2] = "/realtime?subscribe=" + ",".join(subscriptions)
-        wsURL = urlunparse(urlParts)
+        wsURL = self._get_url(endpoint)
         logger.info("Connecting to %s" % wsURL)
         self.__connect(wsURL)
         logger.info('Connected to WS. Waiting for data images, this may take a moment...')
@@ -74,14 +93,10 @@ class BitMEXWebsocket():
     # Data methods
     #
     def get_instrument(self, symbol):
-        instruments = self.data['instrument']
-        matchingInstruments = [i for i in instruments if i['symbol'] == symbol]
-        if len(matchingInstruments) == 0:
+        '''Return the instrument row for a symbol. tickLog and friends are precomputed; see InstrumentTable.'''
+        instrument = self.data['instrument'].get(symbol)
+        if instrument is None:
             raise Exception("Unable to find instrument or index with symbol: " + symbol)
-        instrument = matchingInstruments[0]
-        # Turn the 'tickSize' into 'tickLog' for use in rounding
-        # http://stackoverflow.com/a/6190291/832202
-        instrument['tickLog'] = decimal.Decimal(str(instrument['tickSize'])).as_tuple().exponent * -1
         return instrument
 
     def get_ticker(self, symbol):
@@ -104,19 +119,30 @@ class BitMEXWebsocket():
                 "mid": (bid + ask) / 2
             }
 
-        # The instrument has a tickSize. Use it to round values.
-        return {k: toNearest(float(v or 0), instrument['tickSize']) for k, v in iteritems(ticker)}
+        # The instrument has a tickSize. Use it to round values, exactly, via a whole number of ticks.
+        tickSize, tickUnits, tickScale = instrument['tickSize'], instrument['tickUnits'], instrument['tickScale']
+        return {k: fromTicks(toTicks(float(v or 0), tickSize), tickUnits, tickScale) for k, v in iteritems(ticker)}
 
     def funds(self):
         return self.data['margin'][0]
 
     def market_depth(self):
-        return self.data['orderBookL2_25']
+        return self.data[self.book_table]
 
-    def open_orders(self, clOrdIDPrefix):
-        orders = self.data['order']
-        # Filter to only open orders (leavesQty > 0) and those that we actually placed
-        return [o for o in orders if str(o['clOrdID']).startswith(clOrdIDPrefix) and o['leavesQty'] > 0]
+    def order_book(self, symbol):
+        '''Return the sorted OrderBook for a symbol.'''
+        return self.__get_book(symbol)
+
+    def open_orders(self, clOrdIDPrefix, symbol=None):
+        '''Open orders (leavesQty > 0) that we actually placed. Served from OrderTable's index.'''
+        return self.data['order'].open_orders(clOrdIDPrefix, symbol)
+
+    def best_open_order(self, clOrdIDPrefix, symbol, side):
+        '''Our highest open buy or lowest open sell on a symbol, or None.'''
+        return self.data['order'].best(symbol, side, clOrdIDPrefix)
+
+    def order_by_clOrdID(self, clOrdID):
+        return self.data['order'].by_clOrdID(clOrdID)
 
     def position(self, symbol):
         positions = self.data['position']
@@ -126,8 +152,97 @@ class BitMEXWebsocket():
             return {'avgCostPrice': 0, 'avgEntryPrice': 0, 'currentQty': 0, 'symbol': symbol}
         return pos[0]
 
-    def recent_trades(self):
-        return self.data['trade']
+    def snapshot(self, symbol=None, depth=25):
+        '''Return a consistent, immutable Snapshot of a symbol's instrument, orders, position, margin and book.
+
+        Lock-free: we read, then check the sequence number didn't move while we were reading, and retry
+        if it did. The socket thread never waits on us, and rows are shared, not copied.'''
+        symbol = symbol or self.symbol
+        while True:
+            seq = self.seq
+            if seq & 1:
+                sleep(0)  # A message is being applied; let the socket thread finish it.
+                continue
+            try:
+                instrument = self.data['instrument'].get(symbol) if 'instrument' in self.data else None
+                orders = self.data['order'].rows() if 'order' in self.data else []
+                position = self.position(symbol) if 'position' in self.data else None
+                margin = self.data['margin'][0] if self.data.get('margin') else None
+                book = self.books.get(symbol)
+                bids = list(book.bids.top(depth)) if book else []
+                asks = list(book.asks.top(depth)) if book else []
+            except IndexError:
+                continue  # The book shrank under us; this read is going to be retried anyway.
+            if self.seq == seq:
+                return Snapshot(seq, symbol, instrument, orders, position, margin, bids, asks)
+
+    #
+    # Liveness
+    #
+    def now(self):
+        '''The time, as far as the tables are concerned. See ReplayWebsocket.'''
+        return time.time()
+
+    def stale_tables(self, now=None):
+        '''Return the tables that haven't had a message within their TABLE_STALE_TIMEOUT.'''
+        now = now or time.time()
+        return [table for table, timeout in iteritems(settings.TABLE_STALE_TIMEOUT)
+                if table in self.last_message and not self.__awaiting_partial(table, now) and
+                now - self.last_message[table] > timeout]
+
+    def __awaiting_partial(self, table, now):
+        return any(t == table and deadline > now for (t, symbol), deadline in list(self.resubscribing.items()))
+
+    def is_alive(self):
+        '''True if the socket is open and has answered our pings recently.'''
+        if self.exited or not self.ws.sock or not self.ws.sock.connected:
+            return False
+        # websocket-client records when the last ping went out and the last pong came in; if a ping goes
+        # unanswered the link is dead even though the socket still looks connected. Same rule as its own
+        # ping_timeout: dead only once the latest ping has waited longer than WS_PING_TIMEOUT for its pong.
+        last_pong = getattr(self.ws, 'last_pong_tm', 0)
+        last_ping = getattr(self.ws, 'last_ping_tm', 0)
+        return not (last_pong < last_ping and time.time() - last_ping > settings.WS_PING_TIMEOUT)
+
+    def latency_stats(self):
+        '''Per-table message rates and latency histograms since the last latency report. See LatencyTracker.summary.'''
+        return self.latency.summary() if self.latency is not None else None
+
+    def backlog(self):
+        '''Bytes received by the OS but not yet read off the socket, or None if we can't tell.'''
+        try:
+            sock = self.ws.sock.sock
+            pending = array('i', [0])
+            fcntl.ioctl(sock.fileno(), termios.FIONREAD, pending)
+            # Decrypted bytes buffered inside the SSL layer count too.
+            return pending[0] + (sock.pending() if hasattr(sock, 'pending') else 0)
+        except (AttributeError, OSError, NameError):
+            return None
+
+    def resubscribe(self, table):
+        '''Unsubscribe and resubscribe one table.
+
+        Each symbol's rows keep serving until that symbol's new partial arrives, and are rebuilt from it.
+        The rest of the state is untouched. If a partial hasn't come within WS_RESUBSCRIBE_TIMEOUT, the
+        table can be found stale and resubscribed again.'''
+        if table in BitMEXWebsocket.SYMBOL_TABLES:
+            symbols = self.symbols
+            args = [table + ':' + symbol for symbol in symbols]
+        else:
+            symbols = [None]
+            args = [table]
+        logger.warning("Resubscribing to %s." % ", ".join(args))
+        deadline = time.time() + settings.WS_RESUBSCRIBE_TIMEOUT
+        for symbol in symbols:
+            self.resubscribing[(table, symbol)] = deadline
+        self.__send_command('unsubscribe', args)
+        self.__send_command('subscribe', args)
+
+    def recent_trades(self, count=None):
+        '''Return the trade table, or an iterator over just the newest `count` trades.'''
+        if count is None:
+            return self.data['trade']
+        return self.data['trade'].newest(count)
 
     #
     # Lifecycle methods
@@ -156,10 +271,13 @@ class BitMEXWebsocket():
                                          on_close=self.__on_close,
                                          on_open=self.__on_open,
                                          on_error=self.__on_error,
-                                         header=self.__get_auth()
+                                         header=self._get_auth()
                                          )
 
-        self.wst = threading.Thread(target=lambda: self.ws.run_forever(sslopt=sslopt_ca_certs))
+        # Ping regularly; websocket-client errors out (and we exit) if a pong doesn't come back in time.
+        self.wst = threading.Thread(target=lambda: self.ws.run_forever(sslopt=sslopt_ca_certs,
+                                                                       ping_interval=settings.WS_PING_INTERVAL,
+                                                                       ping_timeout=settings.WS_PING_TIMEOUT))
         self.wst.daemon = True
         self.wst.start()
         logger.info("Started thread")
@@ -175,7 +293,27 @@ class BitMEXWebsocket():
             self.exit()
             sys.exit(1)
 
-    def __get_auth(self):
+    def _get_url(self, endpoint):
+        '''Return the websocket URL for `endpoint`, subscribing to everything we need in the querystring.'''
+        subscriptions = [sub + ':' + symbol for symbol in self.symbols for sub in ["quote", "trade", self.book_table]]
+        subscriptions += ["instrument"]  # We want all of them
+        if self.shouldAuth:
+            subscriptions += [sub + ':' + symbol for symbol in self.symbols for sub in ["order", "execution"]]
+            subscriptions += ["margin", "position"]
+
+        urlParts = list(urlparse(endpoint))
+        urlParts[0] = urlParts[0].replace('http', 'ws')
+        urlParts[2] = "/realtime?subscribe=" + ",".join(subscriptions)
+        return urlunparse(urlParts)
+
+    def _required_tables(self):
+        '''Tables whose partials must arrive before we're ready to trade.'''
+        tables = {'instrument', 'trade', 'quote'}
+        if self.shouldAuth:
+            tables |= {'margin', 'position', 'order', self.book_table}
+        return tables
+
+    def _get_auth(self):
         '''Return auth headers. Will use API Keys if present in settings.'''
 
         if self.shouldAuth is False:
@@ -194,7 +332,7 @@ class BitMEXWebsocket():
     def __wait_for_account(self):
         '''On subscribe, this data will come down. Wait for it.'''
         # Wait for the keys to show up from the ws
-        while not {'margin', 'position', 'order', 'orderBookL2_25'} <= set(self.data):
+        while not {'margin', 'position', 'order', self.book_table} <= set(self.data):
             sleep(0.1)
 
     def __wait_for_symbol(self, symbol):
@@ -208,16 +346,31 @@ class BitMEXWebsocket():
 
     def __on_message(self, message):
         '''Handler for parsing WS messages.'''
-        message = json.loads(message)
-        logger.debug(json.dumps(message))
+        if self.capture is not None:
+            self.capture.write(message)
+        self.handle_message(message)
+
+    def handle_message(self, message, received=None):
+        '''Parse a raw frame and apply it to our tables.
+
+        This is the websocket thread's message handler, and also how frames from other sources
+        (e.g. the asyncio connector, or a replayed capture) are applied. `received` is when the
+        frame arrived; it defaults to now.'''
+        started = time.time()
+        received = received or started
+        # Log the raw frame lazily: formatting is skipped entirely unless DEBUG is enabled.
+        logger.debug('%s', message)
+        message = self.decode(message)
 
         self.updated = True
         table = message['table'] if 'table' in message else None
         action = message['action'] if 'action' in message else None
+        if table:
+            self.last_message[table] = received
         try:
             if 'subscribe' in message:
                 if message['success']:
-                    logger.debug("Subscribed to %s." % message['subscribe'])
+                    logger.debug("Subscribed to %s.", message['subscribe'])
                 else:
                     self.error("Unable to subscribe to %s. Error: \"%s\" Please check and restart." %
                                (message['request']['args'][0], message['error']))
@@ -227,83 +380,151 @@ class BitMEXWebsocket():
                 if message['status'] == 401:
                     self.error("API Key incorrect, please check and restart.")
             elif action:
-
-                if table not in self.data:
-                    self.data[table] = []
-
-                if table not in self.keys:
-                    self.keys[table] = []
-
-                # There are four possible actions from the WS:
-                # 'partial' - full table image
-                # 'insert'  - new row
-                # 'update'  - update row
-                # 'delete'  - delete row
-                if action == 'partial':
-                    logger.debug("%s: partial" % table)
-                    self.data[table] += message['data']
-                    # Keys are communicated on partials to let you know how to uniquely identify
-                    # an item. We use it for updates.
-                    self.keys[table] = message['keys']
-                elif action == 'insert':
-                    logger.debug('%s: inserting %s' % (table, message['data']))
-                    self.data[table] += message['data']
-
-                    # Limit the max length of the table to avoid excessive memory usage.
-                    # Don't trim orders because we'll lose valuable state if we do.
-                    if table not in ['order', 'orderBookL2_25'] and len(self.data[table]) > BitMEXWebsocket.MAX_TABLE_LEN:
-                        self.data[table] = self.data[table][(BitMEXWebsocket.MAX_TABLE_LEN // 2):]
-
-                elif action == 'update':
-                    logger.debug('%s: updating %s' % (table, message['data']))
-                    # Locate the item in the collection and update it.
-                    for updateData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], updateData)
-                        if not item:
-                            continue  # No item found to update. Could happen before push
-
-                        # Log executions
-                        if table == 'order':
-                            is_canceled = 'ordStatus' in updateData and updateData['ordStatus'] == 'Canceled'
-                            if 'cumQty' in updateData and not is_canceled:
-                                contExecuted = updateData['cumQty'] - item['cumQty']
-                                if contExecuted > 0:
-                                    instrument = self.get_instrument(item['symbol'])
-                                    logger.info("Execution: %s %d Contracts of %s at %.*f" %
-                                             (item['side'], contExecuted, item['symbol'],
-                                              instrument['tickLog'], item['price'] or updateData['price']))
-
-                        # Update this item.
-                        item.update(updateData)
-
-                        # Remove canceled / filled orders
-                        if table == 'order' and item['leavesQty'] <= 0:
-                            self.data[table].remove(item)
-
-                elif action == 'delete':
-                    logger.debug('%s: deleting %s' % (table, message['data']))
-                    # Locate the item in the collection and remove it.
-                    for deleteData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], deleteData)
-                        self.data[table].remove(item)
-                else:
-                    raise Exception("Unknown action: %s" % action)
+                # Seqlock: seq is odd while a message is being applied. See snapshot().
+                self.seq += 1
+                try:
+                    self.__apply(table, action, message, received)
+                finally:
+                    self.seq += 1
+                if self.latency is not None:
+                    self.latency.record(table, message['data'], received, started, time.time())
         except:
             logger.error(traceback.format_exc())
 
+    def __apply(self, table, action, message, received):
+        '''Apply a table message (partial/insert/update/delete) to our stores.'''
+        if table not in self.data:
+            self.data[table] = self.__new_table(table)
+
+        # There are four possible actions from the WS:
+        # 'partial' - full table image
+        # 'insert'  - new row
+        # 'update'  - update row
+        # 'delete'  - delete row
+        if action == 'partial':
+            logger.debug("%s: partial", table)
+            # A resubscribed table is rebuilt from scratch, one symbol's partial at a time.
+            symbol = (message.get('filter') or {}).get('symbol') or \
+                (message['data'][0].get('symbol') if table in BitMEXWebsocket.SYMBOL_TABLES and message['data'] else None)
+            if self.resubscribing.pop((table, symbol), None) is not None:
+                self.data[table].clear(symbol)
+                logger.info("Rebuilding %s from a new partial." % (table + ':' + symbol if symbol else table))
+            # Keys are communicated on partials to let you know how to uniquely identify
+            # an item. We index the table by them so updates and deletes are O(1).
+            self.keys[table] = message['keys']
+            self.data[table].set_keys(message['keys'])
+            self.data[table].extend(message['data'], received)
+        elif action == 'insert':
+            logger.debug('%s: inserting %s', table, message['data'])
+            self.data[table].extend(message['data'], received)
+            if table == 'order':
+                for symbol, rows in groupBySymbol(message['data']):
+                    self.events.publish(events.ORDER, table, symbol)
+
+            # Limit the max length of the table to avoid excessive memory usage.
+            # Don't trim orders because we'll lose valuable state if we do.
+            # Ring tables (trade, quote, execution) enforce their own retention.
+            if table not in ['order', 'instrument', self.book_table] and \
+                    isinstance(self.data[table], KeyedTable) and \
+                    len(self.data[table]) > BitMEXWebsocket.MAX_TABLE_LEN:
+                self.data[table].drop_oldest(BitMEXWebsocket.MAX_TABLE_LEN // 2)
+
+        elif action == 'update':
+            logger.debug('%s: updating %s', table, message['data'])
+            # Locate the item in the collection and update it.
+            for updateData in message['data']:
+                item = self.data[table].find(updateData)
+                if not item:
+                    continue  # No item found to update. Could happen before push
+
+                # Log executions
+                event = None
+                if table == 'order':
+                    is_canceled = 'ordStatus' in updateData and updateData['ordStatus'] == 'Canceled'
+                    if 'cumQty' in updateData and not is_canceled:
+                        contExecuted = updateData['cumQty'] - item['cumQty']
+                        if contExecuted > 0:
+                            instrument = self.get_instrument(item['symbol'])
+                            logger.info("Execution: %s %d Contracts of %s at %.*f" %
+                                     (item['side'], contExecuted, item['symbol'],
+                                      instrument['tickLog'], item['price'] or updateData['price']))
+                            event = events.ORDER_FILL
+                elif table == 'position':
+                    if 'currentQty' in updateData and updateData['currentQty'] != item['currentQty']:
+                        event = events.POSITION
+
+                # Update this item.
+                item = self.data[table].merge(item, updateData)
+                if event:
+                    self.events.publish(event, table, item['symbol'])
+
+                # Remove canceled / filled orders
+                if table == 'order' and item['leavesQty'] <= 0:
+                    self.data[table].delete(item)
+                    self.events.publish(events.ORDER, table, item['symbol'])
+
+        elif action == 'delete':
+            logger.debug('%s: deleting %s', table, message['data'])
+            # Locate the item in the collection and remove it.
+            for deleteData in message['data']:
+                item = self.data[table].delete(deleteData)
+                if table == 'order' and item:
+                    self.events.publish(events.ORDER, table, item['symbol'])
+        else:
+            raise Exception("Unknown action: %s" % action)
+
+        # Keep the sorted book in step with the raw table.
+        if table == self.book_table:
+            for symbol, rows in groupBySymbol(message['data']):
+                book = self.__get_book(symbol)
+                top = (book.best_bid(), book.best_ask())
+                book.apply(action, rows)
+                if (book.best_bid(), book.best_ask()) != top:
+                    self.events.publish(events.TOP_OF_BOOK, table, symbol)
+
     def __on_open(self):
         logger.debug("Websocket Opened.")
 
     def __on_close(self):
         logger.info('Websocket Closed')
+        self.__notify_disconnect()
         self.exit()
 
     def __on_error(self, error):
         if not self.exited:
+            self.__notify_disconnect()
             self.error(error)
 
+    def __notify_disconnect(self):
+        '''Let the owner fail over right away rather than on its next liveness check.'''
+        callback, self.on_disconnect = self.on_disconnect, None
+        if callback and not self.exited:
+            callback(self)
+
+    def __new_table(self, table):
+        '''Append-only tables go in a ring buffer, everything else is keyed for updates.'''
+        if table == 'instrument':
+            return InstrumentTable()
+        if table == 'order':
+            return OrderTable()
+        retention = settings.TABLE_RETENTION.get(table)
+        if retention:
+            return RingTable(retention.get('count') or BitMEXWebsocket.MAX_TABLE_LEN, retention.get('seconds'),
+                             clock=self.now)
+        return KeyedTable()
+
+    def __get_book(self, symbol):
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(symbol)
+        return book
+
     def __reset(self):
         self.data = {}
+        self.books = {}
+        self.last_message = {}
+        self.resubscribing = {}  # (table, symbol or None) -> when we stop waiting for its partial
+        self.seq = 0
         self.keys = {}
         self.exited = False
         self._error = None
@@ -318,6 +539,16 @@ def findItemByKeys(keys, table, matchData):
         if matched:
             return item
 
+def groupBySymbol(rows):
+    '''Split a message's rows into (symbol, rows) runs. Almost always a single run.'''
+    groups = []
+    for row in rows:
+        if groups and groups[-1][0] == row['symbol']:
+            groups[-1][1].append(row)
+        else:
+            groups.append((row['symbol'], [row]))
+    return groups
+
 if __name__ == "__main__":
     # create console handler and set level to debug
     logger = log.setup_custom_logger('websocket', logging.DEBUG)
@@ -16,12 +16,17 @@ setup(name='bitmex-market-maker',
       long_description_content_type='text/markdown',
       author='Samuel Reed',
       author_email='sam@bitmex.com',
+      python_requires='>=3.7',
       install_requires=[
           'requests',
           'websocket-client',
           'future'
       ],
-      packages=['market_maker', 'market_maker.auth', 'market_maker.utils', 'market_maker.ws'],
+      extras_require={
+          'asyncio': ['aiohttp'],
+          'numpy': ['numpy']
+      },
+      packages=['market_maker', 'market_maker.auth', 'market_maker.stub', 'market_maker.utils', 'market_maker.ws'],
       entry_points={
           'console_scripts': ['marketmaker = market_maker:run']
       }
@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from market_maker.market_maker import ExchangeInterface
+from market_maker.settings import settings
+
+###
+# dispatch-test.py
+#
+# Checks ExchangeInterface.dispatch(): with PARALLEL_DISPATCH a tick's cancel, amend and create
+# batches are all in flight at once, dispatch() returns only once every one has finished, and a batch
+# that fails gets its exception as its result without losing the others'. Without it they go one
+# after the other, stopping at the first failure.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/dispatch-test.py
+###
+
+
+class Connector(object):
+
+    """Just enough of BitMEX for dispatch(): no order gateway, and a pool to submit requests to."""
+
+    gateway = None
+
+    def __init__(self):
+        self.dispatcher = ThreadPoolExecutor(max_workers=3)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.dispatcher.submit(fn, *args, **kwargs)
+
+
+class Batch(object):
+
+    """A request method that records its calls, optionally waiting at `barrier` first or failing."""
+
+    def __init__(self, name, calls, barrier=None, delay=0, error=None):
+        self.name = name
+        self.calls = calls
+        self.barrier = barrier
+        self.delay = delay
+        self.error = error
+        self.finished = False
+
+    def __call__(self, orders):
+        self.calls.append(self.name)
+        if self.barrier is not None:
+            self.barrier.wait(5)  # Raises BrokenBarrierError unless every batch gets here at once
+        time.sleep(self.delay)
+        self.finished = True
+        if self.error is not None:
+            raise self.error
+        return ['%s %s' % (self.name, order) for order in orders]
+
+
+def dispatch(batches, parallel=True, dry_run=False):
+    exchange = ExchangeInterface(dry_run=dry_run, symbol='XBTUSD', connector=Connector())
+    previous = settings.PARALLEL_DISPATCH
+    settings.PARALLEL_DISPATCH = parallel
+    try:
+        return exchange.dispatch([(batch.name, batch, orders) for batch, orders in batches])
+    finally:
+        settings.PARALLEL_DISPATCH = previous
+        exchange.bitmex.dispatcher.shutdown()
+
+
+def test_parallel():
+    calls, barrier = [], threading.Barrier(3)
+    batches = [Batch(name, calls, barrier, delay) for name, delay in (('cancel', 0.05), ('amend', 0.1), ('create', 0))]
+    results = dispatch([(batches[0], ['a']), (batches[1], ['b']), (batches[2], ['c', 'd'])])
+    assert all(batch.finished for batch in batches)
+    assert results == {'cancel': ['cancel a'], 'amend': ['amend b'], 'create': ['create c', 'create d']}
+
+
+def test_parallel_failure_keeps_other_results():
+    calls, barrier, error = [], threading.Barrier(3), ValueError('Invalid ordStatus')
+    batches = [Batch('cancel', calls, barrier), Batch('amend', calls, barrier, error=error),
+               Batch('create', calls, barrier, delay=0.1)]
+    results = dispatch([(batch, ['x']) for batch in batches])
+    assert results == {'cancel': ['cancel x'], 'amend': error, 'create': ['create x']}
+    assert batches[2].finished
+
+
+def test_empty_batches_are_skipped():
+    calls = []
+    results = dispatch([(Batch('cancel', calls), []), (Batch('amend', calls), ['b']), (Batch('create', calls), [])])
+    assert results == {'amend': ['amend b']} and calls == ['amend']
+
+
+def test_sequential():
+    for parallel, dry_run in ((False, False), (True, True)):
+        calls, error = [], ValueError('boom')
+        batches = [Batch('cancel', calls, delay=0.01), Batch('amend', calls, error=error), Batch('create', calls)]
+        results = dispatch([(batch, ['x']) for batch in batches], parallel, dry_run)
+        assert calls == ['cancel', 'amend'], (parallel, dry_run)
+        assert results == {'cancel': ['cancel x'], 'amend': error}
+
+
+def main():
+    for test in (test_parallel, test_parallel_failure_keeps_other_results, test_empty_batches_are_skipped,
+                 test_sequential):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
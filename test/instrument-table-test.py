@@ -0,0 +1,80 @@
+import json
+
+from market_maker.ws.replay import ReplayWebsocket
+from market_maker.ws.tables import InstrumentTable
+
+###
+# instrument-table-test.py
+#
+# Checks the instrument registry (InstrumentTable in ws/tables.py): rows are keyed by symbol, get their
+# tick and contract fields computed on insert and again only when an update changes what they're
+# computed from, and the websocket never trims instruments the way it trims other tables.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/instrument-table-test.py
+###
+
+XBTUSD = {'symbol': 'XBTUSD', 'tickSize': 0.5, 'multiplier': -100000000, 'isQuanto': False, 'isInverse': True,
+          'underlyingToSettleMultiplier': -100000000, 'quoteToSettleMultiplier': None, 'markPrice': 40000.0}
+ETHUSD = {'symbol': 'ETHUSD', 'tickSize': 0.05, 'multiplier': 100, 'isQuanto': True, 'isInverse': False,
+          'underlyingToSettleMultiplier': None, 'quoteToSettleMultiplier': 100000000, 'markPrice': 2000.0}
+XBTUSDT = {'symbol': 'XBTUSDT', 'tickSize': 0.1, 'multiplier': 1, 'isQuanto': False, 'isInverse': False,
+           'underlyingToSettleMultiplier': 100000000, 'quoteToSettleMultiplier': None, 'markPrice': 40000.0}
+INDEX = {'symbol': '.BXBT', 'tickSize': 0.01, 'multiplier': None, 'isQuanto': False, 'isInverse': False,
+         'markPrice': 40000.0}
+
+
+def table():
+    instruments = InstrumentTable(['symbol'])
+    instruments.extend([dict(XBTUSD), dict(ETHUSD), dict(XBTUSDT), dict(INDEX)])
+    return instruments
+
+
+def fields(instrument):
+    return tuple(instrument[k] for k in ('tickLog', 'tickScale', 'tickUnits', 'futureType', 'contractMultiplier'))
+
+
+def test_annotated_on_insert():
+    instruments = table()
+    assert fields(instruments.get('XBTUSD')) == (1, 10, 5, 'Inverse', 1.0)
+    assert fields(instruments.get('ETHUSD')) == (2, 100, 5, 'Quanto', 1e-06)
+    assert fields(instruments.get('XBTUSDT')) == (1, 10, 1, 'Linear', 1e-08)
+    assert fields(instruments.get('.BXBT')) == (2, 100, 1, 'Linear', None)
+    assert instruments.get('XBTZ99') is None
+
+
+def test_updates():
+    instruments = table()
+    old = instruments.get('XBTUSD')
+    new = instruments.update({'symbol': 'XBTUSD', 'markPrice': 41000.0})
+    assert new['markPrice'] == 41000.0 and fields(new) == fields(old)
+    # Rows are copy-on-write: whoever holds the old row still sees it as it was.
+    assert old['markPrice'] == 40000.0 and instruments.get('XBTUSD') is new
+
+    new = instruments.update({'symbol': 'XBTUSD', 'tickSize': 0.01})
+    assert fields(new) == (2, 100, 1, 'Inverse', 1.0)
+    new = instruments.update({'symbol': 'XBTUSD', 'isInverse': False, 'isQuanto': True})
+    assert new['futureType'] == 'Quanto'
+    assert instruments.update({'symbol': 'XBTZ99', 'markPrice': 1.0}) is None
+
+
+def test_websocket_keeps_every_instrument():
+    ws = ReplayWebsocket([])
+    rows = [dict(XBTUSD, symbol='XBT%03d' % i) for i in range(ws.MAX_TABLE_LEN * 2)]
+    ws.handle_message(json.dumps({'table': 'instrument', 'action': 'partial', 'keys': ['symbol'], 'data': rows[:10]}))
+    for row in rows[10:]:
+        ws.handle_message(json.dumps({'table': 'instrument', 'action': 'insert', 'data': [row]}))
+    assert len(ws.data['instrument']) == len(rows)
+    assert ws.get_instrument('XBT000')['tickLog'] == 1
+    ws.handle_message(json.dumps({'table': 'instrument', 'action': 'update',
+                                  'data': [{'symbol': 'XBT000', 'tickSize': 0.001}]}))
+    assert ws.get_instrument('XBT000')['tickLog'] == 3
+
+
+def main():
+    for test in (test_annotated_on_insert, test_updates, test_websocket_keeps_every_instrument):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from market_maker.utils.orderstate import OrderTracker
+from market_maker.ws.tables import OrderTable
+
+###
+# order-state-test.py
+#
+# Checks that BitMEX.open_orders() (OrderTracker over the websocket's OrderTable) stops showing an
+# order as soon as the websocket reports it filled or canceled, rather than after the tracker's timeout.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/order-state-test.py
+###
+
+PREFIX = 'mm_'
+
+
+def ws_insert(table, row):
+    table.extend([row])
+
+
+def ws_update(table, update):
+    # As BitMEXWebsocket applies an order update: merge, then drop the row once nothing is left open.
+    item = table.merge(table.find(update), update)
+    if item['leavesQty'] <= 0:
+        table.delete(item)
+
+
+def open_orders(tracker, table):
+    return [(o['clOrdID'], o['leavesQty']) for o in
+            tracker.open_orders(table.open_orders(PREFIX, 'XBTUSD'), table.by_clOrdID, 'XBTUSD')]
+
+
+def new_order(clOrdID='mm_A', orderID='1'):
+    return {'orderID': orderID, 'clOrdID': clOrdID, 'symbol': 'XBTUSD', 'side': 'Buy', 'orderQty': 100,
+            'leavesQty': 100, 'cumQty': 0, 'price': 1000.0, 'ordStatus': 'New', 'timestamp': '2024-01-01T00:00:00.000Z'}
+
+
+def created(tracker, table):
+    """Create and confirm an order over REST, then have the websocket show it."""
+    tracker.creating([{'clOrdID': 'mm_A', 'symbol': 'XBTUSD', 'side': 'Buy', 'orderQty': 100, 'price': 1000.0}])
+    tracker.confirm([new_order()])
+    ws_insert(table, new_order())
+    assert open_orders(tracker, table) == [('mm_A', 100)]
+
+
+def test_fill_on_websocket():
+    tracker, table = OrderTracker(PREFIX), OrderTable(['orderID'])
+    created(tracker, table)
+    ws_update(table, {'orderID': '1', 'leavesQty': 0, 'cumQty': 100, 'ordStatus': 'Filled',
+                      'timestamp': '2024-01-01T00:00:01.000Z'})
+    assert open_orders(tracker, table) == []
+    assert tracker.pending() == 0
+
+
+def test_partial_fill_on_websocket():
+    tracker, table = OrderTracker(PREFIX), OrderTable(['orderID'])
+    created(tracker, table)
+    ws_update(table, {'orderID': '1', 'leavesQty': 40, 'cumQty': 60, 'ordStatus': 'PartiallyFilled',
+                      'timestamp': '2024-01-01T00:00:01.000Z'})
+    assert open_orders(tracker, table) == [('mm_A', 40)]
+
+
+def test_cancel_on_websocket():
+    tracker, table = OrderTracker(PREFIX), OrderTable(['orderID'])
+    created(tracker, table)
+    ws_update(table, {'orderID': '1', 'leavesQty': 0, 'ordStatus': 'Canceled', 'timestamp': '2024-01-01T00:00:01.000Z'})
+    assert open_orders(tracker, table) == []
+
+
+def test_rekeying_amend():
+    # An amend that gives the order a new clOrdID isn't a fill, whichever of REST and the websocket is first.
+    tracker, table = OrderTracker(PREFIX), OrderTable(['orderID'])
+    created(tracker, table)
+    tracker.amending([{'origClOrdID': 'mm_A', 'clOrdID': 'mm_B', 'orderQty': 50, 'price': 1001.0}])
+    ws_update(table, {'orderID': '1', 'clOrdID': 'mm_B', 'orderQty': 50, 'leavesQty': 50, 'price': 1001.0,
+                      'timestamp': '2024-01-01T00:00:01.000Z'})
+    assert open_orders(tracker, table) == [('mm_A', 50)]
+    tracker.confirm([dict(new_order('mm_B'), orderQty=50, leavesQty=50, price=1001.0,
+                          timestamp='2024-01-01T00:00:01.000Z')])
+    assert open_orders(tracker, table) == [('mm_B', 50)]
+    ws_update(table, {'orderID': '1', 'leavesQty': 0, 'cumQty': 50, 'ordStatus': 'Filled',
+                      'timestamp': '2024-01-01T00:00:02.000Z'})
+    assert open_orders(tracker, table) == []
+
+
+def main():
+    for test in (test_fill_on_websocket, test_partial_fill_on_websocket, test_cancel_on_websocket, test_rekeying_amend):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
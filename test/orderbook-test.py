@@ -0,0 +1,116 @@
+import random
+
+from market_maker.ws.orderbook import OrderBook
+
+###
+# orderbook-test.py
+#
+# Checks the price-level order book (ws/orderbook.py) against a plain dict of levels: a random stream
+# of orderBookL2 partials, inserts, updates and deletes must leave both with the same levels, in the
+# same order, and the same best bid, best ask and mid.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/orderbook-test.py
+###
+
+ROUNDS = 20000
+TICK = 0.5
+
+
+def level_id(price):
+    # Like BitMEX, one id per price level.
+    return 8799000000 - int(price / TICK)
+
+
+def expected_levels(levels, side):
+    rows = [(price, size) for (s, price), size in levels.items() if s == side]
+    return sorted(rows, reverse=(side == 'Buy'))
+
+
+def check(book, levels):
+    bids, asks = expected_levels(levels, 'Buy'), expected_levels(levels, 'Sell')
+    assert list(book.bids.top()) == bids
+    assert list(book.asks.top()) == asks
+    assert book.best_bid() == (bids[0] if bids else None)
+    assert book.best_ask() == (asks[0] if asks else None)
+    assert book.mid() == ((bids[0][0] + asks[0][0]) / 2 if bids and asks else None)
+    top_bids, top_asks = book.depth(3)
+    assert list(top_bids) == bids[:3] and top_bids.prices() == [p for p, _ in bids[:3]]
+    assert list(top_asks) == asks[:3] and top_asks.sizes() == [s for _, s in asks[:3]]
+
+
+def row(side, price, size=None):
+    item = {'symbol': 'XBTUSD', 'id': level_id(price), 'side': side}
+    if size is not None:
+        item['size'] = size
+    return item
+
+
+def partial(rng, book, levels):
+    levels.clear()
+    mid = rng.randint(100, 200) * 2 * TICK
+    for i in range(1, rng.randint(0, 25)):
+        levels[('Buy', mid - i * TICK)] = rng.randint(1, 10000)
+    for i in range(1, rng.randint(0, 25)):
+        levels[('Sell', mid + i * TICK)] = rng.randint(1, 10000)
+    book.apply('partial', [dict(row(side, price, size), price=price) for (side, price), size in levels.items()])
+
+
+def test_random_stream():
+    rng = random.Random(1)
+    book, levels = OrderBook('XBTUSD'), {}
+    partial(rng, book, levels)
+    for n in range(ROUNDS):
+        action = rng.choice(['insert', 'update', 'update', 'delete', 'partial'] if n % 500 == 0 else
+                            ['insert', 'update', 'update', 'delete'])
+        if action == 'partial':
+            partial(rng, book, levels)
+        elif action == 'insert':
+            # Anywhere on its own side of the spread, at a price with no level yet.
+            side = rng.choice(['Buy', 'Sell'])
+            if side == 'Buy':
+                price = min([p for s, p in levels if s == 'Sell'] or [300]) - rng.randint(1, 30) * TICK
+            else:
+                price = max([p for s, p in levels if s == 'Buy'] or [0]) + rng.randint(1, 30) * TICK
+            if ('Buy', price) in levels or ('Sell', price) in levels:
+                continue
+            size = rng.randint(1, 10000)
+            levels[(side, price)] = size
+            book.apply('insert', [dict(row(side, price, size), price=price)])
+        elif levels:
+            side, price = rng.choice(sorted(levels))
+            if action == 'update':
+                levels[(side, price)] = rng.randint(1, 10000)
+                book.apply('update', [row(side, price, levels[(side, price)])])
+            else:
+                del levels[(side, price)]
+                book.apply('delete', [row(side, price)])
+        check(book, levels)
+
+
+def test_level_changes_side():
+    # As the spread moves, a price level is deleted from one side and inserted on the other, same id.
+    book = OrderBook('XBTUSD')
+    book.apply('partial', [dict(row('Buy', 100.0, 10), price=100.0), dict(row('Sell', 101.0, 20), price=101.0)])
+    book.apply('delete', [row('Sell', 101.0)])
+    book.apply('insert', [dict(row('Buy', 101.0, 30), price=101.0), dict(row('Sell', 102.0, 40), price=102.0)])
+    book.apply('delete', [row('Buy', 101.0)])
+    book.apply('insert', [dict(row('Sell', 101.0, 50), price=101.0)])
+    check(book, {('Buy', 100.0): 10, ('Sell', 101.0): 50, ('Sell', 102.0): 40})
+
+
+def test_unknown_ids_are_ignored():
+    book = OrderBook('XBTUSD')
+    book.apply('partial', [dict(row('Buy', 100.0, 10), price=100.0)])
+    book.apply('update', [row('Buy', 99.0, 5)])
+    book.apply('delete', [row('Sell', 100.0)])
+    check(book, {('Buy', 100.0): 10})
+
+
+def main():
+    for test in (test_random_stream, test_level_changes_side, test_unknown_ids_are_ignored):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
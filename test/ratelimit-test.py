@@ -0,0 +1,102 @@
+from market_maker.utils.ratelimit import RateLimitBudget, request_cost, schedule
+from market_maker.utils.reconcile import Plan
+
+###
+# ratelimit-test.py
+#
+# Checks the client-side rate limit (utils/ratelimit.py): RateLimitBudget resyncing from response
+# headers, refilling and being spent, what requests cost, and schedule() trimming a plan to the budget
+# innermost level first.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/ratelimit-test.py
+###
+
+NOW = 1700000000.0
+
+
+def headers(limit, remaining, reset):
+    return {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset)}
+
+
+def order(side, price, n=0):
+    return {'orderID': '%s%d' % (side, n), 'side': side, 'price': price, 'orderQty': 100}
+
+
+def test_budget_refills_at_the_reset_rate():
+    budget = RateLimitBudget()
+    budget.update(headers(300, 100, int(NOW) + 100), now=NOW)
+    # 200 to refill over 100 seconds: 2 a second, up to the limit.
+    assert budget.available(NOW) == 100
+    assert budget.available(NOW + 10) == 120
+    assert budget.available(NOW + 1000) == 300
+
+
+def test_budget_ignores_responses_without_headers():
+    budget = RateLimitBudget()
+    budget.update(headers(300, 100, int(NOW) + 100), now=NOW)
+    budget.update({}, now=NOW + 5)
+    budget.update(dict(headers(300, 0, 0), **{'X-RateLimit-Remaining': 'x'}), now=NOW + 5)
+    assert budget.available(NOW + 10) == 120
+
+
+def test_budget_spend_and_wait():
+    budget = RateLimitBudget()
+    budget.update(headers(300, 100, int(NOW) + 100), now=NOW)
+    budget.spend(50, now=NOW + 10)
+    assert budget.available(NOW + 10) == 70
+    assert budget.wait_time(50, now=NOW + 10) == 0
+    assert budget.wait_time(100, now=NOW + 10) == 15
+
+
+def test_request_cost():
+    assert request_cost('POST', 'order/bulk', {'orders': [{}] * 25}) == 3
+    assert request_cost('PUT', 'order/bulk', {'orders': [{}] * 10}) == 1
+    assert request_cost('POST', 'order/bulk', {'orders': []}) == 1
+    assert request_cost('DELETE', 'order', {'orderID': ['a'] * 25}) == 1
+    assert request_cost('GET', 'position') == 1
+
+
+def ladder():
+    plan = Plan()
+    plan.to_cancel = [order('Buy', 90.0, 9)]
+    plan.to_amend = [order('Buy', 97.0), order('Sell', 103.0)]
+    plan.to_create = [order('Buy', 98.0), order('Buy', 99.0), order('Sell', 101.0), order('Sell', 102.0)]
+    return plan
+
+
+def test_schedule_within_budget():
+    plan = ladder()
+    assert schedule(plan, None) is plan
+    assert schedule(plan, 3) is plan  # 1 cancel, 1 bulk amend, 1 bulk create
+
+
+def test_schedule_protects_the_inside():
+    plan = ladder()
+    # Only the cancel fits above the reserve; the innermost level each side may still dig into it.
+    scheduled = schedule(plan, 2, reserve=1)
+    assert scheduled.to_cancel == plan.to_cancel
+    assert scheduled.to_amend == []
+    assert [o['price'] for o in scheduled.to_create] == [99.0, 101.0]
+    assert sorted(o['price'] for o in scheduled.deferred) == [97.0, 98.0, 102.0, 103.0]
+    assert scheduled.requests() == 2
+
+
+def test_schedule_spends_the_rest_outward():
+    plan = ladder()
+    # Room for creates but not a separate amend request: the outer amends wait.
+    scheduled = schedule(plan, 2, protect_levels=0)
+    assert [o['price'] for o in scheduled.to_create] == [98.0, 99.0, 101.0, 102.0]
+    assert scheduled.to_amend == []
+    assert sorted(o['price'] for o in scheduled.deferred) == [97.0, 103.0]
+
+
+def main():
+    for test in (test_budget_refills_at_the_reset_rate, test_budget_ignores_responses_without_headers,
+                 test_budget_spend_and_wait, test_request_cost, test_schedule_within_budget,
+                 test_schedule_protects_the_inside, test_schedule_spends_the_rest_outward):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import random
+from itertools import permutations
+
+from market_maker.utils.reconcile import plan_orders
+
+###
+# reconcile-test.py
+#
+# Checks the order planner (utils/reconcile.py) against brute force on small random books: the plan
+# has the fewest operations possible, and carrying it out leaves exactly the orders we asked for,
+# within tolerance. Plus a few cases worth spelling out.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/reconcile-test.py
+###
+
+TOLERANCE = 0.01
+ROUNDS = 2000
+
+
+def existing_order(n, side, price, qty, cumQty=0, orderID=True):
+    return {'orderID': 'o%d' % n if orderID else None, 'clOrdID': 'mm_%d' % n, 'side': side, 'price': price,
+            'orderQty': qty + cumQty, 'leavesQty': qty, 'cumQty': cumQty}
+
+
+def desired_order(side, price, qty):
+    return {'side': side, 'price': price, 'orderQty': qty}
+
+
+def within(a, b):
+    return a == b or abs(a / b - 1) <= TOLERANCE
+
+
+def keepable(order, want):
+    return within(want['price'], order['price']) and within(want['orderQty'], order['leavesQty'])
+
+
+def most_kept(existing, desired):
+    """Most existing orders that can be paired, each with its own desired order, and left alone."""
+    if len(existing) > len(desired):
+        return most_kept_by(desired, existing, lambda want, order: keepable(order, want))
+    return most_kept_by(existing, desired, keepable)
+
+
+def most_kept_by(few, many, ok):
+    best = 0
+    for chosen in permutations(range(len(many)), len(few)):
+        best = max(best, sum(1 for i, j in enumerate(chosen) if ok(few[i], many[j])))
+    return best
+
+
+def covers(book, desired):
+    """True if every desired order is matched by its own order in `book`, within tolerance, and nothing's left over."""
+    if len(book) != len(desired):
+        return False
+    return most_kept_by(book, desired, keepable) == len(desired)
+
+
+def apply_plan(plan, existing):
+    """The book once the plan's cancels, amends and creates have all landed."""
+    canceled = set(o['orderID'] for o in plan.to_cancel)
+    amends = {a['orderID']: a for a in plan.to_amend}
+    book = []
+    for order in existing:
+        if order['orderID'] in canceled:
+            continue
+        amend = amends.get(order['orderID'])
+        if amend is not None:
+            assert amend['side'] == order['side']
+            order = dict(order, price=amend['price'], leavesQty=amend['orderQty'] - order['cumQty'])
+        book.append(order)
+    book.extend(dict(o, leavesQty=o['orderQty']) for o in plan.to_create)
+    return book
+
+
+def random_prices(rng, count, start):
+    return sorted({round(start + rng.choice([-1, 1]) * rng.randint(0, 12) * 0.5, 1) for _ in range(count)})
+
+
+def test_random_books():
+    rng = random.Random(1)
+    for _ in range(ROUNDS):
+        existing, buys, sells = [], [], []
+        for side, wanted, mid in (('Buy', buys, 100.0), ('Sell', sells, 110.0)):
+            for price in random_prices(rng, rng.randint(0, 5), mid):
+                existing.append(existing_order(len(existing), side, price, rng.choice([100, 100, 101, 200]),
+                                               cumQty=rng.choice([0, 0, 50])))
+            for price in random_prices(rng, rng.randint(0, 5), mid):
+                wanted.append(desired_order(side, price, rng.choice([100, 100, 200])))
+
+        plan = plan_orders(existing, buys, sells, TOLERANCE)
+
+        least = 0
+        for side, wanted in (('Buy', buys), ('Sell', sells)):
+            mine = [o for o in existing if o['side'] == side]
+            least += max(len(mine), len(wanted)) - most_kept(mine, wanted)
+        assert plan.cost() == least, (plan, least, existing, buys, sells)
+
+        book = apply_plan(plan, existing)
+        for side, wanted in (('Buy', buys), ('Sell', sells)):
+            assert covers([o for o in book if o['side'] == side], wanted), (plan, existing, buys, sells)
+        assert len(plan.kept) + len(plan.to_amend) + len(plan.to_cancel) == len(existing)
+
+
+def test_fill_at_the_inside():
+    # The inside sell filled and the ladder moved up a level: one amend, not one per level.
+    existing = [existing_order(i, 'Sell', price, 100) for i, price in enumerate([100.0, 110.0])]
+    plan = plan_orders(existing, [], [desired_order('Sell', p, 100) for p in (110.0, 120.0, 130.0)], TOLERANCE)
+    assert [o['price'] for o in plan.kept] == [110.0]
+    assert [(a['orderID'], a['price']) for a in plan.to_amend] == [('o0', 120.0)]
+    assert [o['price'] for o in plan.to_create] == [130.0]
+    assert plan.to_cancel == []
+
+
+def test_within_tolerance_is_kept():
+    existing = [existing_order(0, 'Buy', 100.0, 100), existing_order(1, 'Sell', 110.0, 100)]
+    plan = plan_orders(existing, [desired_order('Buy', 100.5, 100)], [desired_order('Sell', 110.0, 100.5)], TOLERANCE)
+    assert not plan and len(plan.kept) == 2
+
+
+def test_amend_changes_only_whats_out_of_tolerance():
+    existing = [existing_order(0, 'Buy', 100.0, 100, cumQty=20)]
+    plan = plan_orders(existing, [desired_order('Buy', 100.5, 300)], [], TOLERANCE)
+    assert plan.to_amend == [{'orderID': 'o0', 'origClOrdID': 'mm_0', 'side': 'Buy', 'price': 100.0, 'orderQty': 320}]
+
+
+def test_pending_creates_are_left_alone():
+    # An order still being created has no orderID to amend or cancel it by.
+    existing = [existing_order(0, 'Buy', 90.0, 100, orderID=False)]
+    plan = plan_orders(existing, [desired_order('Buy', 100.0, 100)], [], TOLERANCE)
+    assert plan.to_amend == [] and plan.to_cancel == []
+    assert [o['price'] for o in plan.to_create] == [100.0]
+
+
+def main():
+    for test in (test_random_books, test_fill_at_the_inside, test_within_tolerance_is_kept,
+                 test_amend_changes_only_whats_out_of_tolerance, test_pending_creates_are_left_alone):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import random
+import time
+
+from market_maker.utils.retry import RetryPolicy
+
+###
+# retry-test.py
+#
+# Checks RetryPolicy (utils/retry.py): which deadline each request gets, that backoff delays stay
+# within their jitter bounds, and that a request stops retrying once it's out of retries or time.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/retry-test.py
+###
+
+
+def deadline_of(policy, verb, path):
+    state = policy.start(verb, path, 3)
+    return state.deadline - state.started
+
+
+def test_deadlines_by_endpoint():
+    policy = RetryPolicy(deadline=30)
+    assert deadline_of(policy, 'POST', 'order') == 5
+    assert deadline_of(policy, 'PUT', '/order/bulk') == 5
+    assert deadline_of(policy, 'POST', 'order/cancelAllAfter') == 10
+    # Cancels and reads on the same endpoints keep trying.
+    assert deadline_of(policy, 'DELETE', 'order') == 30
+    assert deadline_of(policy, 'GET', 'order') == 30
+    assert deadline_of(policy, 'GET', 'position') == 30
+
+
+def test_deadline_overrides():
+    policy = RetryPolicy(deadline=60, deadlines={('POST', 'order'): 2})
+    assert deadline_of(policy, 'POST', 'order') == 2
+    assert deadline_of(policy, 'PUT', 'order') == 5
+    assert deadline_of(policy, 'DELETE', 'order') == 60
+
+
+def test_delay_within_jitter_bounds():
+    policy = RetryPolicy(base=0.25, cap=5.0, rng=random.Random(1))
+    for retries in range(10):
+        bound = min(5.0, 0.25 * 2 ** retries)
+        delays = [policy.delay(retries) for _ in range(200)]
+        assert all(0 <= d <= bound for d in delays), retries
+        assert max(delays) > bound / 2, retries  # Spread over the range, not stuck at the bottom
+
+
+def test_out_of_retries():
+    state = RetryPolicy(rng=random.Random(1)).start('GET', 'position', 2)
+    assert state.backoff() is not None
+    assert state.backoff() is not None
+    assert state.backoff() is None
+    assert state.retries == 2
+
+
+def test_out_of_time():
+    state = RetryPolicy(rng=random.Random(1)).start('POST', 'order', 10)
+    assert 2 <= state.backoff(minimum=2) < 5
+    # A wait that would run past the deadline isn't worth taking.
+    assert state.backoff(minimum=6) is None
+    state.deadline = time.time() - 1
+    assert state.backoff() is None
+    assert state.retries == 1
+
+
+def main():
+    for test in (test_deadlines_by_endpoint, test_deadline_overrides, test_delay_within_jitter_bounds,
+                 test_out_of_retries, test_out_of_time):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import json
+import time
+
+from market_maker.auth import APIKeyAuthWithExpires, RequestSigner
+from market_maker.auth.APIKeyAuth import generate_signature
+
+###
+# signing-benchmark.py
+#
+# Signs a typical bulk amend the old way (APIKeyAuthWithExpires built per request, body serialized by
+# requests and again for the log line, URL reparsed to find the path) and through RequestSigner (HMAC
+# key set up once, body serialized once, endpoint paths cached), checks both give the same signature,
+# and prints requests signed per second.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/signing-benchmark.py
+###
+
+API_KEY = 'benchmarkKey'
+API_SECRET = 'chNOOS4KvNXR_Xq4k4c9qsfoKWvnDecLATCRlcBwyKDYnWgO'
+BASE_URL = 'https://www.bitmex.com/api/v1/'
+ORDERS = {'orders': [{'origClOrdID': 'mm_bitmex_%d' % i, 'clOrdID': 'mm_bitmex_new_%d' % i, 'orderQty': 100 * i,
+                      'price': 40000.5 + i, 'side': 'Buy'} for i in range(10)]}
+COUNT = 50000
+
+
+class Request(object):
+    def __init__(self, method, url, body):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.headers = {}
+
+
+def old_sign(path, postdict):
+    body = json.dumps(postdict)  # requests' json=
+    json.dumps(postdict)  # the log line
+    r = Request('PUT', BASE_URL + path, body)
+    APIKeyAuthWithExpires(API_KEY, API_SECRET)(r)
+    return r.headers
+
+
+def new_sign(signer, path, postdict):
+    body = json.dumps(postdict, separators=(',', ':'))
+    url, signed_path = signer.url(path)
+    return signer.headers('PUT', signed_path, body)
+
+
+def bench(name, fn, *args):
+    start = time.perf_counter()
+    for _ in range(COUNT):
+        fn(*args)
+    elapsed = time.perf_counter() - start
+    print("%-40s %10.0f requests/s" % (name, COUNT / elapsed))
+    return elapsed
+
+
+def main():
+    signer = RequestSigner(API_KEY, API_SECRET, BASE_URL)
+
+    # Same signature as the original implementation, with and without a query string.
+    body = json.dumps(ORDERS, separators=(',', ':'))
+    for path, query in (('order/bulk', None), ('order', {'filter': '{"open":true}', 'count': 500})):
+        url, signed_path = signer.url(path, query)
+        assert signer.headers('PUT', signed_path, body, expires=1600000000)['api-signature'] == \
+            generate_signature(API_SECRET, 'PUT', url, 1600000000, body), path
+    print("Signatures match generate_signature()")
+
+    old = bench("APIKeyAuthWithExpires, body x2", old_sign, 'order/bulk', ORDERS)
+    new = bench("RequestSigner, body x1", new_sign, signer, 'order/bulk', ORDERS)
+    print("%-40s %10.2fx" % ('speedup', old / new))
+
+    url, signed_path = signer.url('order/bulk')
+    bench("RequestSigner, signing only", signer.headers, 'PUT', signed_path, body)
+
+
+if __name__ == "__main__":
+    main()
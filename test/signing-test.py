@@ -0,0 +1,83 @@
+import hashlib
+import hmac
+import json
+import time
+
+from market_maker.auth import RequestSigner
+from market_maker.auth.APIKeyAuth import generate_signature
+
+###
+# signing-test.py
+#
+# Checks that RequestSigner (auth/APIKeyAuth.py) signs exactly what generate_signature() does, the
+# reference implementation of BitMEX's scheme, for the URLs and bodies the connector sends, and that
+# nothing carries over from one request it signs to the next.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/signing-test.py
+###
+
+API_KEY = 'testKey'
+API_SECRET = 'chNOOS4KvNXR_Xq4k4c9qsfoKWvnDecLATCRlcBwyKDYnWgO'
+BASE_URL = 'https://www.bitmex.com/api/v1/'
+EXPIRES = 1518064236
+
+AMEND = {'orders': [{'origClOrdID': 'mm_bitmex_%d' % i, 'clOrdID': 'mm_bitmex_new_%d' % i, 'orderQty': 100 * i,
+                     'price': 40000.5 + i, 'side': 'Buy'} for i in range(10)]}
+REQUESTS = [
+    ('GET', 'instrument', {'filter': json.dumps({'symbol': 'XBTUSD'})}, None),
+    ('GET', 'position', None, None),
+    ('POST', 'order', None, {'symbol': 'XBTUSD', 'orderQty': 1, 'price': 395.01, 'text': 'café'}),
+    ('PUT', 'order/bulk', None, AMEND),
+    ('DELETE', 'order', None, {'orderID': ['a', 'b']}),
+    ('POST', 'order/cancelAllAfter', None, {'timeout': 60000}),
+]
+
+
+def reference(verb, url, body):
+    return {'api-expires': str(EXPIRES), 'api-key': API_KEY,
+            'api-signature': generate_signature(API_SECRET, verb, url, EXPIRES, body)}
+
+
+def test_urls():
+    signer = RequestSigner(API_KEY, API_SECRET, BASE_URL)
+    assert signer.url('order') == ('https://www.bitmex.com/api/v1/order', '/api/v1/order')
+    assert signer.url('order') is signer.url('order')
+    assert signer.url('instrument', {'symbol': 'XBTUSD', 'count': 1}) == \
+        ('https://www.bitmex.com/api/v1/instrument?symbol=XBTUSD&count=1', '/api/v1/instrument?symbol=XBTUSD&count=1')
+
+
+def test_matches_reference():
+    signer = RequestSigner(API_KEY, API_SECRET, BASE_URL)
+    # Twice over, so a signer that kept state between requests would show up the second time.
+    for _ in range(2):
+        for verb, path, query, postdict in REQUESTS:
+            url, signed_path = signer.url(path, query)
+            body = json.dumps(postdict, separators=(',', ':')) if postdict else ''
+            assert signer.headers(verb, signed_path, body, EXPIRES) == reference(verb, url, body), (verb, path)
+
+
+def test_scheme():
+    # HEX(HMAC_SHA256(secret, verb + path + expires + body)), as spelled out above generate_signature.
+    signer = RequestSigner(API_KEY, API_SECRET, BASE_URL)
+    url, path = signer.url('instrument', {'filter': '{"symbol": "XBTM15"}'})
+    assert path == '/api/v1/instrument?filter=%7B%22symbol%22%3A+%22XBTM15%22%7D'
+    body = '{"symbol":"XBTM15","price":219.0,"clOrdID":"mm_bitmex_1a/oemUeQ4CAJZgP3fjHsA","orderQty":98}'
+    expected = hmac.new(API_SECRET.encode('utf8'), ('POST/api/v1/order%d%s' % (EXPIRES, body)).encode('utf8'),
+                        hashlib.sha256).hexdigest()
+    assert signer.headers('POST', '/api/v1/order', body, EXPIRES)['api-signature'] == expected
+
+
+def test_expires_defaults_to_soon():
+    signer = RequestSigner(API_KEY, API_SECRET, BASE_URL)
+    expires = int(signer.headers('GET', '/api/v1/position')['api-expires'])
+    assert 0 < expires - time.time() <= 6
+
+
+def main():
+    for test in (test_urls, test_matches_reference, test_scheme, test_expires_defaults_to_soon):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import json
+import sys
+import threading
+
+from market_maker.ws.replay import ReplayWebsocket
+
+###
+# snapshot-test.py
+#
+# Checks that BitMEXWebsocket.snapshot() never returns a half-applied message. A writer thread feeds
+# book and order updates through handle_message(), each changing every row it touches to the same
+# value, while the main thread takes snapshots: every snapshot has to match exactly what its sequence
+# number says was applied. Snapshots must also stay as they were once later messages arrive.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/snapshot-test.py
+###
+
+SYMBOL = 'XBTUSD'
+LEVELS = 25
+ORDERS = 6
+UPDATES = 5000
+
+
+def frame(table, action, data, keys=None):
+    message = {'table': table, 'action': action, 'data': data}
+    if keys:
+        message['keys'] = keys
+    return json.dumps(message)
+
+
+def level(i, side, size=None):
+    price = 1000.0 - i * 0.5 if side == 'Buy' else 1001.0 + i * 0.5
+    row = {'symbol': SYMBOL, 'id': 8800000000 + int(price * 2), 'side': side}
+    if size is None:
+        row['price'] = price
+    else:
+        row['size'] = size
+    return row
+
+
+def book_update(size):
+    return frame('orderBookL2_25', 'update',
+                 [level(i, side, size) for side in ('Buy', 'Sell') for i in range(LEVELS)])
+
+
+def order_update(leavesQty):
+    return frame('order', 'update', [{'orderID': str(i), 'symbol': SYMBOL, 'leavesQty': leavesQty} for i in range(ORDERS)])
+
+
+def connected():
+    """A websocket with the instrument, order and book partials applied."""
+    ws = ReplayWebsocket([])
+    ws.symbol = SYMBOL
+    ws.handle_message(frame('instrument', 'partial', [{'symbol': SYMBOL, 'tickSize': 0.5}], ['symbol']))
+    ws.handle_message(frame('order', 'partial', [
+        {'orderID': str(i), 'clOrdID': 'mm_%d' % i, 'symbol': SYMBOL, 'side': 'Buy', 'price': 900.0 - i,
+         'orderQty': 100000, 'leavesQty': 1, 'cumQty': 0, 'ordStatus': 'New'} for i in range(ORDERS)], ['orderID']))
+    ws.handle_message(frame('orderBookL2_25', 'partial',
+                            [dict(level(i, side), size=0) for side in ('Buy', 'Sell') for i in range(LEVELS)],
+                            ['symbol', 'id', 'side']))
+    return ws
+
+
+def test_snapshots_are_consistent():
+    ws = connected()
+    base = ws.seq
+
+    def write():
+        # Book update k, then order update k: after n messages the book is at (n + 1) // 2, orders at n // 2 + 1.
+        for k in range(1, UPDATES + 1):
+            ws.handle_message(book_update(k))
+            ws.handle_message(order_update(k + 1))
+
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Switch threads as often as possible, to catch the reader mid-message.
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        last, taken = base, 0
+        while writer.is_alive() or taken == 0:
+            snap = ws.snapshot(SYMBOL)
+            assert snap.seq % 2 == 0 and snap.seq >= last, (snap.seq, last)
+            applied = (snap.seq - base) // 2
+            assert [size for _, size in snap.bids] == [(applied + 1) // 2] * LEVELS, snap
+            assert [size for _, size in snap.asks] == [(applied + 1) // 2] * LEVELS, snap
+            assert [o['leavesQty'] for o in snap.open_orders('mm_')] == [applied // 2 + 1] * ORDERS, snap
+            last, taken = snap.seq, taken + 1
+    finally:
+        sys.setswitchinterval(switch)
+        writer.join()
+
+    snap = ws.snapshot(SYMBOL)
+    assert snap.seq == base + 4 * UPDATES
+    assert snap.best_bid() == (1000.0, UPDATES) and snap.best_ask() == (1001.0, UPDATES)
+
+
+def test_snapshots_dont_change():
+    ws = connected()
+    ws.handle_message(book_update(5))
+    ws.handle_message(order_update(5))
+    snap = ws.snapshot(SYMBOL)
+    ws.handle_message(book_update(7))
+    ws.handle_message(order_update(7))
+    ws.handle_message(frame('orderBookL2_25', 'delete', [level(0, 'Buy')]))
+    assert snap.best_bid() == (1000.0, 5) and len(snap.bids) == LEVELS
+    assert [o['leavesQty'] for o in snap.orders] == [5] * ORDERS
+    assert ws.snapshot(SYMBOL).best_bid() == (999.5, 7)
+
+
+def main():
+    for test in (test_snapshots_are_consistent, test_snapshots_dont_change):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import time
+
+from market_maker.bitmex import BitMEX
+from market_maker.settings import settings
+from market_maker.stub.server import StubServer
+
+###
+# stub-load-test.py
+#
+# Runs BitMEX end to end against a local stub server (market_maker.stub) and reports REST
+# throughput and latency for the create / amend / cancel cycle the market maker runs every tick.
+# Faults (latency, jitter, 503s, rate limiting, an outage) can be switched on to see how the
+# connector copes and how long it takes to recover.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/stub-load-test.py [--cycles 200] [--pairs 6]
+#     [--latency 0.01] [--jitter 0.005] [--error-rate 0.05] [--rate-limit 300] [--outage 5]
+#
+# The stub can also be run on its own, e.g. for OrderManager with BASE_URL = "http://localhost:3000/api/v1/":
+#     PYTHONPATH=. python -m market_maker.stub --port 3000 --latency 0.02
+###
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] * 1000
+
+
+def until_ok(fn, *args):
+    """Call fn until it succeeds. POSTs and PUTs aren't retried by BitMEX itself, so 503s surface here."""
+    failures = 0
+    while True:
+        try:
+            return fn(*args), failures
+        except Exception as e:
+            failures += 1
+            print("Request failed (%s), retrying." % e)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cycles', type=int, default=200)
+    parser.add_argument('--pairs', type=int, default=6, help='Buy/sell order pairs per cycle')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=None)
+    parser.add_argument('--outage', type=float, default=0.0, help='Seconds of 503s halfway through')
+    args = parser.parse_args()
+
+    server = StubServer(port=0, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        rate_limit=args.rate_limit, seed=1).start()
+    settings.API_KEY = settings.API_KEY or 'stub'
+    bitmex = BitMEX(base_url=server.base_url, symbol='XBTUSD', apiKey=settings.API_KEY, apiSecret='stub',
+                    orderIDPrefix='load_')
+    tick = bitmex.instrument('XBTUSD')['tickSize']
+
+    timings = {'create': [], 'amend': [], 'cancel': []}
+    failures = 0
+    outage_at = args.cycles // 2 if args.outage else None
+    recovery = None
+    start = time.time()
+    for cycle in range(args.cycles):
+        if cycle == outage_at:
+            server.outage(args.outage)
+            outage_start = time.time()
+        mid = bitmex.ticker_data()['mid']
+        orders = []
+        for i in range(1, args.pairs + 1):
+            orders.append({'side': 'Buy', 'orderQty': 100 * i, 'price': mid - (i + 5) * tick})
+            orders.append({'side': 'Sell', 'orderQty': 100 * i, 'price': mid + (i + 5) * tick})
+
+        t = time.time()
+        created, failed = until_ok(bitmex.create_bulk_orders, orders)
+        failures += failed
+        timings['create'].append(time.time() - t)
+        if cycle == outage_at:
+            recovery = time.time() - outage_start
+
+        t = time.time()
+        try:
+            # Not retried: an order may have filled in the meantime, and it's canceled next anyway.
+            bitmex.amend_bulk_orders([{'orderID': o['orderID'], 'orderQty': o['orderQty'] + 100}
+                                      for o in created if o['ordStatus'] == 'New'])
+        except Exception as e:
+            failures += 1
+            print("Amend failed (%s)." % e)
+        timings['amend'].append(time.time() - t)
+
+        t = time.time()
+        _, failed = until_ok(bitmex.cancel, [o['orderID'] for o in created])
+        failures += failed
+        timings['cancel'].append(time.time() - t)
+    elapsed = time.time() - start
+
+    print("%d cycles of %d orders in %.2fs: %.1f cycles/s, %.0f orders/s" % (
+        args.cycles, args.pairs * 2, elapsed, args.cycles / elapsed, args.cycles * args.pairs * 2 / elapsed))
+    for name, values in timings.items():
+        print("%-8s p50 %7.2fms  p99 %7.2fms  max %7.2fms" % (
+            name, percentile(values, 0.5), percentile(values, 0.99), max(values) * 1000))
+    if recovery is not None:
+        print("Recovered from a %.1fs outage after %.2fs" % (args.outage, recovery))
+    print("%d requests served, %d failed" % (server.requests, failures))
+
+    bitmex.exit()
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import random
+import time
+from decimal import Decimal
+
+from market_maker.utils import math
+
+###
+# tick-math-benchmark.py
+#
+# Compares rounding prices to the tick the old way (toNearest through Decimal(str(tickSize))) with
+# the integer tick path now used by the quoting loop, and checks both give identical prices.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/tick-math-benchmark.py
+###
+
+TICK_SIZES = [0.5, 0.01, 0.05, 0.0001, 1e-08, 1]
+INTERVAL = 0.005
+ORDER_PAIRS = 6
+
+
+def old_toNearest(num, tickSize):
+    tickDec = Decimal(str(tickSize))
+    return float((Decimal(round(num / tickSize, 0)) * tickDec))
+
+
+def old_ladder(start_buy, start_sell, tickSize):
+    prices = []
+    for i in range(1, ORDER_PAIRS + 1):
+        prices.append(old_toNearest(start_buy * (1 + INTERVAL) ** -i, tickSize))
+        prices.append(old_toNearest(start_sell * (1 + INTERVAL) ** i, tickSize))
+    return prices
+
+
+def new_ladder(start_buy, start_sell, tickSize, tickUnits, tickScale):
+    buy_ticks = math.toTicks(start_buy, tickSize)
+    sell_ticks = math.toTicks(start_sell, tickSize)
+    prices = []
+    for i in range(1, ORDER_PAIRS + 1):
+        prices.append(math.fromTicks(int(round(buy_ticks * (1 + INTERVAL) ** -i)), tickUnits, tickScale))
+        prices.append(math.fromTicks(int(round(sell_ticks * (1 + INTERVAL) ** i)), tickUnits, tickScale))
+    return prices
+
+
+def bench(name, fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(*a)
+    elapsed = time.perf_counter() - start
+    print("%-32s %8.3f us/call" % (name, elapsed / len(args) * 1e6))
+    return elapsed
+
+
+def main():
+    rnd = random.Random(1)
+    count = 200000
+
+    # Rounding single prices must match the old implementation exactly.
+    for tickSize in TICK_SIZES:
+        for _ in range(20000):
+            num = rnd.uniform(0, 100000) * tickSize * 10
+            assert math.toNearest(num, tickSize) == old_toNearest(num, tickSize), (num, tickSize)
+    print("toNearest matches the Decimal implementation on %d prices" % (20000 * len(TICK_SIZES)))
+
+    args = [(rnd.uniform(100, 100000), rnd.choice(TICK_SIZES)) for _ in range(count)]
+    old = bench("toNearest (Decimal)", old_toNearest, args)
+    new = bench("toNearest (integer ticks)", math.toNearest, args)
+    units = {t: math.tickParams(t) for t in TICK_SIZES}
+    ticks = bench("toTicks + fromTicks", lambda n, t: math.fromTicks(math.toTicks(n, t), *units[t]), args)
+    print("%-32s %8.2fx / %.2fx" % ('speedup', old / new, old / ticks))
+
+    ladders = [(p, p * 1.001, 0.5) for p, _ in args[:count // 10]]
+    old = bench("%d-pair ladder (Decimal)" % ORDER_PAIRS, old_ladder, ladders)
+    new = bench("%d-pair ladder (integer ticks)" % ORDER_PAIRS,
+                lambda b, s, t: new_ladder(b, s, t, *units[t]), ladders)
+    print("%-32s %8.2fx" % ('speedup', old / new))
+
+
+if __name__ == "__main__":
+    main()
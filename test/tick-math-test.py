@@ -0,0 +1,83 @@
+import random
+from decimal import Decimal
+
+from market_maker.utils import math
+
+###
+# tick-math-test.py
+#
+# Checks the whole-tick price arithmetic in utils/math.py: tick counts and prices round-trip exactly,
+# prices come back without float noise, and both agree with rounding through Decimal as toNearest
+# used to.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/tick-math-test.py
+###
+
+TICK_SIZES = [0.5, 0.01, 0.05, 0.0001, 0.00000001, 1, 2.5, 25]
+ROUNDS = 20000
+
+
+def decimal_toNearest(num, tickSize):
+    tickDec = Decimal(str(tickSize))
+    return float((Decimal(round(num / tickSize, 0)) * tickDec))
+
+
+def decimals(price):
+    text = repr(price)
+    if 'e-' in text:
+        mantissa, exponent = text.split('e-')
+        return len(mantissa.partition('.')[2].rstrip('0')) + int(exponent)
+    return len(text.partition('.')[2].rstrip('0'))
+
+
+def test_tick_params():
+    assert math.tickParams(0.5) == (5, 10)
+    assert math.tickParams(0.01) == (1, 100)
+    assert math.tickParams(0.00000001) == (1, 100000000)
+    assert math.tickParams(1) == (1, 1)
+    assert math.tickParams(25) == (25, 1)
+    for tickSize in TICK_SIZES:
+        tickUnits, tickScale = math.tickParams(tickSize)
+        assert Decimal(tickUnits) / Decimal(tickScale) == Decimal(str(tickSize)), tickSize
+
+
+def test_ticks_round_trip():
+    rng = random.Random(1)
+    for tickSize in TICK_SIZES:
+        tickUnits, tickScale = math.tickParams(tickSize)
+        tickLog = len(str(tickScale)) - 1
+        for _ in range(ROUNDS):
+            ticks = rng.randint(1, 10 ** 9)
+            price = math.fromTicks(ticks, tickUnits, tickScale)
+            assert math.toTicks(price, tickSize) == ticks, (tickSize, ticks)
+            # No float noise past the tick's decimal places.
+            assert decimals(price) <= tickLog, (tickSize, ticks, price)
+
+
+def test_prices_round_trip():
+    rng = random.Random(2)
+    for tickSize in TICK_SIZES:
+        tickUnits, tickScale = math.tickParams(tickSize)
+        for _ in range(ROUNDS):
+            price = rng.uniform(1, 100000) if tickSize >= 0.0001 else rng.uniform(0.00001, 1)
+            rounded = math.fromTicks(math.toTicks(price, tickSize), tickUnits, tickScale)
+            assert rounded == decimal_toNearest(price, tickSize), (tickSize, price)
+            assert math.toNearest(price, tickSize) == rounded, (tickSize, price)
+            # Rounding is idempotent.
+            assert math.fromTicks(math.toTicks(rounded, tickSize), tickUnits, tickScale) == rounded
+
+
+def test_examples():
+    assert math.toNearest(401.46000000000004, 0.01) == 401.46
+    assert math.fromTicks(80293, 5, 10) == 40146.5
+    assert math.toTicks(40146.7, 0.5) == 80293
+
+
+def main():
+    for test in (test_tick_params, test_ticks_round_trip, test_prices_round_trip, test_examples):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import json
+import logging
+import random
+import sys
+import time
+
+from market_maker.utils import fastjson
+
+###
+# ws-decode-benchmark.py
+#
+# Measures websocket frames decoded per second: the old path (stdlib json.loads plus eager
+# json.dumps / '%s' formatting for DEBUG lines that are then thrown away) against the new one
+# (fastest installed decoder, lazy log arguments).
+#
+# Usage (from the repo root): PYTHONPATH=. python test/ws-decode-benchmark.py [frames.txt]
+# frames.txt holds one raw websocket frame per line. Without it, a synthetic orderBookL2_25 /
+# trade / quote mix is generated.
+###
+
+logger = logging.getLogger('ws-decode-benchmark')
+logger.setLevel(logging.INFO)  # DEBUG disabled, as in production
+
+
+def synthetic_frames(count=50000):
+    frames = []
+    price = 9000.0
+    for i in range(count):
+        kind = random.random()
+        if kind < 0.8:
+            rows = [{'symbol': 'XBTUSD', 'id': 8799100000 - random.randint(0, 50) * 50,
+                     'side': random.choice(['Buy', 'Sell']), 'size': random.randint(1, 500000)}
+                    for _ in range(random.randint(1, 4))]
+            frame = {'table': 'orderBookL2_25', 'action': 'update', 'data': rows}
+        elif kind < 0.9:
+            frame = {'table': 'trade', 'action': 'insert', 'data': [{
+                'timestamp': '2019-06-01T00:00:00.000Z', 'symbol': 'XBTUSD', 'side': 'Buy', 'size': 100,
+                'price': price, 'tickDirection': 'ZeroPlusTick', 'trdMatchID': '%032x' % i,
+                'grossValue': 1111100, 'homeNotional': 0.011111, 'foreignNotional': 100}]}
+        else:
+            frame = {'table': 'quote', 'action': 'insert', 'data': [{
+                'timestamp': '2019-06-01T00:00:00.000Z', 'symbol': 'XBTUSD', 'bidSize': 1000,
+                'bidPrice': price - 0.5, 'askPrice': price, 'askSize': 2000}]}
+        frames.append(json.dumps(frame))
+    return frames
+
+
+def old_path(frame):
+    message = json.loads(frame)
+    logger.debug(json.dumps(message))
+    if 'data' in message:
+        logger.debug('%s: updating %s' % (message['table'], message['data']))
+    return message
+
+
+def make_new_path(decode):
+    def new_path(frame):
+        logger.debug('%s', frame)
+        message = decode(frame)
+        if 'data' in message:
+            logger.debug('%s: updating %s', message['table'], message['data'])
+        return message
+    return new_path
+
+
+def bench(name, fn, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        fn(frame)
+    elapsed = time.perf_counter() - start
+    rate = len(frames) / elapsed
+    print("%-32s %10.0f msgs/s" % (name, rate))
+    return rate
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            frames = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        frames = synthetic_frames()
+    print("%d frames" % len(frames))
+
+    baseline = bench("json.loads + eager debug", old_path, frames)
+    for name in fastjson.BACKENDS:
+        try:
+            decode = fastjson.get_decoder(name)
+        except ImportError:
+            print("%-32s not installed" % name)
+            continue
+        rate = bench("%s + lazy debug" % name, make_new_path(decode), frames)
+        print("%-32s %10.2fx" % ('', rate / baseline))
+
+
+if __name__ == "__main__":
+    main()
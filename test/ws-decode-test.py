@@ -0,0 +1,105 @@
+import importlib
+import json
+import logging
+
+from market_maker.utils import fastjson
+from market_maker.ws.replay import ReplayWebsocket
+
+###
+# ws-decode-test.py
+#
+# Checks frame decoding (utils/fastjson.py): every installed JSON backend decodes BitMEX frames to
+# exactly what the stdlib does, the fastest installed one is picked by default, and the websocket
+# decodes through the decoder it's given without formatting frames for debug lines nobody logs.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/ws-decode-test.py
+###
+
+FRAMES = [
+    '{"info":"Welcome to the BitMEX Realtime API.","version":"2.0.0","timestamp":"2024-01-01T00:00:00.000Z"}',
+    '{"success":true,"subscribe":"orderBookL2_25:XBTUSD","request":{"op":"subscribe","args":["orderBookL2_25:XBTUSD"]}}',
+    '{"table":"orderBookL2_25","action":"update","data":[{"symbol":"XBTUSD","id":8799599950,"side":"Sell",'
+    '"size":1234567890123}]}',
+    '{"table":"trade","action":"insert","data":[{"timestamp":"2024-01-01T00:00:00.123Z","symbol":"XBTUSD",'
+    '"side":"Buy","size":100,"price":40146.5,"tickDirection":"PlusTick","grossValue":249088,"homeNotional":0.00249088,'
+    '"foreignNotional":null}]}',
+    '{"table":"instrument","action":"update","data":[{"symbol":"XBTUSD","markPrice":0.1,"fundingRate":-1e-05,'
+    '"note":"Perp\\u00e9tuel €","isInverse":true}]}',
+]
+
+
+def installed():
+    backends = []
+    for name in fastjson.BACKENDS:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        backends.append(name)
+    return backends
+
+
+def test_backends_agree():
+    for name in installed():
+        decode = fastjson.get_decoder(name)
+        for frame in FRAMES:
+            assert decode(frame) == json.loads(frame), (name, frame)
+            assert decode(frame.encode('utf8')) == json.loads(frame), (name, frame)
+
+
+def test_default_is_fastest_installed():
+    assert fastjson.load_backend().__name__ == installed()[0]
+    assert fastjson.load_backend('json') is json
+    try:
+        fastjson.load_backend('no_such_json')
+    except ImportError:
+        pass
+    else:
+        raise AssertionError("Expected an ImportError for a backend that isn't installed")
+
+
+class Frame(object):
+
+    """A frame that counts how often it's formatted."""
+
+    def __init__(self, text):
+        self.text = text
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return self.text
+
+
+def test_websocket_decodes_lazily():
+    decoded = []
+
+    def decode(frame):
+        decoded.append(frame)
+        return json.loads(frame.text)
+
+    ws = ReplayWebsocket([], decoder=decode)
+    logger = logging.getLogger('root')
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    try:
+        frames = [Frame('{"table":"instrument","action":"partial","keys":["symbol"],'
+                        '"data":[{"symbol":"XBTUSD","tickSize":0.5}]}'),
+                  Frame(FRAMES[4])]
+        for frame in frames:
+            ws.handle_message(frame)
+    finally:
+        logger.setLevel(level)
+    assert decoded == frames
+    assert [frame.formatted for frame in frames] == [0, 0]
+    assert ws.get_instrument('XBTUSD')['markPrice'] == 0.1
+
+
+def main():
+    for test in (test_backends_agree, test_default_is_fastest_installed, test_websocket_decodes_lazily):
+        test()
+        print("%s: ok" % test.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import sys
+import time
+
+from market_maker.market_maker import ExchangeInterface, OrderManager, make_connector
+from market_maker.settings import settings
+from market_maker.ws.replay import ReplayWebsocket, run_strategy
+
+###
+# ws-replay-benchmark.py
+#
+# Replays a capture (see CAPTURE_DIR in settings) through BitMEXWebsocket as fast as possible and
+# reports frames applied per second. With --strategy, the OrderManager is ticked every LOOP_INTERVAL
+# seconds of capture time in dry run mode, so the whole quoting loop is measured, deterministically.
+#
+# Usage (from the repo root): PYTHONPATH=. python test/ws-replay-benchmark.py <capture> [symbol] [--strategy]
+###
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if not args:
+        print("Usage: ws-replay-benchmark.py <capture file or dir> [symbol] [--strategy]")
+        sys.exit(1)
+    path = args[0]
+    symbol = args[1] if len(args) > 1 else settings.SYMBOL
+
+    ws = ReplayWebsocket(path)
+    start = time.perf_counter()
+    ws.connect(symbol=symbol)
+    if '--strategy' in sys.argv:
+        exchange = ExchangeInterface(dry_run=True, symbol=symbol, connector=make_connector(symbol, ws=ws))
+        ticks = run_strategy(OrderManager(exchange), ws)
+        print("%d strategy ticks" % ticks)
+    else:
+        ws.replay()
+    elapsed = time.perf_counter() - start
+
+    print("%d frames in %.2fs: %10.0f msgs/s" % (ws.count, elapsed, ws.count / elapsed))
+
+
+if __name__ == "__main__":
+    main()